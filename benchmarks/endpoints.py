@@ -0,0 +1,260 @@
+"""Latency and throughput of the main endpoints on a seeded corpus.
+
+Usage:
+    $ source env.sh
+    $ biaoqingbao seed --users 1 --images 100000 --blobs 500
+    $ python benchmarks/endpoints.py --user-id 1 --output release-a.json
+    $ python benchmarks/endpoints.py --user-id 1 --baseline release-a.json
+
+Requests go through the Flask test client in this process against DATABASE_URI,
+so network and WSGI server overhead are excluded (see benchmarks/serving.py for
+those). Every scenario picks its parameters from a seeded random generator, so
+two runs on the same corpus issue the same requests. The JSON report contains
+the corpus size, relevant configs and per-scenario latency percentiles; with
+--baseline it also contains the p50/p99 ratio to a previous report.
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+from biaoqingbao import Group, Image, Tag, __version__, create_app, db, generate_token
+
+
+class Context:
+    def __init__(self, app, user_id: int, seed: int):
+        self.rnd = random.Random(seed)
+        with app.app_context():
+            self.image_ids = [
+                id
+                for id, in db.session.query(Image.id)
+                .filter_by(user_id=user_id)
+                .order_by(Image.id)
+            ]
+            self.group_ids = [
+                id
+                for id, in db.session.query(Group.id)
+                .filter_by(user_id=user_id)
+                .order_by(Group.id)
+            ]
+            # 按使用次数排序的标签
+            self.tags = [
+                text
+                for text, in db.session.query(Tag.text)
+                .filter_by(user_id=user_id)
+                .group_by(Tag.text)
+                .order_by(db.func.count().desc(), Tag.text)
+                .limit(50)
+            ]
+            self.deleted = Image.query.filter_by(
+                user_id=user_id, is_deleted=True
+            ).count()
+            self.tag_number = Tag.query.filter_by(user_id=user_id).count()
+        if not self.image_ids:
+            raise SystemExit(f"user {user_id} has no images, run `biaoqingbao seed`")
+
+    def image_id(self):
+        return self.rnd.choice(self.image_ids)
+
+    def group_id(self):
+        return self.rnd.choice(self.group_ids)
+
+    def tag(self, top: int = 10):
+        return quote(self.rnd.choice(self.tags[:top]))
+
+
+def get(client, url):
+    resp = client.get(url)
+    # 读完流式响应（图片内容、导出）
+    resp.get_data()
+    if resp.status_code not in (200, 302, 304):
+        raise RuntimeError(f"{url}: {resp.status_code}")
+    return resp
+
+
+def cursor_walk(client, ctx, pages=10):
+    cursor = ""
+    for _ in range(pages):
+        data = get(client, f"/api/images/?cursor={cursor}").get_json()
+        cursor = data["pagination"]["next_cursor"]
+        if cursor is None:
+            break
+
+
+SCENARIOS = {
+    "images_first_page": lambda c, ctx: get(c, "/api/images/"),
+    "images_deep_page": lambda c, ctx: get(
+        c, f"/api/images/?page={len(ctx.image_ids) // 40}"
+    ),
+    "images_cursor_walk_10": cursor_walk,
+    "images_with_total": lambda c, ctx: get(c, "/api/images/?cursor=&with_total=1"),
+    "images_group": lambda c, ctx: get(c, f"/api/images/?groupId={ctx.group_id()}"),
+    "images_recycle_bin": lambda c, ctx: get(c, "/api/images/?groupId=-1"),
+    "tag_search": lambda c, ctx: get(c, f"/api/images/?tag={ctx.tag()}"),
+    "tag_search_and": lambda c, ctx: get(
+        c, f"/api/images/?tag={ctx.tag()}&tag={ctx.tag(50)}"
+    ),
+    "tag_search_facets": lambda c, ctx: get(
+        c, f"/api/images/?tag={ctx.tag()}&exclude_tag={ctx.tag(50)}&facets=1"
+    ),
+    "show_groups": lambda c, ctx: get(c, "/api/groups/"),
+    "show_tags_of_image": lambda c, ctx: get(
+        c, f"/api/tags/?image_id={ctx.image_id()}"
+    ),
+    "show_image": lambda c, ctx: get(c, f"/api/images/{ctx.image_id()}"),
+    "export_group": lambda c, ctx: get(
+        c, f"/api/images/export?group_id={ctx.group_id()}"
+    ),
+}
+
+# 耗时较长的场景，重复次数为 --repeat 的 1/10
+SLOW_SCENARIOS = {"export_group", "images_cursor_walk_10"}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(app, token, ctx, fn, repeat, concurrency):
+    def new_client():
+        client = app.test_client()
+        client.set_cookie("localhost", "token", token)
+        return client
+
+    # 预热：建立连接、标签索引等
+    fn(new_client(), ctx)
+
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(repeat))
+
+    def worker():
+        client = new_client()
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            start = time.perf_counter()
+            fn(client, ctx)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": ms(sum(latencies) / len(latencies)),
+        "p50_ms": ms(percentile(latencies, 0.5)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(max(latencies)),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(scenarios, baseline):
+    diff = {}
+    for name, result in scenarios.items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        diff[name] = {
+            key: round(result[key] / old[key], 2) if old[key] else None
+            for key in ("p50_ms", "p99_ms", "rps")
+        }
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--scenario", action="append", choices=sorted(SCENARIOS), help="Repeatable."
+    )
+    parser.add_argument("--baseline", help="Previous report to compare with.")
+    parser.add_argument("--output", help="Write the report here instead of stdout.")
+    args = parser.parse_args()
+
+    app = create_app()
+    token = generate_token({"user_id": args.user_id})
+    ctx = Context(app, args.user_id, args.seed)
+
+    scenarios = {}
+    for name in args.scenario or SCENARIOS:
+        repeat = args.repeat
+        if name in SLOW_SCENARIOS:
+            repeat = max(1, repeat // 10)
+        scenarios[name] = measure(
+            app, token, ctx, SCENARIOS[name], repeat, args.concurrency
+        )
+        print(name, json.dumps(scenarios[name]), file=sys.stderr)
+
+    report = {
+        "version": __version__,
+        "git_revision": git_revision(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "configs": {
+            key: app.config[key]
+            for key in (
+                "BLOB_STORAGE",
+                "IMAGE_COUNTERS",
+                "TAG_SEARCH",
+                "DATABASE_PROFILE",
+                "RESPONSE_CACHE",
+            )
+        },
+        "corpus": {
+            "images": len(ctx.image_ids),
+            "deleted_images": ctx.deleted,
+            "groups": len(ctx.group_ids),
+            "tags": ctx.tag_number,
+        },
+        "repeat": args.repeat,
+        "concurrency": args.concurrency,
+        "scenarios": scenarios,
+    }
+    if args.baseline:
+        with open(args.baseline) as fh:
+            report["baseline"] = compare(scenarios, json.load(fh))
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
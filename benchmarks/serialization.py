@@ -0,0 +1,153 @@
+"""Per-item cost of the image list at 20, 200 and 2000 items per page.
+
+Usage:
+    $ source env.sh
+    $ biaoqingbao seed --users 1 --images 10000 --blobs 10
+    $ python benchmarks/serialization.py --user-id 1
+
+Stages, each reported as median microseconds per item:
+- query: the legacy ORM path (Image instances with joined group and tags, then
+  dicts built from attributes) vs. views.main.image_list_columns rows (no
+  identity map) plus serialize_image_rows, which loads the page's tags in one
+  more statement.
+- dumps: the same payload through Flask's DefaultJSONProvider vs. OrjsonProvider.
+- endpoint: GET /api/images/?cursor=&per_page=N through the test client with the
+  response cache disabled, once per JSON provider.
+"""
+import argparse
+import json
+import statistics
+import time
+from unittest import mock
+
+from flask.json.provider import DefaultJSONProvider
+
+from biaoqingbao import Image, create_app, db, generate_token
+from biaoqingbao.configs import configs
+from biaoqingbao.jsonprovider import OrjsonProvider, orjson
+from biaoqingbao.views.main import (
+    image_list_columns,
+    image_order,
+    serialize_image_rows,
+)
+
+PAGE_SIZES = (20, 200, 2000)
+
+
+def per_item_us(fn, items: int, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return round(statistics.median(samples) / items * 1e6, 2)
+
+
+def orm_page(user_id: int, n: int):
+    records = (
+        Image.query.filter_by(user_id=user_id, is_deleted=False)
+        .order_by(*image_order(False))
+        .limit(n)
+        .all()
+    )
+    data = [
+        {
+            "id": record.id,
+            "url": f"/api/images/{record.id}",
+            "thumbnail_url": f"/api/images/{record.id}/thumbnail",
+            "type": record.type,
+            "tags": [{"id": t.id, "text": t.text} for t in record.tags],
+            "group_id": record.group_id,
+            "is_deleted": record.is_deleted,
+        }
+        for record in records
+    ]
+    # 与 view 中相同，每个请求一个新的 session
+    db.session.remove()
+    return data
+
+
+def row_page(user_id: int, n: int):
+    rows = (
+        Image.query.filter_by(user_id=user_id, is_deleted=False)
+        .with_entities(*image_list_columns())
+        .order_by(*image_order(False))
+        .limit(n)
+        .all()
+    )
+    data = serialize_image_rows(rows)
+    db.session.remove()
+    return data
+
+
+def create_bench_app(provider: str):
+    with mock.patch.multiple(configs, JSON_PROVIDER=provider, RESPONSE_CACHE="none"):
+        return create_app()
+
+
+def bench(user_id: int, repeat: int) -> dict:
+    app = create_bench_app("stdlib")
+    stdlib = DefaultJSONProvider(app)
+    fast = OrjsonProvider(app) if orjson is not None else None
+    apps = {"stdlib": app}
+    if fast is not None:
+        apps["orjson"] = create_bench_app("orjson")
+
+    report = {}
+    for n in PAGE_SIZES:
+        with app.app_context():
+            payload = {"data": row_page(user_id, n)}
+            items = len(payload["data"])
+            if items < n:
+                raise SystemExit(f"user {user_id} has {items} images, need {n}")
+            legacy = orm_page(user_id, n)
+            # joined load 的标签顺序不确定，行查询按 id 排序
+            for item in legacy:
+                item["tags"].sort(key=lambda t: t["id"])
+            if legacy != payload["data"]:
+                raise SystemExit("ORM and row paths returned different data")
+            result = {
+                "query_orm_us": per_item_us(lambda: orm_page(user_id, n), n, repeat),
+                "query_rows_us": per_item_us(lambda: row_page(user_id, n), n, repeat),
+                "dumps_stdlib_us": per_item_us(
+                    lambda: stdlib.dumps(payload), n, repeat
+                ),
+            }
+            if fast is not None:
+                result["dumps_orjson_us"] = per_item_us(
+                    lambda: fast.dumps(payload), n, repeat
+                )
+
+        for name, bench_app in apps.items():
+            client = bench_app.test_client()
+            client.set_cookie(
+                "localhost", "token", generate_token({"user_id": user_id})
+            )
+            url = f"/api/images/?cursor=&per_page={n}"
+
+            def get():
+                resp = client.get(url)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"{url}: {resp.status_code}")
+
+            get()
+            result[f"endpoint_{name}_us"] = per_item_us(get, n, repeat)
+        report[n] = result
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    report = {
+        "orjson": orjson is not None,
+        "pages": bench(args.user_id, args.repeat),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Throughput and p99 latency of `biaoqingbao run` serving profiles.
+
+Usage:
+    $ source env.sh
+    $ python benchmarks/serving.py --clients 32 --duration 20
+    $ python benchmarks/serving.py --server waitress --threads 4,8,16,32
+
+Each candidate (server, workers, threads) is started with `biaoqingbao run` in
+a subprocess and loaded by --clients keep-alive connections with mixed traffic:
+image list JSON (GET /api/images/) and multi-MB image bodies
+(GET /api/images/<id>). The recommended profile is the one with the highest
+throughput whose p99 stays within --p99-factor of the best p99; its values are
+what serving.py uses as defaults. gunicorn candidates are skipped when gunicorn
+is not installed. A benchmark user with --images images is created in
+DATABASE_URI.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from uuid import uuid4
+
+from biaoqingbao import User, create_app, db, generate_token
+from biaoqingbao.models import Image
+from biaoqingbao.serving import BaseApplication
+from biaoqingbao.storage import put_blob
+
+SERVER = """
+from biaoqingbao import cli
+cli(["run", *{args!r}])
+"""
+
+
+def create_user(images: int, max_size: int):
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        user = User(email=f"bench-{uuid4().hex[:8]}@foo.com", password="")
+        rnd = random.Random(0)
+        for _ in range(images):
+            data = os.urandom(rnd.randint(max_size // 10, max_size))
+            user.images.append(Image(hash=put_blob(data), type="jpeg"))
+        db.session.add(user)
+        db.session.commit()
+        return user.id, [image.id for image in user.images]
+
+
+def wait_listening(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def client_loop(port, token, image_ids, json_ratio, stop, results):
+    rnd = random.Random()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    headers = {"Cookie": f"token={token}"}
+    while not stop.is_set():
+        if rnd.random() < json_ratio:
+            kind, url = "json", "/api/images/?per_page=20"
+        else:
+            kind, url = "image", f"/api/images/{rnd.choice(image_ids)}"
+        start = time.perf_counter()
+        try:
+            conn.request("GET", url, headers=headers)
+            resp = conn.getresponse()
+            size = len(resp.read())
+            ok = resp.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            size, ok = 0, False
+        results.append((kind, time.perf_counter() - start, size, ok))
+    conn.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_candidate(candidate, args, token, image_ids):
+    server_args = [
+        "--server",
+        candidate["server"],
+        "--port",
+        str(args.port),
+        "--threads",
+        str(candidate["threads"]),
+    ]
+    if candidate["server"] == "gunicorn":
+        server_args += ["--workers", str(candidate["workers"])]
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER.format(args=server_args)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_listening(args.port)
+        results = []
+        stop = threading.Event()
+        clients = [
+            threading.Thread(
+                target=client_loop,
+                args=(args.port, token, image_ids, args.json_ratio, stop, results),
+            )
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        # 预热后重新计数
+        time.sleep(args.warmup)
+        results.clear()
+        start = time.perf_counter()
+        time.sleep(args.duration)
+        measured = list(results)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for client in clients:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [latency for _, latency, _, ok in measured if ok]
+    report = dict(candidate)
+    report.update(
+        {
+            "requests": len(measured),
+            "failed": sum(1 for *_, ok in measured if not ok),
+            "rps": round(len(latencies) / elapsed, 1),
+            "mb_per_second": round(
+                sum(size for _, _, size, _ in measured) / elapsed / 1024 / 1024, 1
+            ),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        }
+    )
+    for kind in ("json", "image"):
+        kind_latencies = [l for k, l, _, ok in measured if ok and k == kind]
+        if kind_latencies:
+            report[f"{kind}_p99_ms"] = round(percentile(kind_latencies, 0.99) * 1000, 1)
+    return report
+
+
+def candidates(args):
+    for server in args.server:
+        if server == "gunicorn" and BaseApplication is None:
+            print("gunicorn is not installed, skipped.", file=sys.stderr)
+            continue
+        for threads in args.threads:
+            if server == "waitress":
+                yield {"server": server, "workers": 1, "threads": threads}
+            else:
+                for workers in args.workers:
+                    yield {"server": server, "workers": workers, "threads": threads}
+
+
+def recommend(reports, p99_factor):
+    ok = [r for r in reports if not r["failed"]]
+    if not ok:
+        return None
+    best_p99 = min(r["p99_ms"] for r in ok)
+    within = [r for r in ok if r["p99_ms"] <= best_p99 * p99_factor]
+    return max(within, key=lambda r: r["rps"])
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--server", type=lambda v: v.split(","), default=["waitress", "gunicorn"]
+    )
+    parser.add_argument("--threads", type=int_list, default=[4, 8, 16, 32])
+    parser.add_argument("--workers", type=int_list, default=[os.cpu_count() or 1])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--json-ratio", type=float, default=0.7)
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--image-mb", type=float, default=4)
+    parser.add_argument("--p99-factor", type=float, default=1.5)
+    parser.add_argument("--port", type=int, default=5098)
+    args = parser.parse_args()
+
+    user_id, image_ids = create_user(args.images, int(args.image_mb * 1024 * 1024))
+    token = generate_token({"user_id": user_id})
+
+    reports = []
+    for candidate in candidates(args):
+        report = run_candidate(candidate, args, token, image_ids)
+        print(json.dumps(report), file=sys.stderr)
+        reports.append(report)
+
+    print(
+        json.dumps(
+            {
+                "clients": args.clients,
+                "json_ratio": args.json_ratio,
+                "image_mb": args.image_mb,
+                "results": reports,
+                "recommended": recommend(reports, args.p99_factor),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Substring tag search latency at 1M+ tags.
+
+Usage:
+    $ python benchmarks/tag_search.py --tags 1000000
+    $ source env.sh && python benchmarks/tag_search.py --tags 1000000 --postgres
+
+In-process: NgramIndex.search vs a linear scan (what LIKE '%x%' does without
+an index). With --postgres: LIKE '%x%' on a scratch table before and after
+building the pg_trgm GIN index (skipped when pg_trgm is not available).
+"""
+import argparse
+import io
+import json
+import random
+import statistics
+import time
+
+from biaoqingbao.tagsearch import NgramIndex
+
+SYLLABLES = (
+    "猫 狗 熊 兔 哈 嘿 呵 笑 哭 怒 惊 赞 滑稽 doge cat lol ok yes no wow"
+    " happy sad meme gif emoji 表情 斗图 沙雕 可爱 无语 加油 晚安 早安"
+).split()
+
+TERMS = ["猫", "dog", "表情", "happy", "沙雕可爱", "xyz不存在"]
+
+
+def generate_tags(n: int, seed: int = 0):
+    rnd = random.Random(seed)
+    for i in range(1, n + 1):
+        yield i, "".join(rnd.choices(SYLLABLES, k=rnd.randint(1, 3)))
+
+
+def timeit(fn, repeat: int) -> float:
+    """Return: median milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def bench_in_process(tags, repeat: int) -> dict:
+    start = time.perf_counter()
+    index = NgramIndex(tags)
+    build_ms = round((time.perf_counter() - start) * 1000, 1)
+    texts = list(index.texts.items())
+
+    result = {"build_ms": build_ms, "terms": {}}
+    for term in TERMS:
+        result["terms"][term] = {
+            "matches": len(index.search(term)),
+            "scan_ms": timeit(lambda: [i for i, t in texts if term in t], repeat),
+            "ngram_ms": timeit(lambda: index.search(term), repeat),
+        }
+    return result
+
+
+def bench_postgres(tags, repeat: int) -> dict:
+    from biaoqingbao import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DROP TABLE IF EXISTS bench_tag")
+            cursor.execute("CREATE TABLE bench_tag (id integer, text varchar(64))")
+            buffer = io.StringIO("".join(f"{i}\t{t}\n" for i, t in tags))
+            cursor.copy_from(buffer, "bench_tag")
+            cursor.execute("ANALYZE bench_tag")
+
+            def run(term):
+                def query():
+                    cursor.execute(
+                        "SELECT id FROM bench_tag WHERE text LIKE %s", (f"%{term}%",)
+                    )
+                    cursor.fetchall()
+
+                return timeit(query, repeat)
+
+            result = {"terms": {t: {"seq_scan_ms": run(t)} for t in TERMS}}
+            cursor.execute(
+                "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+            )
+            if cursor.fetchone() is None:
+                result["trigram"] = "pg_trgm is not available"
+            else:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                start = time.perf_counter()
+                cursor.execute(
+                    "CREATE INDEX ON bench_tag USING gin (text gin_trgm_ops)"
+                )
+                result["trigram_build_ms"] = round(
+                    (time.perf_counter() - start) * 1000, 1
+                )
+                cursor.execute("ANALYZE bench_tag")
+                for t in TERMS:
+                    result["terms"][t]["trigram_ms"] = run(t)
+            cursor.execute("DROP TABLE bench_tag")
+            conn.commit()
+        finally:
+            conn.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tags", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--postgres", action="store_true")
+    args = parser.parse_args()
+
+    tags = list(generate_tags(args.tags))
+    report = {"tags": args.tags, "in_process": bench_in_process(tags, args.repeat)}
+    if args.postgres:
+        report["postgres"] = bench_postgres(tags, args.repeat)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
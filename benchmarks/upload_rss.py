@@ -0,0 +1,142 @@
+"""Peak RSS of the server process under parallel image uploads.
+
+Usage:
+    $ source env.sh
+    $ python benchmarks/upload_rss.py --parallel 8 --size-mb 10
+
+The server runs in a subprocess (waitress, one thread per parallel upload) with
+the current environment, so set BLOB_STORAGE=local to measure the streaming
+path end to end. A benchmark user is created in DATABASE_URI.
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from biaoqingbao import User, create_app, db, generate_token
+
+SERVER = """
+from waitress import serve
+from biaoqingbao import create_app
+serve(create_app(), host="127.0.0.1", port={port}, threads={threads})
+"""
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as fh:
+        for line in fh:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def create_user() -> int:
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        user = User(email=f"bench-{uuid4().hex[:8]}@foo.com", password="")
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def multipart_body(size: int):
+    boundary = uuid4().hex
+    # 随机内容，避免 blob 去重掩盖写入成本
+    image = os.urandom(size)
+    body = b"".join(
+        [
+            f"--{boundary}\r\n".encode(),
+            b'Content-Disposition: form-data; name="metadata"\r\n\r\n',
+            json.dumps({"type": "jpeg"}).encode(),
+            f"\r\n--{boundary}\r\n".encode(),
+            b'Content-Disposition: form-data; name="image"; filename="a.jpeg"\r\n',
+            b"Content-Type: application/octet-stream\r\n\r\n",
+            image,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ]
+    )
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def upload(port: int, token: str, size: int) -> int:
+    body, content_type = multipart_body(size)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    conn.request(
+        "POST",
+        "/api/images/add",
+        body=body,
+        headers={"Content-Type": content_type, "Cookie": f"token={token}"},
+    )
+    status = conn.getresponse().status
+    conn.close()
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--parallel", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--size-mb", type=float, default=10)
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    token = generate_token({"user_id": create_user()})
+    size = int(args.size_mb * 1024 * 1024)
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            SERVER.format(port=args.port, threads=args.parallel),
+        ]
+    )
+    try:
+        time.sleep(2)
+        baseline = rss_kb(server.pid)
+        peak = baseline
+        done = threading.Event()
+
+        def sample():
+            nonlocal peak
+            while not done.is_set():
+                peak = max(peak, rss_kb(server.pid))
+                time.sleep(0.01)
+
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.parallel) as executor:
+            statuses = list(
+                executor.map(
+                    lambda _: upload(args.port, token, size),
+                    range(args.parallel * args.rounds),
+                )
+            )
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "parallel": args.parallel,
+        "uploads": len(statuses),
+        "upload_mb": args.size_mb,
+        "failed": sum(1 for s in statuses if s != 200),
+        "seconds": round(elapsed, 2),
+        "baseline_rss_mb": round(baseline / 1024, 1),
+        "peak_rss_mb": round(peak / 1024, 1),
+        "peak_rss_per_upload_mb": round((peak - baseline) / 1024 / args.parallel, 2),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -30,6 +30,13 @@ server.shell(
     chdir=repo_dir,
 )
 
+# 新代码启动前数据库须已有新增的表、列和索引
+server.shell(
+    name="Migrate database",
+    commands=[". .venv/bin/activate && . env.sh && biaoqingbao migrate"],
+    chdir=repo_dir,
+)
+
 systemd.service(
     name="Restart biaoqingbao.service",
     service="biaoqingbao",
@@ -38,6 +45,22 @@ systemd.service(
     enabled=True,
 )
 
+files.put(
+    name="Upload biaoqingbao-mail-worker.service",
+    src="biaoqingbao-mail-worker.service",
+    dest="/etc/systemd/system/biaoqingbao-mail-worker.service",
+    mode="644",
+)
+
+systemd.service(
+    name="Restart biaoqingbao-mail-worker.service",
+    service="biaoqingbao-mail-worker",
+    running=True,
+    restarted=True,
+    enabled=True,
+    daemon_reload=True,
+)
+
 server.wait(
     name="Wait for biaoqingbao to start",
     port=5000,
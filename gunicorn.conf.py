@@ -1,5 +1,18 @@
-import multiprocessing
+from biaoqingbao.configs import configs
+from biaoqingbao.engine import pool_capacity
+from biaoqingbao.serving import gunicorn_options, prepare_metrics_dir
+
+# 在创建 app 之前设置 PROMETHEUS_MULTIPROC_DIR
+prepare_metrics_dir()
 
 wsgi_app = "biaoqingbao:create_app()"
-bind = "127.0.0.1:5000"
-workers = multiprocessing.cpu_count() * 2 + 1
+# gthread worker、preload_app、max_requests_jitter 等，同 `biaoqingbao run --server gunicorn`
+globals().update(
+    gunicorn_options(
+        host="127.0.0.1",
+        port=5000,
+        max_threads=pool_capacity(configs),
+        metrics_host=configs.METRICS_HOST,
+        metrics_port=configs.METRICS_PORT,
+    )
+)
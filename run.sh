@@ -1,4 +1,4 @@
 #!/bin/sh
 . .venv/bin/activate
 . env.sh
-exec gunicorn 'biaoqingbao:create_app()'
+exec biaoqingbao run --server gunicorn
@@ -35,8 +35,11 @@ setup(
     python_requires=">=3.6",
     install_requires=["flask", "flask-sqlalchemy", "psycopg2", "waitress", "PyJWT"],
     extras_require={
-        "dev": ["pylint", "rope"],
+        "dev": ["pylint", "rope", "aiosmtpd"],
         "deploy": ["gunicorn"],
+        "thumbnail": ["pillow"],
+        "metrics": ["prometheus-client"],
+        "speedups": ["orjson"],
     },
     entry_points={
         "console_scripts": [
@@ -1,5 +1,20 @@
 from .auth import generate_token
 from .cli import cli
 from .factory import create_app
-from .models import Group, Image, Passcode, ResetAttempt, Tag, User, db
+from .models import (
+    Blob,
+    Group,
+    Image,
+    OutboxEmail,
+    Passcode,
+    PurgeJob,
+    RateLimit,
+    Rendition,
+    ResetAttempt,
+    RevokedToken,
+    SchemaMigration,
+    Tag,
+    User,
+    db,
+)
 from .version import __version__
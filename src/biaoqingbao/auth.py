@@ -1,15 +1,141 @@
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from typing import Optional
+
 import jwt
 
 from .configs import configs
+from .models import RevokedToken, db
+from .querybudget import unbudgeted
+
+
+class TokenRevoked(jwt.InvalidTokenError):
+    pass
+
+
+class TokenCache:
+    """已验证 token 的 LRU 缓存，避免每个请求都重新验证签名。过期的 token 不会命中。"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._tokens = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            claims = self._tokens.get(token)
+            if claims is None:
+                return None
+            elif claims["exp"] <= time.time():
+                del self._tokens[token]
+                return None
+            self._tokens.move_to_end(token)
+            return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._tokens[token] = claims
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tokens.clear()
+
+
+class RevocationList:
+    """已注销 token 的 jti 集合，定期从 revoked_token 表刷新，查询为 O(1)。"""
 
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._jtis = frozenset()
+        self._loaded_at = None
+        self._lock = Lock()
 
-def generate_token(json_data: dict) -> str:
+    def __contains__(self, jti: str) -> bool:
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.refresh_interval:
+            self.refresh()
+        return jti in self._jtis
+
+    def refresh(self) -> None:
+        """需在 app context 中调用。"""
+        with self._lock, unbudgeted():
+            self._jtis = frozenset(
+                jti
+                for jti, in db.session.query(RevokedToken.jti).filter(
+                    RevokedToken.expire_at > datetime.utcnow()
+                )
+            )
+            self._loaded_at = time.monotonic()
+
+    def add(self, jti: str) -> None:
+        with self._lock:
+            self._jtis = self._jtis | {jti}
+
+
+token_cache = TokenCache(configs.TOKEN_CACHE_SIZE)
+revoked_tokens = RevocationList(configs.TOKEN_REVOCATION_REFRESH)
+
+
+def generate_token(json_data: dict, lifetime: Optional[int] = None) -> str:
+    """
+    Params:
+        json_data [dict]: 写入 token 的数据，eg. {"user_id": 1}
+        lifetime [int]: 有效期（秒），默认为 TOKEN_LIFETIME
+    """
+    now = int(time.time())
+    if lifetime is None:
+        lifetime = configs.TOKEN_LIFETIME
     return jwt.encode(
-        json_data,
+        {
+            **json_data,
+            "iat": now,
+            "exp": now + lifetime,
+            "jti": uuid.uuid4().hex,
+        },
         configs.SECRET_KEY,
         algorithm="HS256",
     )
 
 
 def decode_token(token: str) -> dict:
-    return jwt.decode(token, configs.SECRET_KEY, algorithms=["HS256"])
+    """验证 token 并返回其中的数据，需在 app context 中调用。
+
+    token 无效、过期或已注销时抛出 jwt.InvalidTokenError。
+    """
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(
+            token,
+            configs.SECRET_KEY,
+            algorithms=["HS256"],
+            options={"require": ["exp", "iat", "jti"]},
+        )
+        token_cache.put(token, claims)
+    if claims["jti"] in revoked_tokens:
+        raise TokenRevoked(claims["jti"])
+    return claims
+
+
+def revoke_token(token: str) -> None:
+    """注销 token，在调用方的事务中执行。token 无效时不做任何事。"""
+    try:
+        claims = decode_token(token)
+    except jwt.InvalidTokenError:
+        return
+
+    now = datetime.utcnow()
+    RevokedToken.query.filter(RevokedToken.expire_at <= now).delete()
+    db.session.add(
+        RevokedToken(
+            jti=claims["jti"], expire_at=datetime.utcfromtimestamp(claims["exp"])
+        )
+    )
+    revoked_tokens.add(claims["jti"])
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import weakref
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from typing import Callable, Optional
+from uuid import uuid4
+
+from flask import current_app, request
+from sqlalchemy import event
+
+from .metrics import count_cache_result
+from .models import User
+from .versions import get_data_version
+
+CACHE_HEADER = "X-Cache"
+
+# 已创建的缓存，user 表重建（数据版本号从头开始）时清空
+_caches = weakref.WeakSet()
+
+
+class ResponseCache:
+    """响应内容的缓存。key 中含用户的数据版本号，数据修改后旧的 key 不再被读取，
+    无需逐个删除，由淘汰策略清除。"""
+
+    def __init__(self):
+        _caches.add(self)
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryResponseCache(ResponseCache):
+    """LRU，内容总大小超过 max_bytes 时淘汰最久未读取的。只在当前进程内有效。"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+
+class SharedResponseCache(ResponseCache):
+    """存放在共享内存目录中，同一主机上的 worker 进程共用。
+
+    每个 key 一个文件，先写临时文件再 rename，读写不需要加锁。读取时更新文件的修改时间，
+    每写入 PRUNE_INTERVAL 次检查一次目录大小，超过 max_bytes 时删除最久未读取的文件。
+    """
+
+    PRUNE_INTERVAL = 100
+    # 淘汰到 max_bytes 的此比例，避免每次检查都要删除
+    PRUNE_TARGET = 0.8
+
+    def __init__(self, path: str, max_bytes: int):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = Lock()
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.blake2b(key.encode()).hexdigest())
+
+    def get(self, key):
+        path = self._file(key)
+        try:
+            with open(path, "rb") as fh:
+                value = fh.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # 其它进程同时淘汰了此文件
+            return None
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        tmp = os.path.join(self.path, f".{uuid4().hex}")
+        with open(tmp, "wb") as fh:
+            fh.write(value)
+        os.replace(tmp, self._file(key))
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_INTERVAL == 0
+        if prune:
+            self.prune()
+
+    def prune(self) -> None:
+        files = []
+        size = 0
+        for entry in os.scandir(self.path):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            size += stat.st_size
+        if size <= self.max_bytes:
+            return
+        files.sort()
+        for _, file_size, path in files:
+            if size <= self.max_bytes * self.PRUNE_TARGET:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def clear(self):
+        for entry in os.scandir(self.path):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+@event.listens_for(User.__table__, "after_create")
+def clear_caches(target, connection, **kw):
+    for cache in list(_caches):
+        cache.clear()
+
+
+def create_response_cache(configs) -> Optional[ResponseCache]:
+    if configs.RESPONSE_CACHE == "memory":
+        return MemoryResponseCache(configs.RESPONSE_CACHE_MAX_BYTES)
+    elif configs.RESPONSE_CACHE == "shared":
+        return SharedResponseCache(
+            configs.RESPONSE_CACHE_SHM_PATH, configs.RESPONSE_CACHE_MAX_BYTES
+        )
+    else:
+        return None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return current_app.extensions.get("response_cache")
+
+
+def cached_response(condition: Optional[Callable[[], bool]] = None):
+    """只读 view 的装饰器，按用户、数据版本号及请求的路径和参数缓存 200 的 JSON 响应。
+
+    修改用户数据的请求须在同一事务中调用 bump_data_version，提交后缓存即失效。
+    放在 read_replica 之下，数据版本号与数据从同一个库读取。
+
+    Params:
+        condition [Callable[[], bool]]: 返回 False 时不使用缓存，eg. 只缓存图片列表首页
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = get_response_cache()
+            if cache is None or (condition is not None and not condition()):
+                return view(*args, **kwargs)
+
+            user_id = request.session["user_id"]
+            key = f"{user_id}:{get_data_version(user_id)}:{request.full_path}"
+            body = cache.get(key)
+            hit = body is not None
+            if hit:
+                resp = current_app.response_class(body, mimetype="application/json")
+            else:
+                resp = current_app.make_response(view(*args, **kwargs))
+                if resp.status_code == 200 and resp.is_json and not resp.is_streamed:
+                    cache.set(key, resp.get_data())
+            count_cache_result(request.endpoint, hit)
+            resp.headers[CACHE_HEADER] = "hit" if hit else "miss"
+            return resp
+
+        return wrapper
+
+    return decorator
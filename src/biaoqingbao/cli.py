@@ -1,8 +1,21 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import List
+
 import click
-from waitress import serve
 
+from . import migrations, renditions, serving
+from .configs import configs
+from .counters import reconcile_image_counters
+from .engine import pool_capacity
 from .factory import create_app
-from .models import db
+from .models import Image, Passcode, PurgeJob, Rendition, ResetAttempt, db
+from .purge import purge_expired, run_purge_job
+from .ratelimit import purge_expired_rate_limits
+from .seed import seed_corpus
+from .services import run_mail_worker
+from .storage import put_blob
 from .version import __version__
 
 
@@ -12,12 +25,46 @@ def cli():
     """biaoqingbao cli."""
 
 
+def apply_migrations() -> List[migrations.Migration]:
+    """新建缺少的表并执行未执行的迁移，需在 app context 中调用。"""
+    db.create_all()
+    return migrations.upgrade(
+        echo=lambda m: click.echo(f"Applying {m.version} {m.name} ...")
+    )
+
+
 @cli.command()
 def create_table():
-    """Initialize sqlite database file."""
+    """Create database tables."""
     app = create_app()
     with app.app_context():
         db.create_all()
+        migrations.upgrade()
+
+
+@cli.command("migrate")
+@click.option("--to", "target", default=None, type=int, help="Target version.")
+def migrate(target: int):
+    """Create missing tables and apply pending schema migrations."""
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        done = migrations.upgrade(
+            target,
+            echo=lambda m: click.echo(f"Applying {m.version} {m.name} ..."),
+        )
+        click.echo(f"Applied {len(done)} migrations.")
+
+
+@cli.command("show-migrations")
+def show_migrations():
+    """List schema migrations and whether they are applied."""
+    app = create_app()
+    with app.app_context(), db.engine.begin() as conn:
+        applied = set(migrations.applied_versions(conn))
+    for m in migrations.MIGRATIONS:
+        status = "applied" if m.version in applied else "pending"
+        click.echo(f"{m.version} {m.name} {status}")
 
 
 @cli.command()
@@ -29,8 +76,214 @@ def drop_all():
 
 
 @cli.command("run")
+@click.option(
+    "--server",
+    type=click.Choice(["waitress", "gunicorn"]),
+    default="waitress",
+    help="waitress: one process with threads. gunicorn: gthread workers.",
+)
+@click.option("--host", default="127.0.0.1", help="Network host to listen to.")
 @click.option("--port", default=5000, help="Network port to listen to.")
-def run(port: int):
+@click.option("--unix-socket", default=None, help="Listen to a unix socket instead.")
+@click.option("--workers", default=None, type=int, help="gunicorn worker processes.")
+@click.option("--threads", default=None, type=int, help="Threads per process.")
+@click.option("--max-requests", default=1000, help="Restart gunicorn workers after.")
+@click.option("--max-requests-jitter", default=100)
+def run(
+    server: str,
+    host: str,
+    port: int,
+    unix_socket: str,
+    workers: int,
+    threads: int,
+    max_requests: int,
+    max_requests_jitter: int,
+):
     """Run biaoqingbao server."""
+    bind = dict(host=host, port=port, unix_socket=unix_socket, threads=threads)
+    bind.update(max_threads=pool_capacity(configs))
+    bind.update(metrics_host=configs.METRICS_HOST, metrics_port=configs.METRICS_PORT)
+    if server == "waitress":
+        serving.serve_waitress(create_app(), **bind)
+    elif serving.BaseApplication is None:
+        raise click.ClickException("gunicorn is not installed.")
+    else:
+        serving.serve_gunicorn(
+            create_app,
+            workers=workers,
+            max_requests=max_requests,
+            max_requests_jitter=max_requests_jitter,
+            **bind,
+        )
+
+
+@cli.command("migrate-blobs")
+@click.option("--batch-size", default=100, help="Number of images per transaction.")
+def migrate_blobs(batch_size: int):
+    """Move image data out of image table into blob storage."""
+    app = create_app()
+    with app.app_context():
+        # image.hash 等列由迁移添加
+        apply_migrations()
+
+        moved = 0
+        while True:
+            images = (
+                Image.query.filter(Image.hash == None, Image.data != None)
+                .options(db.undefer(Image.data))
+                .order_by(Image.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not images:
+                break
+
+            for image in images:
+                image.hash = put_blob(image.data)
+                image.data = None
+            db.session.commit()
+            moved += len(images)
+            click.echo(f"Moved {moved} images.")
+
+
+@cli.command("backfill-renditions")
+@click.option("--batch-size", default=100, help="Number of images per batch.")
+@click.option("--workers", default=None, type=int, help="Number of processes.")
+def backfill_renditions(batch_size: int, workers: int):
+    """Generate thumbnails for existing images."""
+    if renditions.PIL is None:
+        raise click.ClickException("Pillow is not installed.")
+
+    app = create_app()
+    with app.app_context(), ProcessPoolExecutor(workers) as executor:
+        failed = set()
+        done = 0
+        while True:
+            hashes = [
+                hash
+                for hash, in db.session.query(Image.hash)
+                .outerjoin(
+                    Rendition,
+                    db.and_(
+                        Rendition.source_hash == Image.hash,
+                        Rendition.name == renditions.THUMBNAIL,
+                    ),
+                )
+                .filter(Image.hash != None, Rendition.id == None)
+                .filter(Image.hash.notin_(failed))
+                .distinct()
+                .limit(batch_size)
+            ]
+            if not hashes:
+                break
+
+            futures = {
+                hash: renditions.submit_thumbnail(app, executor, hash)
+                for hash in hashes
+            }
+            for hash, future in futures.items():
+                if future is None:
+                    continue
+                renditions.save_thumbnail(hash, future)
+                if future.exception() is not None:
+                    failed.add(hash)
+            done += len(hashes)
+            click.echo(f"Processed {done} images, {len(failed)} failed.")
+
+
+@cli.command("reconcile-counters")
+def reconcile_counters():
+    """Recompute image counters of users and groups."""
     app = create_app()
-    serve(app, host="127.0.0.1", port=port)
+    with app.app_context():
+        # 计数列由迁移添加
+        apply_migrations()
+
+        repaired = reconcile_image_counters()
+        click.echo(f"Repaired counters of {repaired} users and groups.")
+
+
+@cli.command("purge-recycle-bin")
+@click.option(
+    "--days",
+    default=None,
+    type=int,
+    help="Purge images trashed more than DAYS ago."
+    " Defaults to RECYCLE_BIN_RETENTION_DAYS.",
+)
+def purge_recycle_bin(days: int):
+    """Finish interrupted purge jobs and purge expired images in recycle bins."""
+    app = create_app()
+    with app.app_context():
+        job_ids = [
+            id for id, in db.session.query(PurgeJob.id).filter_by(status="pending")
+        ]
+        for job_id in job_ids:
+            run_purge_job(job_id)
+        click.echo(f"Finished {len(job_ids)} purge jobs.")
+
+        if days is None:
+            days = app.config["RECYCLE_BIN_RETENTION_DAYS"]
+        if days is not None:
+            click.echo(f"Purged {purge_expired(days)} expired images.")
+
+
+@cli.command("mail-worker")
+@click.option(
+    "--poll-interval", default=5.0, help="Seconds between checks for retries."
+)
+@click.option("--once", is_flag=True, help="Send due emails and exit.")
+def mail_worker(poll_interval: float, once: bool):
+    """Send emails queued in the outbox."""
+    logging.basicConfig(level=logging.INFO)
+    run_mail_worker(create_app(), poll_interval=poll_interval, once=once)
+
+
+@cli.command("purge-expired")
+def purge_expired_records():
+    """Delete expired passcodes and rate limit counters."""
+    app = create_app()
+    with app.app_context():
+        expire_datetime = datetime.now() - timedelta(
+            seconds=app.config["PASSCODE_LIFETIME"]
+        )
+        passcodes = Passcode.query.filter(
+            Passcode.create_at <= expire_datetime
+        ).delete()
+        attempts = ResetAttempt.query.filter(
+            ResetAttempt.create_at <= expire_datetime
+        ).delete()
+        db.session.commit()
+        rate_limits = purge_expired_rate_limits()
+        click.echo(
+            f"Deleted {passcodes} passcodes, {attempts} reset attempts"
+            f" and {rate_limits} rate limit counters."
+        )
+
+
+@cli.command("seed")
+@click.option("--users", default=1, help="Number of users.")
+@click.option("--images", default=1000, help="Images per user.")
+@click.option("--groups", default=10, help="Groups per user.")
+@click.option("--tags", default=3, help="Average tags per image.")
+@click.option("--blobs", default=100, help="Number of distinct image contents.")
+@click.option("--blob-kb", default=100, help="Average image size in KB.")
+@click.option("--seed", default=0, help="Random seed.")
+def seed(
+    users: int, images: int, groups: int, tags: int, blobs: int, blob_kb: int, seed: int
+):
+    """Generate synthetic users, groups, tags and images for benchmarks."""
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        user_ids = seed_corpus(
+            users=users,
+            images=images,
+            groups=groups,
+            tags=tags,
+            blobs=blobs,
+            blob_kb=blob_kb,
+            seed=seed,
+            echo=click.echo,
+        )
+    click.echo(f"Seeded users {', '.join(map(str, user_ids))}.")
@@ -1,6 +1,15 @@
+import os
+import tempfile
+from typing import List, Literal, Optional
+
 from pydantic import BaseSettings, Field, PostgresDsn
 
 
+class DatabaseDsn(PostgresDsn):
+    # 较早的 pydantic 不含 psycopg 3 驱动
+    allowed_schemes = PostgresDsn.allowed_schemes | {"postgresql+psycopg"}
+
+
 class Configs(BaseSettings):
     # DEBUG = True if os.getenv('DEBUG') in ('True', 'true', '1') else False
     # SQLALCHEMY_ECHO = True
@@ -8,12 +17,113 @@ class Configs(BaseSettings):
     # TESTING = True if os.getenv('TESTING') in ('True', 'true', '1') else False
 
     SQLALCHEMY_TRACK_MODIFICATIONS: bool = False
-    SQLALCHEMY_DATABASE_URI: PostgresDsn = Field(..., env="DATABASE_URI")
+    SQLALCHEMY_DATABASE_URI: DatabaseDsn = Field(..., env="DATABASE_URI")
+    # 连接池配置：postgres 直连，pgbouncer 经 PgBouncer transaction 模式连接。
+    # 各配置的默认值见 engine.PROFILES，以下 DATABASE_* 不为空时覆盖。
+    DATABASE_PROFILE: Literal["postgres", "pgbouncer"] = "postgres"
+    # 每个进程的连接数，pgbouncer 默认为 0（不在进程内缓存连接）
+    DATABASE_POOL_SIZE: Optional[int] = None
+    DATABASE_MAX_OVERFLOW: Optional[int] = None
+    # 取连接的最长等待时间（秒）
+    DATABASE_POOL_TIMEOUT: Optional[float] = None
+    DATABASE_POOL_RECYCLE: Optional[int] = None
+    DATABASE_POOL_PRE_PING: Optional[bool] = None
+    # 单条语句的最长执行时间（毫秒），0 为不限制。仅 postgres 配置有效。
+    DATABASE_STATEMENT_TIMEOUT: int = 30000
+    DATABASE_APPLICATION_NAME: str = "biaoqingbao"
+    # 只读接口使用的从库，JSON 数组，eg. '["postgresql://replica1/biaoqingbao"]'
+    DATABASE_REPLICA_URIS: List[DatabaseDsn] = []
+    # 用户修改数据后此时间（秒）内读主库
+    REPLICA_READ_AFTER_WRITE: int = 5
+    # 从库健康检查间隔（秒），延迟超过 REPLICA_MAX_LAG 秒的从库不使用
+    REPLICA_HEALTH_INTERVAL: float = 5
+    REPLICA_MAX_LAG: float = 10
     SECRET_KEY: str
+    # token 有效期（秒）
+    TOKEN_LIFETIME: int = 14 * 24 * 3600
+    # 缓存已验证的 token 数量，0 为不缓存
+    TOKEN_CACHE_SIZE: int = 4096
+    # 多进程部署时，其它进程注销的 token 最迟在此时间（秒）后失效
+    TOKEN_REVOCATION_REFRESH: int = 10
+
+    # 图片内容存储位置：database 存放在数据库 blob 表中，local 存放在本地目录中。
+    BLOB_STORAGE: Literal["database", "local"] = "database"
+    BLOB_STORAGE_PATH: str = "blobs"
+
+    MAX_CONTENT_LENGTH: int = 64 * 1024 * 1024
+    # 上传文件超过此大小时暂存到磁盘
+    UPLOAD_SPOOL_MEMORY_SIZE: int = 512 * 1024
+
+    # 缩略图，需安装 Pillow。RENDITION_WORKERS 为 0 时不生成缩略图。
+    RENDITION_WORKERS: int = 1
+    THUMBNAIL_SIZE: int = 256
+    THUMBNAIL_FORMAT: Literal["webp", "jpeg"] = "webp"
+
+    # 标签搜索：auto 在 Postgres 安装了 pg_trgm 时使用 trigram 索引，否则使用进程内索引。
+    TAG_SEARCH: Literal["auto", "trigram", "ngram", "like"] = "auto"
+    TAG_INDEX_CACHE_USERS: int = 256
+
+    # 维护用户、组的图片数量，GET /api/groups/ 直接读取。开启前先执行 `biaoqingbao reconcile-counters`。
+    IMAGE_COUNTERS: bool = False
+
+    # 组列表、标签、图片列表首页的响应缓存，key 中含用户的数据版本号，数据修改后立即失效。
+    # memory 只在当前进程内，shared 为同一主机上的 worker 进程共用（共享内存中的文件），
+    # none 不缓存。超过 RESPONSE_CACHE_MAX_BYTES 时淘汰最久未读取的响应。
+    RESPONSE_CACHE: Literal["none", "memory", "shared"] = "memory"
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_SHM_PATH: str = os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        "biaoqingbao-cache",
+    )
+
+    # JSON 序列化：orjson 需安装 orjson，auto 在安装了 orjson 时使用，否则使用标准库 json。
+    JSON_PROVIDER: Literal["auto", "orjson", "stdlib"] = "auto"
+
+    # 清空回收站时每个事务删除的图片数量
+    PURGE_CHUNK_SIZE: int = 500
+    # 回收站中超过此天数的图片由 `biaoqingbao purge-recycle-bin` 删除，不设置则不自动删除
+    RECYCLE_BIN_RETENTION_DAYS: Optional[int] = None
+
+    # 密码哈希，同 werkzeug.security.generate_password_hash 的参数。修改后用户登录时自动更新哈希。
+    PASSWORD_HASH_METHOD: str = "pbkdf2:sha256:260000"
+    PASSWORD_SALT_LENGTH: int = 16
+    # 每个进程同时计算的密码哈希数量，最多排队等待的数量及等待时间（秒）
+    PASSWORD_HASH_WORKERS: int = 1
+    PASSWORD_HASH_QUEUE_SIZE: int = 16
+    PASSWORD_HASH_TIMEOUT: float = 5
+
+    # 验证码有效期（秒），有效期内最多发送、尝试 PASSCODE_LIMIT 次
+    PASSCODE_LIFETIME: int = 600
+    PASSCODE_LIMIT: int = 5
+    # 限流计数存放位置：memory 只在当前进程内有效，shared 为同一主机上的进程共用，
+    # database 为多台主机共用。
+    RATE_LIMIT_BACKEND: Literal["memory", "shared", "database"] = "shared"
+    RATE_LIMIT_SHM_PATH: str = os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        "biaoqingbao-ratelimit",
+    )
+
+    # Prometheus 指标，需安装 prometheus_client。METRICS_PORT 为空时由应用的 /metrics
+    # 提供，否则 `biaoqingbao run` 在 METRICS_HOST:METRICS_PORT 上单独提供。
+    METRICS: bool = True
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: Optional[int] = None
+
+    # 测试中开启：请求执行的 SQL 超出 view 的 query_budget，或同一 SELECT 执行超过
+    # QUERY_REPEAT_LIMIT 次（N+1）时报错
+    QUERY_BUDGETS: bool = False
+    QUERY_REPEAT_LIMIT: int = 3
 
     EMAIL_HOST: str = "smtpdm.aliyun.com"
+    EMAIL_PORT: int = 465
+    EMAIL_USE_SSL: bool = True
     EMAIL_USERNAME: str = "admin@notice.bqb.plus"
     EMAIL_PASSWORD: str
+    EMAIL_TIMEOUT: int = 10
+    # 发件箱：每批发送的邮件数量，发送失败时的重试次数及首次重试间隔（秒，之后每次加倍）
+    EMAIL_BATCH_SIZE: int = 50
+    EMAIL_MAX_ATTEMPTS: int = 8
+    EMAIL_RETRY_DELAY: int = 30
 
 
 configs = Configs()
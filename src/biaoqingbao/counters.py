@@ -0,0 +1,98 @@
+from collections import Counter
+from typing import Iterable, Optional, Tuple
+
+from flask import current_app
+
+from .models import Group, Image, User, db
+from .versions import bump_data_version
+
+
+def adjust_image_counters(
+    user_id: int, changes: Iterable[Tuple[Optional[int], bool, int]]
+) -> None:
+    """图片增删、移动、移入移出回收站时调用，在调用方的事务中执行。未配置 IMAGE_COUNTERS 时不做任何事。
+
+    Params:
+        changes [Iterable[(group_id, is_deleted, delta)]]: 图片状态为 (group_id, is_deleted)
+            的数量变化，eg. 图片移入回收站：[(group_id, False, -1), (group_id, True, 1)]
+    """
+    if not current_app.config["IMAGE_COUNTERS"]:
+        return
+
+    image_delta = 0
+    deleted_delta = 0
+    group_deltas = Counter()
+    for group_id, is_deleted, delta in changes:
+        if is_deleted:
+            deleted_delta += delta
+        else:
+            image_delta += delta
+            if group_id is not None:
+                group_deltas[group_id] += delta
+
+    if image_delta or deleted_delta:
+        User.query.filter_by(id=user_id).update(
+            {
+                User.image_number: User.image_number + image_delta,
+                User.deleted_image_number: User.deleted_image_number + deleted_delta,
+            },
+            synchronize_session=False,
+        )
+    for group_id, delta in group_deltas.items():
+        if delta:
+            Group.query.filter_by(id=group_id).update(
+                {Group.image_number: Group.image_number + delta},
+                synchronize_session=False,
+            )
+
+
+def reconcile_image_counters() -> int:
+    """按 image 表重新计算所有计数。
+
+    Return:
+        repaired [int]: 计数有误的用户和组的数量
+    """
+
+    def count_images(*criteria):
+        return db.select(db.func.count(Image.id)).where(*criteria).scalar_subquery()
+
+    image_number = count_images(Image.user_id == User.id, Image.is_deleted == False)
+    deleted_image_number = count_images(
+        Image.user_id == User.id, Image.is_deleted == True
+    )
+    repaired = db.session.execute(
+        db.update(User)
+        .where(
+            db.or_(
+                User.image_number != image_number,
+                User.deleted_image_number != deleted_image_number,
+            )
+        )
+        .values(
+            image_number=image_number,
+            deleted_image_number=deleted_image_number,
+            # 使缓存的组列表失效
+            data_version=User.data_version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    group_image_number = count_images(
+        Image.group_id == Group.id, Image.is_deleted == False
+    )
+    group_user_ids = (
+        db.session.execute(
+            db.update(Group)
+            .where(Group.image_number != group_image_number)
+            .values(image_number=group_image_number)
+            .returning(Group.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        .scalars()
+        .all()
+    )
+    repaired += len(group_user_ids)
+    for user_id in set(group_user_ids):
+        bump_data_version(user_id)
+    db.session.commit()
+    return repaired
@@ -0,0 +1,182 @@
+import os
+import time
+import weakref
+from threading import Lock
+from typing import Optional
+
+from flask import g, has_request_context
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+# 各连接池配置的默认值，DATABASE_* 配置项覆盖
+PROFILES = {
+    # 直连 Postgres。gunicorn 启动 cpu_count() * 2 + 1 个 worker，每个 worker 的连接数
+    # 应较少，合计不超过 max_connections。
+    "postgres": {
+        "pool_size": 3,
+        "max_overflow": 2,
+        "pool_timeout": 10,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    },
+    # 经 PgBouncer（transaction 模式）连接，由 PgBouncer 维护连接池。
+    # 不支持启动参数中的 statement_timeout，须用 ALTER ROLE ... SET 设置。
+    "pgbouncer": {
+        "pool_size": 0,
+        "pool_pre_ping": False,
+    },
+}
+
+
+class PoolStats:
+    """连接池取连接的等待时间统计。"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        # 每次取连接后以等待时间调用，超时时以 None 调用（见 metrics.instrument_pool）
+        self.listeners = []
+        self._lock = Lock()
+
+    def observe(self, wait_seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+        for listener in self.listeners:
+            listener(wait_seconds)
+
+    def timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+        for listener in self.listeners:
+            listener(None)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录取连接等待时间的 QueuePool。请求中等待的时间记入 g.db_pool_wait。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.timeout()
+            raise
+        wait_seconds = time.perf_counter() - start
+        self.stats.observe(wait_seconds)
+        if has_request_context():
+            g.db_pool_wait = g.get("db_pool_wait", 0) + wait_seconds
+        return conn
+
+    def recreate(self):
+        pool = super().recreate()
+        # dispose() 后沿用原来的统计
+        pool.stats = self.stats
+        return pool
+
+
+def engine_options(configs, uri: Optional[str] = None) -> dict:
+    """根据 DATABASE_PROFILE 及 DATABASE_* 配置生成 SQLALCHEMY_ENGINE_OPTIONS。
+
+    Params:
+        uri [str]: 数据库地址，默认为 DATABASE_URI
+    """
+    if uri is None:
+        uri = configs.SQLALCHEMY_DATABASE_URI
+    profile = configs.DATABASE_PROFILE
+    options = dict(PROFILES[profile])
+    for key, value in [
+        ("pool_size", configs.DATABASE_POOL_SIZE),
+        ("max_overflow", configs.DATABASE_MAX_OVERFLOW),
+        ("pool_timeout", configs.DATABASE_POOL_TIMEOUT),
+        ("pool_recycle", configs.DATABASE_POOL_RECYCLE),
+        ("pool_pre_ping", configs.DATABASE_POOL_PRE_PING),
+    ]:
+        if value is not None:
+            options[key] = value
+
+    url = make_url(uri)
+    connect_args = {"application_name": configs.DATABASE_APPLICATION_NAME}
+    if profile == "postgres" and configs.DATABASE_STATEMENT_TIMEOUT:
+        connect_args[
+            "options"
+        ] = f"-c statement_timeout={configs.DATABASE_STATEMENT_TIMEOUT}"
+    if profile == "pgbouncer" and url.get_driver_name() == "psycopg":
+        # transaction 模式下连接在事务间切换，不能使用服务端预备语句。
+        # psycopg2 不使用预备语句，无需设置。
+        connect_args["prepare_threshold"] = None
+    options["connect_args"] = connect_args
+
+    if options.get("pool_size") == 0:
+        options["poolclass"] = NullPool
+        for key in ("pool_size", "max_overflow", "pool_timeout"):
+            options.pop(key, None)
+    else:
+        options["poolclass"] = InstrumentedQueuePool
+    return options
+
+
+_engines = weakref.WeakSet()
+_engines_lock = Lock()
+_fork_hook_registered = False
+
+
+def dispose_in_child() -> None:
+    # gunicorn preload_app 时连接池在 master 中创建，子进程不能使用继承的连接。
+    # close=False 不关闭父进程仍在使用的连接，只丢弃。
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+def setup_engine(engine: Engine) -> None:
+    """create_app 中对 Flask-SQLAlchemy 创建的 engine 调用。"""
+    global _fork_hook_registered
+    with _engines_lock:
+        if not _fork_hook_registered:
+            os.register_at_fork(after_in_child=dispose_in_child)
+            _fork_hook_registered = True
+        _engines.add(engine)
+
+
+def pool_capacity(configs) -> Optional[int]:
+    """每个进程最多同时使用的连接数，不使用连接池（pgbouncer）或不限连接数时为 None。"""
+    options = engine_options(configs)
+    if options["poolclass"] is NullPool or options["max_overflow"] < 0:
+        return None
+    return options["pool_size"] + options["max_overflow"]
+
+
+def add_pool_timing(resp):
+    """after_request：请求中等待数据库连接的时间。"""
+    wait_seconds = g.get("db_pool_wait")
+    if wait_seconds is not None:
+        resp.headers.add("Server-Timing", f"db-pool;dur={wait_seconds * 1000:.3f}")
+    return resp
+
+
+def pool_metrics(engine: Engine) -> Optional[dict]:
+    """连接池状态。不是 InstrumentedQueuePool 时返回 None。"""
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return None
+    # max_overflow 为 -1 时连接数不受限制
+    capacity = pool.size() + pool._max_overflow if pool._max_overflow >= 0 else None
+    return {
+        "size": pool.size(),
+        "capacity": capacity,
+        "checked_out": pool.checkedout(),
+        # 正在使用的连接占可用连接数的比例，达到 1 时请求开始排队
+        "saturation": pool.checkedout() / capacity if capacity else 0,
+        "checkouts": pool.stats.checkouts,
+        "timeouts": pool.stats.timeouts,
+        "wait_seconds": pool.stats.wait_seconds,
+        "max_wait_seconds": pool.stats.max_wait_seconds,
+    }
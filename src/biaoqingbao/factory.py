@@ -4,9 +4,20 @@ from .configs import configs
 
 
 def create_app():
+    from .uploads import Request
+
     app = Flask(__name__)
+    app.request_class = Request
     app.config.from_object(configs)
 
+    from .jsonprovider import init_json_provider
+
+    init_json_provider(app, configs)
+
+    from .engine import engine_options
+
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(configs)
+
     from .views import bp_main, bp_user
 
     app.register_blueprint(bp_user)
@@ -16,6 +27,62 @@ def create_app():
 
     db.init_app(app)
 
+    from . import metrics, querybudget
+    from .engine import add_pool_timing, setup_engine
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        setup_engine(engine)
+    if metrics.is_enabled(configs):
+        metrics.init_metrics(app, engines)
+    if configs.QUERY_BUDGETS:
+        querybudget.init_query_budgets(app, engines)
+    app.after_request(add_pool_timing)
+
+    if configs.DATABASE_REPLICA_URIS:
+        from sqlalchemy import create_engine
+
+        from .replicas import ReplicaSet, mark_write
+
+        # 不作为 SQLALCHEMY_BINDS，create_all 等不会在从库上执行
+        replica_engines = [
+            create_engine(uri, **engine_options(configs, uri))
+            for uri in configs.DATABASE_REPLICA_URIS
+        ]
+        for engine in replica_engines:
+            setup_engine(engine)
+            if metrics.is_enabled(configs):
+                metrics.instrument_engine(engine)
+            if configs.QUERY_BUDGETS:
+                querybudget.instrument_engine(engine)
+        app.extensions["replicas"] = ReplicaSet(
+            replica_engines,
+            health_interval=configs.REPLICA_HEALTH_INTERVAL,
+            max_lag=configs.REPLICA_MAX_LAG,
+        )
+        app.after_request(mark_write)
+
+    from .storage import create_blob_store
+
+    app.extensions["blob_store"] = create_blob_store(configs)
+
+    from .ratelimit import create_rate_limiter
+
+    app.extensions["rate_limiter"] = create_rate_limiter(configs)
+
+    from .tagsearch import TagIndexCache
+
+    app.extensions["tag_index_cache"] = TagIndexCache(configs.TAG_INDEX_CACHE_USERS)
+
+    from .cache import create_response_cache
+
+    app.extensions["response_cache"] = create_response_cache(configs)
+
+    from .passwords import PasswordHasher
+
+    app.extensions["password_hasher"] = PasswordHasher.from_config(configs)
+
     def make_shell_context():
         return dict(db=db, Image=Image, Group=Group)
 
@@ -0,0 +1,299 @@
+import os
+import time
+from typing import Iterable, List
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .engine import InstrumentedQueuePool, pool_metrics
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # prometheus_client 为可选依赖，未安装时不记录指标
+    prometheus_client = None
+
+# gunicorn 多进程部署时各 worker 的指标写入此目录，须在导入 prometheus_client 前设置
+# （见 serving.prepare_metrics_dir）。
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# 请求耗时（秒）
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# 单条 SQL 耗时（秒）
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+# 每个请求执行的 SQL 数量
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+if prometheus_client is not None:
+    REQUEST_DURATION = prometheus_client.Histogram(
+        "biaoqingbao_request_duration_seconds",
+        "Request latency by endpoint.",
+        ["endpoint", "method"],
+        buckets=REQUEST_BUCKETS,
+    )
+    REQUESTS = prometheus_client.Counter(
+        "biaoqingbao_requests",
+        "Finished requests by endpoint and status.",
+        ["endpoint", "method", "status"],
+    )
+    RESPONSE_BYTES = prometheus_client.Counter(
+        "biaoqingbao_response_bytes",
+        "Response body bytes by endpoint.",
+        ["endpoint"],
+    )
+    REQUESTS_IN_PROGRESS = prometheus_client.Gauge(
+        "biaoqingbao_requests_in_progress",
+        "Requests being handled.",
+        multiprocess_mode="livesum",
+    )
+    SQL_DURATION = prometheus_client.Histogram(
+        "biaoqingbao_sql_duration_seconds",
+        "SQL statement latency by endpoint.",
+        ["endpoint"],
+        buckets=SQL_BUCKETS,
+    )
+    REQUEST_SQL_STATEMENTS = prometheus_client.Histogram(
+        "biaoqingbao_request_sql_statements",
+        "SQL statements per request by endpoint.",
+        ["endpoint"],
+        buckets=SQL_COUNT_BUCKETS,
+    )
+    DB_POOL_WAIT = prometheus_client.Histogram(
+        "biaoqingbao_db_pool_wait_seconds",
+        "Time a request waited for database connections.",
+        buckets=SQL_BUCKETS,
+    )
+    DB_POOL_CHECKOUT_WAIT = prometheus_client.Histogram(
+        "biaoqingbao_db_pool_checkout_wait_seconds",
+        "Time each connection checkout waited, by pool.",
+        ["pool"],
+        buckets=SQL_BUCKETS,
+    )
+    DB_POOL_TIMEOUTS = prometheus_client.Counter(
+        "biaoqingbao_db_pool_timeouts",
+        "Connection checkouts that timed out, by pool.",
+        ["pool"],
+    )
+    DB_POOL_CHECKED_OUT = prometheus_client.Gauge(
+        "biaoqingbao_db_pool_checked_out",
+        "Connections in use, by pool.",
+        ["pool"],
+        multiprocess_mode="livesum",
+    )
+    DB_POOL_CAPACITY = prometheus_client.Gauge(
+        "biaoqingbao_db_pool_capacity",
+        "Pool size plus max overflow, by pool.",
+        ["pool"],
+        multiprocess_mode="livesum",
+    )
+    DB_POOL_SATURATION = prometheus_client.Gauge(
+        "biaoqingbao_db_pool_saturation",
+        "Connections in use over capacity, by pool (busiest process).",
+        ["pool"],
+        multiprocess_mode="livemax",
+    )
+    PASSWORD_HASH_QUEUE = prometheus_client.Histogram(
+        "biaoqingbao_password_hash_queue_seconds",
+        "Time password hashes waited for a hasher thread.",
+        buckets=REQUEST_BUCKETS,
+    )
+    PASSWORD_HASH_DURATION = prometheus_client.Histogram(
+        "biaoqingbao_password_hash_duration_seconds",
+        "Time spent computing password hashes.",
+        buckets=REQUEST_BUCKETS,
+    )
+    PASSWORD_HASH_REJECTED = prometheus_client.Counter(
+        "biaoqingbao_password_hash_rejected",
+        "Password hashes rejected by reason (queue_full or timeout).",
+        ["reason"],
+    )
+    RESPONSE_CACHE = prometheus_client.Counter(
+        "biaoqingbao_response_cache",
+        "Response cache lookups by endpoint and result (hit or miss).",
+        ["endpoint", "result"],
+    )
+
+
+def is_enabled(configs) -> bool:
+    return prometheus_client is not None and configs.METRICS
+
+
+def endpoint_label() -> str:
+    """请求的 endpoint，未匹配路由时为 none，请求之外（命令行等）为 background。"""
+    if not has_request_context():
+        return "background"
+    return request.endpoint or "none"
+
+
+def count_cache_result(endpoint: str, hit: bool) -> None:
+    if prometheus_client is not None:
+        RESPONSE_CACHE.labels(endpoint, "hit" if hit else "miss").inc()
+
+
+def observe_password_hash(queue_seconds: float, hash_seconds: float) -> None:
+    if prometheus_client is not None:
+        PASSWORD_HASH_QUEUE.observe(queue_seconds)
+        PASSWORD_HASH_DURATION.observe(hash_seconds)
+
+
+def count_password_hash_rejected(reason: str) -> None:
+    if prometheus_client is not None:
+        PASSWORD_HASH_REJECTED.labels(reason).inc()
+
+
+def start_timer() -> None:
+    """before_request"""
+    g.metrics_start = time.perf_counter()
+    REQUESTS_IN_PROGRESS.inc()
+
+
+def count_bytes(body: Iterable[bytes], endpoint: str):
+    try:
+        for chunk in body:
+            RESPONSE_BYTES.labels(endpoint).inc(len(chunk))
+            yield chunk
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+
+def count_response(resp):
+    """after_request：记录状态码及响应大小。"""
+    g.metrics_status = resp.status_code
+    endpoint = endpoint_label()
+    length = resp.content_length
+    if length is not None:
+        RESPONSE_BYTES.labels(endpoint).inc(length)
+    elif resp.is_streamed:
+        # 导出等流式响应在发送时计数
+        resp.response = count_bytes(resp.response, endpoint)
+    return resp
+
+
+def observe_request(exc) -> None:
+    """teardown_request：流式响应（stream_with_context）发送完后才执行。"""
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return
+    REQUESTS_IN_PROGRESS.dec()
+    endpoint = endpoint_label()
+    status = 500 if exc is not None else g.get("metrics_status", 500)
+    REQUEST_DURATION.labels(endpoint, request.method).observe(
+        time.perf_counter() - start
+    )
+    REQUESTS.labels(endpoint, request.method, str(status)).inc()
+    REQUEST_SQL_STATEMENTS.labels(endpoint).observe(g.get("sql_statements", 0))
+    wait_seconds = g.get("db_pool_wait")
+    if wait_seconds is not None:
+        DB_POOL_WAIT.observe(wait_seconds)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_start"].pop()
+    SQL_DURATION.labels(endpoint_label()).observe(elapsed)
+    if has_request_context():
+        g.sql_statements = g.get("sql_statements", 0) + 1
+
+
+def handle_error(context) -> None:
+    # 出错的语句没有 after_cursor_execute
+    if context.connection is not None:
+        stack = context.connection.info.get("metrics_start")
+        if stack:
+            stack.pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        instrument_pool(engine)
+
+
+def pool_label(engine: Engine) -> str:
+    url = engine.url
+    return f"{url.host or ''}:{url.port or ''}/{url.database or ''}"
+
+
+def instrument_pool(engine: Engine) -> None:
+    """连接池的等待时间、超时次数及使用中的连接数（见 engine.pool_metrics）。"""
+    label = pool_label(engine)
+    capacity = pool_metrics(engine)["capacity"]
+    if capacity:
+        DB_POOL_CAPACITY.labels(label).set(capacity)
+
+    def observe_checkout(wait_seconds):
+        if wait_seconds is None:
+            DB_POOL_TIMEOUTS.labels(label).inc()
+        else:
+            DB_POOL_CHECKOUT_WAIT.labels(label).observe(wait_seconds)
+
+    def set_checked_out(checked_out: int):
+        DB_POOL_CHECKED_OUT.labels(label).set(checked_out)
+        if capacity:
+            DB_POOL_SATURATION.labels(label).set(checked_out / capacity)
+
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        set_checked_out(engine.pool.checkedout())
+
+    def checkin(dbapi_connection, connection_record):
+        # checkin 在连接放回连接池之前触发
+        set_checked_out(engine.pool.checkedout() - 1)
+
+    # dispose() 重建的连接池沿用 stats 及事件
+    engine.pool.stats.listeners.append(observe_checkout)
+    event.listen(engine, "checkout", checkout)
+    event.listen(engine, "checkin", checkin)
+
+
+def get_registry():
+    """多进程时汇总 MULTIPROC_DIR_ENV 目录中各进程的指标。"""
+    if MULTIPROC_DIR_ENV in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
+
+
+def show_metrics():
+    """
+    API: GET /metrics
+    Return: Prometheus text format
+    """
+    return Response(
+        prometheus_client.generate_latest(get_registry()),
+        content_type=prometheus_client.CONTENT_TYPE_LATEST,
+    )
+
+
+def init_metrics(app, engines: List[Engine]) -> None:
+    """create_app 中尽早调用，使 after_request 最后执行，记录最终的响应。
+
+    METRICS_PORT 不为空时 /metrics 由 start_metrics_server 在单独的端口上提供。
+    """
+    app.before_request(start_timer)
+    app.after_request(count_response)
+    app.teardown_request(observe_request)
+    for engine in engines:
+        instrument_engine(engine)
+    if app.config["METRICS_PORT"] is None:
+        app.add_url_rule("/metrics", "metrics", show_metrics)
+
+
+def start_metrics_server(host: str, port: int) -> None:
+    """在后台线程中提供 /metrics。gunicorn 时在 master 中调用，汇总各 worker 的指标。"""
+    if prometheus_client is None:
+        raise RuntimeError("prometheus_client is not installed")
+    prometheus_client.start_http_server(port, host, registry=get_registry())
+
+
+def mark_process_dead(pid: int) -> None:
+    """gunicorn child_exit：退出的 worker 不再计入进行中的请求数。"""
+    if prometheus_client is not None and MULTIPROC_DIR_ENV in os.environ:
+        multiprocess.mark_process_dead(pid)
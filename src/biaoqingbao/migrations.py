@@ -0,0 +1,180 @@
+from typing import Callable, List, NamedTuple, Optional
+
+from .models import SchemaMigration, db
+from .tagsearch import TRIGRAM_INDEX
+
+# 防止多个进程同时执行迁移
+MIGRATION_LOCK_ID = 0x62716206
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable
+    # CREATE INDEX CONCURRENTLY 不能在事务中执行
+    transactional: bool = True
+
+
+def add_columns(conn) -> None:
+    """旧版本数据库缺少的列。"""
+    for statement in [
+        "ALTER TABLE image ADD COLUMN IF NOT EXISTS"
+        " hash VARCHAR(64) REFERENCES blob (hash)",
+        "ALTER TABLE image ALTER COLUMN data DROP NOT NULL",
+        "ALTER TABLE image ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP",
+        'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS'
+        " data_version INTEGER NOT NULL DEFAULT 0",
+        'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS'
+        " image_number INTEGER NOT NULL DEFAULT 0",
+        'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS'
+        " deleted_image_number INTEGER NOT NULL DEFAULT 0",
+        'ALTER TABLE "group" ADD COLUMN IF NOT EXISTS'
+        " image_number INTEGER NOT NULL DEFAULT 0",
+    ]:
+        conn.execute(db.text(statement))
+
+
+def add_hot_path_indexes(conn) -> None:
+    """图片列表、计数、标签查询使用的索引。"""
+    create_index(
+        conn,
+        "ix_image_user_id_is_deleted_create_at",
+        "image (user_id, is_deleted, create_at DESC, id DESC)",
+    )
+    create_index(
+        conn,
+        "ix_image_group_id_create_at",
+        "image (group_id, create_at DESC, id DESC) WHERE is_deleted = false",
+    )
+    create_index(
+        conn, "ix_image_deleted_at", "image (deleted_at) WHERE is_deleted = true"
+    )
+    create_index(conn, "ix_group_user_id_create_at", '"group" (user_id, create_at, id)')
+    create_index(conn, "ix_tag_user_id_image_id", "tag (user_id, image_id)")
+    create_index(conn, "ix_tag_image_id", "tag (image_id)")
+    create_index(conn, "ix_passcode_user_id_create_at", "passcode (user_id, create_at)")
+    # 已由 ix_image_user_id_is_deleted_create_at 代替
+    drop_index(conn, "ix_image_user_id_create_at")
+
+
+def add_trigram_index(conn) -> None:
+    """标签子串搜索的 pg_trgm GIN 索引（见 tagsearch），新建的表在 after_create 中创建。
+
+    数据库没有 pg_trgm 扩展时跳过，之后安装扩展的需手动创建索引。
+    """
+    available = conn.execute(
+        db.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    ).scalar()
+    if not available:
+        return
+    conn.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    create_index(conn, TRIGRAM_INDEX, "tag USING gin (text gin_trgm_ops)")
+
+
+def add_tag_version(conn) -> None:
+    conn.execute(
+        db.text(
+            'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS'
+            " tag_version INTEGER NOT NULL DEFAULT 0"
+        )
+    )
+
+
+MIGRATIONS = [
+    Migration(1, "add_columns", add_columns),
+    Migration(2, "add_hot_path_indexes", add_hot_path_indexes, transactional=False),
+    Migration(3, "add_trigram_index", add_trigram_index, transactional=False),
+    Migration(4, "add_tag_version", add_tag_version),
+]
+
+
+def create_index(conn, name: str, definition: str) -> None:
+    """不锁表地创建索引（CONCURRENTLY），需在事务之外执行。
+
+    CONCURRENTLY 创建中断时会留下无效的索引，先删除再重新创建。
+
+    Params:
+        definition [str]: "<table> (<columns>) [WHERE ...]"
+    """
+    valid = conn.execute(
+        db.text(
+            "SELECT i.indisvalid FROM pg_index i"
+            " JOIN pg_class c ON c.oid = i.indexrelid"
+            " WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+        ),
+        {"name": name},
+    ).scalar()
+    if valid is False:
+        drop_index(conn, name)
+    conn.execute(
+        db.text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+    )
+
+
+def drop_index(conn, name: str) -> None:
+    conn.execute(db.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def applied_versions(conn) -> List[int]:
+    SchemaMigration.__table__.create(conn, checkfirst=True)
+    return [
+        version
+        for version, in conn.execute(
+            db.select(SchemaMigration.version).order_by(SchemaMigration.version)
+        )
+    ]
+
+
+def pending_migrations(conn, target: Optional[int] = None) -> List[Migration]:
+    applied = set(applied_versions(conn))
+    return [
+        m
+        for m in MIGRATIONS
+        if m.version not in applied and (target is None or m.version <= target)
+    ]
+
+
+def upgrade(target: Optional[int] = None, echo: Callable = None) -> List[Migration]:
+    """依次执行未执行过的迁移，需在 app context 中调用。
+
+    迁移中的语句均可重复执行：由 `create-table` 新建的数据库上执行时不做任何修改。
+
+    Params:
+        target [int]: 只执行到此版本，默认执行全部
+        echo [Callable]: 执行每个迁移前以 Migration 调用
+    Return:
+        执行的迁移
+    """
+    done = []
+    # 此连接持有迁移锁，并在事务之外执行 CONCURRENTLY 语句
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        # 大表上创建索引的时间可能超过 DATABASE_STATEMENT_TIMEOUT
+        conn.execute(db.text("SET statement_timeout = 0"))
+        conn.execute(db.text(f"SELECT pg_advisory_lock({MIGRATION_LOCK_ID})"))
+        try:
+            for migration in pending_migrations(conn, target):
+                if echo is not None:
+                    echo(migration)
+                if migration.transactional:
+                    with db.engine.begin() as transaction:
+                        transaction.execute(db.text("SET LOCAL statement_timeout = 0"))
+                        migration.upgrade(transaction)
+                        record(transaction, migration)
+                else:
+                    migration.upgrade(conn)
+                    record(conn, migration)
+                done.append(migration)
+        finally:
+            conn.execute(db.text(f"SELECT pg_advisory_unlock({MIGRATION_LOCK_ID})"))
+            # 连接放回连接池前恢复连接时的设置
+            conn.execute(db.text("RESET statement_timeout"))
+    return done
+
+
+def record(conn, migration: Migration) -> None:
+    conn.execute(
+        db.insert(SchemaMigration).values(
+            version=migration.version, name=migration.name
+        )
+    )
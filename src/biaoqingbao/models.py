@@ -1,13 +1,26 @@
+from datetime import datetime
+
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.sql import func
 
-db = SQLAlchemy()
+from .replicas import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(64), nullable=False, unique=True)
     password = db.Column(db.String(128), nullable=False)
+    # 用户的图片、标签、组等数据每次变更时加一
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # 新增标签或修改标签文本时加一
+    tag_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # 配置 IMAGE_COUNTERS 时维护的图片数量
+    image_number = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    deleted_image_number = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
     create_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
 
     def __repr__(self):
@@ -21,17 +34,36 @@ class Group(db.Model):
     user = db.relationship(
         User, lazy=True, backref=db.backref("groups", lazy=True, cascade="all,delete")
     )
+    # 配置 IMAGE_COUNTERS 时维护的组内（不含回收站）图片数量
+    image_number = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     create_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
 
+    __table_args__ = (db.Index("ix_group_user_id_create_at", user_id, create_at, id),)
+
     def __repr__(self):
         return "<Group %r>" % self.id
 
 
+class Blob(db.Model):
+    """图片内容，以内容的 sha256 摘要寻址，相同内容的图片共用一个 blob。"""
+
+    hash = db.Column(db.String(64), primary_key=True)  # sha256 hexdigest
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    # 仅 database 存储后端使用，local 存储后端时为空。只在读取图片内容时加载。
+    data = db.deferred(db.Column(db.LargeBinary(length=2**24 - 1)))  # max size: 16MB
+    create_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
+
+    def __repr__(self):
+        return "<Blob %r>" % self.hash
+
+
 class Image(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    data = db.Column(
-        db.LargeBinary(length=2**24 - 1), nullable=False
-    )  # max size: 16MB
+    # 旧数据，图片内容直接存在此列中。`biaoqingbao migrate-blobs` 后为空。
+    # 只在读取图片内容时加载。
+    data = db.deferred(db.Column(db.LargeBinary(length=2**24 - 1)))  # max size: 16MB
+    hash = db.Column(db.String(64), db.ForeignKey(Blob.hash))
     type = db.Column(db.String(64), nullable=False)
     group_id = db.Column(db.Integer, db.ForeignKey(Group.id))
     group = db.relationship(
@@ -44,29 +76,52 @@ class Image(db.Model):
         User, lazy=True, backref=db.backref("images", lazy=True, cascade="all,delete")
     )
     is_deleted = db.Column(db.Boolean, default=False, nullable=False)
+    # 移入回收站的时间，旧数据为空
+    deleted_at = db.Column(db.DateTime())
     create_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
 
-    def readyToJSON(self, keys, datetime_format):
-        """
-        Params:
-            keys [Iterable[str]]
-            datetime_format [str]: 同 datetime.strptime() 的格式声明
-        """
-        d = {}
-        for k in keys:
-            if k == "create_at":
-                v = getattr(self, k).strftime(datetime_format)
-            elif k == "group":
-                v = self.group.name if self.group else None
-            else:
-                v = getattr(self, k)
-            d[k] = v
-        return d
+    # 图片列表按 (create_at, id) 排序、翻页。已有数据库由 `biaoqingbao migrate` 创建索引。
+    __table_args__ = (
+        db.Index(
+            "ix_image_user_id_is_deleted_create_at",
+            user_id,
+            is_deleted,
+            create_at.desc(),
+            id.desc(),
+        ),
+        db.Index(
+            "ix_image_group_id_create_at",
+            group_id,
+            create_at.desc(),
+            id.desc(),
+            postgresql_where=is_deleted == False,
+        ),
+        # 清除回收站中过期的图片
+        db.Index(
+            "ix_image_deleted_at", deleted_at, postgresql_where=is_deleted == True
+        ),
+    )
 
     def __repr__(self):
         return "<Image %r>" % self.id
 
 
+class Rendition(db.Model):
+    """图片的缩略图等衍生图片，按原图内容关联，相同内容的图片共用。"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_hash = db.Column(db.String(64), db.ForeignKey(Blob.hash), nullable=False)
+    name = db.Column(db.String(32), nullable=False)  # eg. "thumbnail"
+    hash = db.Column(db.String(64), db.ForeignKey(Blob.hash), nullable=False)
+    type = db.Column(db.String(64), nullable=False)
+    create_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
+
+    __table_args__ = (db.UniqueConstraint(source_hash, name),)
+
+    def __repr__(self):
+        return "<Rendition %r>" % self.id
+
+
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.String(64), nullable=False)
@@ -81,6 +136,12 @@ class Tag(db.Model):
     )
     create_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
 
+    __table_args__ = (
+        db.Index("ix_tag_user_id_image_id", user_id, image_id),
+        # 加载图片的标签、按标签搜索图片
+        db.Index("ix_tag_image_id", image_id),
+    )
+
     def __repr__(self):
         return "<Tag %r>" % self.id
 
@@ -96,11 +157,15 @@ class Passcode(db.Model):
     )
     create_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
 
+    __table_args__ = (db.Index("ix_passcode_user_id_create_at", user_id, create_at),)
+
     def __repr__(self):
         return "<Passcode %r>" % self.id
 
 
 class ResetAttempt(db.Model):
+    """旧版本的重置密码尝试记录，已由限流代替，`biaoqingbao purge-expired` 删除。"""
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
     user = db.relationship(
@@ -112,3 +177,83 @@ class ResetAttempt(db.Model):
 
     def __repr__(self):
         return "<ResetAttempt %r>" % self.id
+
+
+class RevokedToken(db.Model):
+    """已注销的 token，过期后可删除。"""
+
+    jti = db.Column(db.String(32), primary_key=True)
+    expire_at = db.Column(db.DateTime(), nullable=False, index=True)
+
+    def __repr__(self):
+        return "<RevokedToken %r>" % self.jti
+
+
+class PurgeJob(db.Model):
+    """清空回收站的后台任务，删除创建任务时已在回收站中的图片。"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
+    user = db.relationship(
+        User,
+        lazy=True,
+        backref=db.backref("purge_jobs", lazy=True, cascade="all,delete"),
+    )
+    # pending | done
+    status = db.Column(db.String(16), nullable=False, default="pending")
+    # 删除此时间之前移入回收站的图片
+    deleted_before = db.Column(db.DateTime(), nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    purged = db.Column(db.Integer, nullable=False, default=0)
+    create_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
+    finish_at = db.Column(db.DateTime())
+
+    def __repr__(self):
+        return "<PurgeJob %r>" % self.id
+
+
+class OutboxEmail(db.Model):
+    """待发送的邮件，由 `biaoqingbao mail-worker` 发送。"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    to_addrs = db.Column(db.Text, nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    # pending | sent | failed
+    status = db.Column(db.String(16), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # UTC
+    next_attempt_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    create_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
+    sent_at = db.Column(db.DateTime())
+
+    __table_args__ = (db.Index("ix_outbox_email_pending", status, next_attempt_at),)
+
+    def __repr__(self):
+        return "<OutboxEmail %r>" % self.id
+
+
+class RateLimit(db.Model):
+    """RATE_LIMIT_BACKEND 为 database 时的滑动窗口计数器。"""
+
+    key = db.Column(db.String(128), primary_key=True)
+    bucket = db.Column(db.BigInteger, nullable=False)
+    curr = db.Column(db.Integer, nullable=False)
+    prev = db.Column(db.Integer, nullable=False)
+    # UTC
+    expire_at = db.Column(db.DateTime(), nullable=False, index=True)
+
+    def __repr__(self):
+        return "<RateLimit %r>" % self.key
+
+
+class SchemaMigration(db.Model):
+    """已执行的数据库迁移，见 `biaoqingbao migrate`。"""
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(64), nullable=False)
+    applied_at = db.Column(db.DateTime(), nullable=False, server_default=func.now())
+
+    def __repr__(self):
+        return "<SchemaMigration %r>" % self.version
@@ -0,0 +1,143 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import BoundedSemaphore, Lock
+from typing import Callable
+
+from flask import current_app, g, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .metrics import count_password_hash_rejected, observe_password_hash
+
+
+class HasherBusy(Exception):
+    """等待计算密码哈希的请求过多，或等待超时。"""
+
+
+class HashStats:
+    """密码哈希的排队时间和计算时间统计，同时记入 Prometheus 指标。"""
+
+    def __init__(self):
+        self.count = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.hash_seconds = 0.0
+        self._lock = Lock()
+
+    def observe(self, queue_seconds: float, hash_seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.queue_seconds += queue_seconds
+            self.max_queue_seconds = max(self.max_queue_seconds, queue_seconds)
+            self.hash_seconds += hash_seconds
+        observe_password_hash(queue_seconds, hash_seconds)
+
+    def reject(self, reason: str) -> None:
+        """
+        Params:
+            reason [str]: "queue_full" 或 "timeout"
+        """
+        with self._lock:
+            self.rejected += 1
+        count_password_hash_rejected(reason)
+
+
+class PasswordHasher:
+    """在有限的线程中计算密码哈希，登录请求过多时不会占满 CPU，其它请求仍能及时处理。
+
+    hashlib 计算时释放 GIL，同时计算的哈希数量即 workers。
+    """
+
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        """
+        Params:
+            workers [int]: 同时计算的哈希数量
+            queue_size [int]: 最多排队等待的数量，超出时抛出 HasherBusy
+            timeout [float]: 最长等待时间（秒），超时抛出 HasherBusy
+        """
+        self.timeout = timeout
+        self.stats = HashStats()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="password")
+        self._slots = BoundedSemaphore(workers + queue_size)
+
+    @classmethod
+    def from_config(cls, configs) -> "PasswordHasher":
+        return cls(
+            configs.PASSWORD_HASH_WORKERS,
+            configs.PASSWORD_HASH_QUEUE_SIZE,
+            configs.PASSWORD_HASH_TIMEOUT,
+        )
+
+    def run(self, fn: Callable, *args):
+        if not self._slots.acquire(blocking=False):
+            self.stats.reject("queue_full")
+            raise HasherBusy()
+
+        submit_at = time.perf_counter()
+
+        def task():
+            start_at = time.perf_counter()
+            result = fn(*args)
+            return result, start_at - submit_at, time.perf_counter() - start_at
+
+        future = self._executor.submit(task)
+        # 等待超时后任务仍会执行完，执行完才释放名额
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result, queue_seconds, hash_seconds = future.result(self.timeout)
+        except FutureTimeoutError:
+            self.stats.reject("timeout")
+            raise HasherBusy()
+
+        self.stats.observe(queue_seconds, hash_seconds)
+        if has_app_context():
+            # 一个请求中可能计算多次，如登录时更新哈希
+            total_queue_seconds, total_hash_seconds = g.get(
+                "password_hash_timing", (0, 0)
+            )
+            g.password_hash_timing = (
+                total_queue_seconds + queue_seconds,
+                total_hash_seconds + hash_seconds,
+            )
+        return result
+
+
+def get_password_hasher() -> PasswordHasher:
+    return current_app.extensions["password_hasher"]
+
+
+def hash_password(password: str) -> str:
+    """使用 PASSWORD_HASH_METHOD 计算密码哈希，需在请求中调用。
+
+    Exception:
+        HasherBusy
+    """
+    return get_password_hasher().run(
+        generate_password_hash,
+        password,
+        current_app.config["PASSWORD_HASH_METHOD"],
+        current_app.config["PASSWORD_SALT_LENGTH"],
+    )
+
+
+def verify_password(pwhash: str, password: str) -> bool:
+    """需在请求中调用。
+
+    Exception:
+        HasherBusy
+    """
+    return get_password_hasher().run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash: str) -> bool:
+    """密码哈希的算法、参数与当前配置不同时返回 True。
+
+    werkzeug 的哈希格式为 "method$salt$hash"。
+    """
+    method, _, rest = pwhash.partition("$")
+    salt, _, _ = rest.partition("$")
+    return (
+        method != current_app.config["PASSWORD_HASH_METHOD"]
+        or len(salt) != current_app.config["PASSWORD_SALT_LENGTH"]
+    )
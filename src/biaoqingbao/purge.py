@@ -0,0 +1,149 @@
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Condition
+from typing import Optional
+
+from flask import current_app
+
+from .counters import adjust_image_counters
+from .models import Image, PurgeJob, Tag, db
+from .storage import release_blobs
+from .versions import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="purge")
+_pending = 0
+_pending_changed = Condition()
+
+
+def create_purge_job(user_id: int) -> PurgeJob:
+    """创建清空回收站任务，用户已有未完成的任务时返回该任务。"""
+    job = PurgeJob.query.filter_by(user_id=user_id, status="pending").first()
+    if job is None:
+        now = datetime.utcnow()
+        job = PurgeJob(
+            user_id=user_id,
+            deleted_before=now,
+            total=purgeable_images(user_id, now).count(),
+        )
+        db.session.add(job)
+    return job
+
+
+def purgeable_images(user_id: Optional[int], deleted_before: datetime):
+    query = Image.query.filter(Image.is_deleted == True)
+    if user_id is not None:
+        query = query.filter(
+            Image.user_id == user_id,
+            # 旧数据没有移入回收站的时间
+            db.or_(Image.deleted_at == None, Image.deleted_at <= deleted_before),
+        )
+    else:
+        query = query.filter(Image.deleted_at <= deleted_before)
+    return query
+
+
+def purge_chunk(user_id: Optional[int], deleted_before: datetime) -> int:
+    """在一个短事务中删除最多 PURGE_CHUNK_SIZE 张图片，由调用方提交。
+
+    已被其它进程锁定的图片跳过，多个进程可同时执行同一任务。
+
+    Return:
+        删除的图片数量，0 表示已删完
+    """
+    rows = (
+        purgeable_images(user_id, deleted_before)
+        .with_entities(Image.id, Image.user_id, Image.hash)
+        .order_by(Image.id)
+        .limit(current_app.config["PURGE_CHUNK_SIZE"])
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not rows:
+        return 0
+
+    ids = [id for id, _, _ in rows]
+    Tag.query.filter(Tag.image_id.in_(ids)).delete(synchronize_session=False)
+    Image.query.filter(Image.id.in_(ids)).delete(synchronize_session=False)
+    release_blobs([hash for _, _, hash in rows])
+    for user_id, n in Counter(user_id for _, user_id, _ in rows).items():
+        adjust_image_counters(user_id, [(None, True, -n)])
+        bump_data_version(user_id)
+    return len(rows)
+
+
+def run_purge_job(job_id: int) -> None:
+    """执行清空回收站任务，需在 app context 中调用。中断后重新执行即可继续。"""
+    job = PurgeJob.query.get(job_id)
+    if job is None or job.status == "done":
+        return
+
+    user_id, deleted_before = job.user_id, job.deleted_before
+    while True:
+        purged = purge_chunk(user_id, deleted_before)
+        if purged:
+            PurgeJob.query.filter_by(id=job_id).update(
+                {PurgeJob.purged: PurgeJob.purged + purged},
+                synchronize_session=False,
+            )
+        else:
+            PurgeJob.query.filter_by(id=job_id).update(
+                {PurgeJob.status: "done", PurgeJob.finish_at: datetime.utcnow()},
+                synchronize_session=False,
+            )
+        db.session.commit()
+        if not purged:
+            break
+
+
+def purge_expired(days: int) -> int:
+    """删除回收站中超过 days 天的图片，需在 app context 中调用。
+
+    Return:
+        删除的图片数量
+    """
+    # 旧数据没有移入回收站的时间，从现在开始计算
+    Image.query.filter(Image.is_deleted == True, Image.deleted_at == None).update(
+        {Image.deleted_at: datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+
+    deleted_before = datetime.utcnow() - timedelta(days=days)
+    total = 0
+    while True:
+        purged = purge_chunk(None, deleted_before)
+        db.session.commit()
+        if not purged:
+            return total
+        total += purged
+
+
+def schedule_purge_job(app, job_id: int) -> None:
+    """在请求之外后台执行任务，任务提交后调用。"""
+    global _pending
+    with _pending_changed:
+        _pending += 1
+
+    def run():
+        global _pending
+        try:
+            with app.app_context():
+                run_purge_job(job_id)
+        except Exception:
+            # 未完成的任务由 `biaoqingbao purge-recycle-bin` 继续执行
+            logger.exception("failed to run purge job %s", job_id)
+        finally:
+            with _pending_changed:
+                _pending -= 1
+                _pending_changed.notify_all()
+
+    _executor.submit(run)
+
+
+def wait_pending(timeout: Optional[float] = None) -> bool:
+    """等待已提交的任务完成。"""
+    with _pending_changed:
+        return _pending_changed.wait_for(lambda: _pending == 0, timeout)
@@ -0,0 +1,93 @@
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Tuple
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 测试中响应头返回请求执行的 SQL 数量
+STATEMENTS_HEADER = "X-SQL-Statements"
+
+
+class QueryBudgetExceeded(AssertionError):
+    """请求执行的 SQL 超出 view 声明的数量，或同一查询重复执行（N+1）。"""
+
+
+def query_budget(n: int):
+    """view 装饰器，声明每个请求最多执行的 SQL 数量（不含 unbudgeted 中的查询）。
+
+    QUERY_BUDGETS 开启时（测试中）超出则报错，放在 route 与 view 之间：
+
+        @bp_main.route("/api/groups/")
+        @query_budget(3)
+        def show_groups(): ...
+    """
+
+    def decorator(view):
+        view.query_budget = n
+        return view
+
+    return decorator
+
+
+@contextmanager
+def unbudgeted():
+    """其中的查询不计入当前请求，用于 token 注销列表刷新、从库健康检查等
+    每隔一段时间才执行一次、与请求内容无关的查询。"""
+    if not has_request_context():
+        yield
+        return
+    paused = g.get("sql_log_paused", False)
+    g.sql_log_paused = True
+    try:
+        yield
+    finally:
+        g.sql_log_paused = paused
+
+
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and not g.get("sql_log_paused"):
+        g.setdefault("sql_log", []).append(statement)
+
+
+def find_repeated(statements: List[str], limit: int) -> List[Tuple[str, int]]:
+    """执行超过 limit 次的同一 SELECT 语句，通常是循环中的查询或 lazy load。"""
+    counts = Counter(
+        statement
+        for statement in statements
+        if statement.lstrip().upper().startswith("SELECT")
+    )
+    return [(statement, n) for statement, n in counts.items() if n > limit]
+
+
+def check_query_budget(resp):
+    """after_request。流式响应（导出）发送过程中的查询不计入。"""
+    statements = g.get("sql_log", [])
+    resp.headers[STATEMENTS_HEADER] = str(len(statements))
+    problems = []
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, "query_budget", None)
+    if budget is not None and len(statements) > budget:
+        problems.append(f"{len(statements)} statements exceed budget {budget}")
+    limit = current_app.config["QUERY_REPEAT_LIMIT"]
+    for statement, n in find_repeated(statements, limit):
+        problems.append(f"N+1: executed {n} times: {statement}")
+    if problems:
+        raise QueryBudgetExceeded(
+            "\n".join(
+                [f"{request.method} {request.full_path}", *problems, "statements:"]
+                + statements
+            )
+        )
+    return resp
+
+
+def init_query_budgets(app, engines: List[Engine]) -> None:
+    app.after_request(check_query_budget)
+    for engine in engines:
+        instrument_engine(engine)
+
+
+def instrument_engine(engine: Engine) -> None:
+    event.listen(engine, "after_cursor_execute", record_statement)
@@ -0,0 +1,249 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from collections import deque
+from datetime import datetime
+from threading import Lock
+from typing import Tuple
+
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import RateLimit, db
+
+
+class RateLimiter:
+    """滑动窗口限流：window 秒内同一 key 最多允许 limit 次。"""
+
+    def hit(self, key: str, limit: int, window: int) -> bool:
+        """记录一次请求。超出限制时返回 False，且不计入此次请求。"""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+def slide_window(
+    bucket: int, curr: int, prev: int, now: float, window: int
+) -> Tuple[int, int, int]:
+    """滑动窗口计数器：按 window 将时间切分为固定窗口，只记录当前和上一窗口的次数。
+
+    Return:
+        (bucket, curr, prev): 移动到 now 所在窗口后的状态
+    """
+    now_bucket = int(now // window)
+    if now_bucket == bucket:
+        return bucket, curr, prev
+    elif now_bucket == bucket + 1:
+        return now_bucket, 0, curr
+    else:
+        return now_bucket, 0, 0
+
+
+def estimate_hits(curr: int, prev: int, now: float, window: int) -> float:
+    """假设上一窗口内的请求均匀分布，估算最近 window 秒内的次数。"""
+    elapsed = now / window - now // window
+    return prev * (1 - elapsed) + curr
+
+
+class MemoryRateLimiter(RateLimiter):
+    """记录每次请求的时间，精确的滑动窗口。只在当前进程内有效。"""
+
+    PRUNE_INTERVAL = 1000
+
+    def __init__(self):
+        self._hits = {}
+        self._lock = Lock()
+        self._hit_count = 0
+
+    def hit(self, key, limit, window):
+        now = time.monotonic()
+        with self._lock:
+            self._hit_count += 1
+            if self._hit_count % self.PRUNE_INTERVAL == 0:
+                self._prune(now)
+
+            _, hits = self._hits.setdefault(key, (window, deque()))
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if len(hits) >= limit:
+                return False
+            hits.append(now)
+            return True
+
+    def _prune(self, now: float) -> None:
+        expired = [
+            key
+            for key, (window, hits) in self._hits.items()
+            if not hits or hits[-1] <= now - window
+        ]
+        for key in expired:
+            del self._hits[key]
+
+    def clear(self):
+        with self._lock:
+            self._hits.clear()
+
+
+class SharedMemoryRateLimiter(RateLimiter):
+    """滑动窗口计数器存放在共享内存文件中，同一主机上的多个 worker 进程共用。
+
+    文件为定长的开放寻址哈希表，用 flock 加锁。表满时淘汰最早过期的记录，
+    因此只适合 key 数量不太多的场景（如按用户限制发送验证码）。
+    """
+
+    # key 哈希, 窗口序号, 过期时间, 当前窗口次数, 上一窗口次数
+    SLOT = struct.Struct("<QqdII")
+    PROBES = 16
+
+    def __init__(self, path: str, slots: int = 4096):
+        self.path = path
+        self.slots = slots
+        self._lock = Lock()
+        self._pid = None
+        self._fd = None
+        self._mmap = None
+
+    def _open(self) -> None:
+        # fork 出的子进程共享父进程的 flock，须在各进程中重新打开
+        if self._pid == os.getpid():
+            return
+        size = self.slots * self.SLOT.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._fd = fd
+        self._mmap = mmap.mmap(fd, size)
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _hash(key: str, window: int) -> int:
+        digest = hashlib.blake2b(f"{window}:{key}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def _find_slot(self, key_hash: int, now: float) -> Tuple[int, bool]:
+        """
+        Return:
+            (index, found): 未找到时 index 为可覆盖的空闲、过期或最早过期的位置
+        """
+        start = key_hash % self.slots
+        free = None
+        victim = None
+        victim_expire_at = math.inf
+        for i in range(self.PROBES):
+            index = (start + i) % self.slots
+            slot_hash, _, expire_at, _, _ = self.SLOT.unpack_from(
+                self._mmap, index * self.SLOT.size
+            )
+            if slot_hash == key_hash:
+                return index, True
+            elif slot_hash == 0:
+                # 除 clear() 外位置不会被清空，key 不可能在空闲位置之后
+                return (index if free is None else free), False
+            elif expire_at <= now:
+                # 过期的位置之后仍可能有此 key，须查完整个探测序列
+                if free is None:
+                    free = index
+            elif expire_at < victim_expire_at:
+                victim, victim_expire_at = index, expire_at
+        return (victim if free is None else free), False
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        key_hash = self._hash(key, window)
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                index, found = self._find_slot(key_hash, now)
+                offset = index * self.SLOT.size
+                if found:
+                    _, bucket, _, curr, prev = self.SLOT.unpack_from(self._mmap, offset)
+                else:
+                    bucket, curr, prev = 0, 0, 0
+                bucket, curr, prev = slide_window(bucket, curr, prev, now, window)
+                if estimate_hits(curr, prev, now, window) >= limit:
+                    return False
+                expire_at = (bucket + 2) * window
+                self.SLOT.pack_into(
+                    self._mmap, offset, key_hash, bucket, expire_at, curr + 1, prev
+                )
+                return True
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def clear(self):
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._mmap[:] = bytes(len(self._mmap))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class DatabaseRateLimiter(RateLimiter):
+    """滑动窗口计数器存放在 rate_limit 表中，多台主机共用。
+
+    使用独立的连接和事务，调用方的事务回滚时请求仍然计数。
+    """
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        with db.engine.begin() as conn:
+            conn.execute(
+                insert(RateLimit)
+                .values(key=key, bucket=0, curr=0, prev=0, expire_at=datetime.utcnow())
+                .on_conflict_do_nothing()
+            )
+            row = conn.execute(
+                db.select(RateLimit.bucket, RateLimit.curr, RateLimit.prev)
+                .where(RateLimit.key == key)
+                .with_for_update()
+            ).one()
+            bucket, curr, prev = slide_window(*row, now, window)
+            if estimate_hits(curr, prev, now, window) >= limit:
+                return False
+            conn.execute(
+                db.update(RateLimit)
+                .where(RateLimit.key == key)
+                .values(
+                    bucket=bucket,
+                    curr=curr + 1,
+                    prev=prev,
+                    expire_at=datetime.utcfromtimestamp((bucket + 2) * window),
+                )
+            )
+            return True
+
+    def clear(self):
+        with db.engine.begin() as conn:
+            conn.execute(db.delete(RateLimit))
+
+
+def create_rate_limiter(configs) -> RateLimiter:
+    if configs.RATE_LIMIT_BACKEND == "shared":
+        return SharedMemoryRateLimiter(configs.RATE_LIMIT_SHM_PATH)
+    elif configs.RATE_LIMIT_BACKEND == "database":
+        return DatabaseRateLimiter()
+    else:
+        return MemoryRateLimiter()
+
+
+def get_rate_limiter() -> RateLimiter:
+    return current_app.extensions["rate_limiter"]
+
+
+def purge_expired_rate_limits() -> int:
+    """删除过期的 rate_limit 记录，需在 app context 中调用。
+
+    Return:
+        删除的记录数量
+    """
+    deleted = RateLimit.query.filter(RateLimit.expire_at <= datetime.utcnow()).delete()
+    db.session.commit()
+    return deleted
@@ -0,0 +1,153 @@
+import io
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Condition, Lock
+from typing import Optional, Tuple, Union
+
+from sqlalchemy.exc import IntegrityError
+
+from .models import Rendition, db
+from .storage import get_blob_store, put_blob
+
+try:
+    import PIL.Image
+except ImportError:  # Pillow 为可选依赖，未安装时不生成缩略图
+    PIL = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL = "thumbnail"
+
+_executor = None
+_executor_lock = Lock()
+_pending = 0
+_pending_changed = Condition()
+
+
+def render_thumbnail(
+    source: Union[str, bytes], size: int, format: str
+) -> Tuple[bytes, str]:
+    """在子进程中执行。动图只取第一帧。
+
+    Params:
+        source [str | bytes]: 原图文件路径或原图内容
+        size [int]: 缩略图最长边
+        format [str]: "webp" | "jpeg"
+    Return:
+        (data, type)
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with PIL.Image.open(source) as im:
+        im.seek(0)
+        # JPEG 解码时直接缩小，减少解码开销
+        im.draft("RGB", (size, size))
+        im.thumbnail((size, size))
+        if format == "jpeg":
+            if im.mode in ("RGBA", "LA", "P"):
+                im = im.convert("RGBA")
+                background = PIL.Image.new("RGB", im.size, (255, 255, 255))
+                background.paste(im, mask=im.getchannel("A"))
+                im = background
+            else:
+                im = im.convert("RGB")
+        elif im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA")
+        out = io.BytesIO()
+        im.save(out, format=format.upper(), quality=80)
+    return out.getvalue(), format
+
+
+def is_enabled(app) -> bool:
+    return PIL is not None and app.config["RENDITION_WORKERS"] > 0
+
+
+def get_executor(app) -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # web 进程中有多个线程，spawn 比 fork 安全
+            _executor = ProcessPoolExecutor(
+                max_workers=app.config["RENDITION_WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def rendition_source(hash: str) -> Union[str, bytes]:
+    store = get_blob_store()
+    path = store.local_path(hash)
+    if path is not None:
+        return path
+    with store.open(hash) as fh:
+        return fh.read()
+
+
+def submit_thumbnail(app, executor, hash: str) -> Optional[Future]:
+    """提交生成缩略图任务，需在 app context 中调用。已有缩略图时返回 None。"""
+    exists = Rendition.query.filter_by(source_hash=hash, name=THUMBNAIL).count()
+    if exists:
+        return None
+    return executor.submit(
+        render_thumbnail,
+        rendition_source(hash),
+        app.config["THUMBNAIL_SIZE"],
+        app.config["THUMBNAIL_FORMAT"],
+    )
+
+
+def save_thumbnail(source_hash: str, future: Future) -> None:
+    """保存缩略图，需在 app context 中调用。"""
+    try:
+        data, type = future.result()
+    except Exception:
+        # 无法识别的图片格式等
+        logger.warning("failed to render thumbnail of %s", source_hash, exc_info=True)
+        return
+
+    try:
+        db.session.add(
+            Rendition(
+                source_hash=source_hash,
+                name=THUMBNAIL,
+                hash=put_blob(data),
+                type=type,
+            )
+        )
+        db.session.commit()
+    except IntegrityError:
+        # 已被其它进程生成，或原图已被删除。回滚时 storage 删除新写入的缩略图文件。
+        db.session.rollback()
+
+
+def schedule_thumbnail(app, hash: Optional[str]) -> None:
+    """在请求之外后台生成缩略图，原图上传并提交后调用。"""
+    if hash is None or not is_enabled(app):
+        return
+
+    future = submit_thumbnail(app, get_executor(app), hash)
+    if future is None:
+        return
+
+    global _pending
+    with _pending_changed:
+        _pending += 1
+
+    def done(future):
+        global _pending
+        try:
+            with app.app_context():
+                save_thumbnail(hash, future)
+        finally:
+            with _pending_changed:
+                _pending -= 1
+                _pending_changed.notify_all()
+
+    future.add_done_callback(done)
+
+
+def wait_pending(timeout: Optional[float] = None) -> bool:
+    """等待已提交的缩略图任务完成。"""
+    with _pending_changed:
+        return _pending_changed.wait_for(lambda: _pending == 0, timeout)
@@ -0,0 +1,145 @@
+import itertools
+import logging
+import time
+from functools import wraps
+from threading import Lock
+from typing import List, Optional
+
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from .querybudget import unbudgeted
+
+logger = logging.getLogger(__name__)
+
+# 用户修改数据后的一段时间内读主库，值为修改的时间戳
+WRITE_COOKIE = "last_write"
+
+REPLICA_LAG_SQL = text(
+    "SELECT COALESCE(CASE"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+    " END, 0)"
+)
+
+
+class RoutingSession(Session):
+    """只读请求中的查询发往 g.replica_engine，写入及 flush 仍发往主库。"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and getattr(clause, "is_select", False)
+            and has_app_context()
+        ):
+            engine = g.get("replica_engine")
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaSet:
+    """从库列表，轮流使用健康的从库。
+
+    每隔 health_interval 秒检查一次从库，无法连接或延迟超过 max_lag 秒时不再使用，
+    直到下次检查恢复正常。
+    """
+
+    def __init__(
+        self, engines: List[Engine], health_interval: float = 5, max_lag: float = 10
+    ):
+        self.engines = engines
+        self.health_interval = health_interval
+        self.max_lag = max_lag
+        self._healthy = {engine: False for engine in engines}
+        self._checked_at = {engine: -health_interval for engine in engines}
+        self._lock = Lock()
+        self._counter = itertools.count()
+        for engine in engines:
+            event.listen(engine, "handle_error", self._on_error)
+
+    def _on_error(self, context) -> None:
+        if context.is_disconnect and context.engine is not None:
+            self.mark_unhealthy(context.engine)
+
+    def mark_unhealthy(self, engine: Engine) -> None:
+        with self._lock:
+            self._healthy[engine] = False
+            self._checked_at[engine] = time.monotonic()
+
+    def check(self, engine: Engine) -> bool:
+        try:
+            with unbudgeted(), engine.connect() as conn:
+                lag = conn.execute(REPLICA_LAG_SQL).scalar()
+        except Exception:
+            logger.warning("replica %s is unavailable", engine.url, exc_info=True)
+            return False
+        if lag > self.max_lag:
+            logger.warning("replica %s lags %.1f seconds", engine.url, lag)
+            return False
+        return True
+
+    def is_healthy(self, engine: Engine) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at[engine] < self.health_interval:
+                return self._healthy[engine]
+            # 其它线程在检查期间沿用上次的结果
+            self._checked_at[engine] = now
+        healthy = self.check(engine)
+        with self._lock:
+            self._healthy[engine] = healthy
+        return healthy
+
+    def choose(self) -> Optional[Engine]:
+        """返回一个健康的从库，都不可用时返回 None。"""
+        start = next(self._counter)
+        for i in range(len(self.engines)):
+            engine = self.engines[(start + i) % len(self.engines)]
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+
+def get_replica_set() -> Optional[ReplicaSet]:
+    return current_app.extensions.get("replicas")
+
+
+def wrote_recently() -> bool:
+    try:
+        last_write = float(request.cookies[WRITE_COOKIE])
+    except (KeyError, ValueError):
+        return False
+    return time.time() - last_write < current_app.config["REPLICA_READ_AFTER_WRITE"]
+
+
+def read_replica(view):
+    """只读的 view 在从库上查询。用户最近修改过数据时仍读主库，保证读到自己的修改。"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        replicas = get_replica_set()
+        if replicas is not None and not wrote_recently():
+            g.replica_engine = replicas.choose()
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def mark_write(resp):
+    """after_request：修改数据的请求成功后设置 WRITE_COOKIE。"""
+    if (
+        get_replica_set() is not None
+        and request.method not in ("GET", "HEAD", "OPTIONS")
+        and resp.status_code < 400
+    ):
+        resp.set_cookie(
+            WRITE_COOKIE,
+            str(time.time()),
+            max_age=current_app.config["REPLICA_READ_AFTER_WRITE"],
+            httponly=True,
+        )
+    return resp
@@ -0,0 +1,143 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+from uuid import uuid4
+
+from werkzeug.security import generate_password_hash
+
+from .counters import reconcile_image_counters
+from .models import Blob, Group, Image, Tag, User, db
+from .storage import put_blob
+
+SEED_PASSWORD = "password"
+
+SYLLABLES = (
+    "猫 狗 熊 兔 哈 嘿 呵 笑 哭 怒 惊 赞 滑稽 doge cat lol ok yes no wow"
+    " happy sad meme gif emoji 表情 斗图 沙雕 可爱 无语 加油 晚安 早安"
+).split()
+
+
+def zipf_weights(n: int, s: float = 1.0) -> List[float]:
+    """少数 blob、标签被大量使用，与真实数据的分布相近。"""
+    return [1 / (i + 1) ** s for i in range(n)]
+
+
+def random_bytes(rnd: random.Random, size: int) -> bytes:
+    return rnd.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def add_blob_refs(counts: Counter) -> None:
+    for key, count in counts.items():
+        Blob.query.filter_by(hash=key).update(
+            {Blob.ref_count: Blob.ref_count + count}, synchronize_session=False
+        )
+
+
+def seed_corpus(
+    users: int = 1,
+    images: int = 1000,
+    groups: int = 10,
+    tags: int = 3,
+    blobs: int = 100,
+    blob_kb: int = 100,
+    seed: int = 0,
+    batch_size: int = 5000,
+    echo: Optional[Callable[[str], None]] = None,
+) -> List[int]:
+    """生成测试数据，需在 app context 中调用。相同的 seed 生成相同的数据（邮箱除外）。
+
+    Params:
+        images [int]: 每个用户的图片数量，约 3% 在回收站中
+        groups [int]: 每个用户的组数量，约 70% 的图片在组中
+        tags [int]: 每张图片平均的标签数量
+        blobs [int]: 不同图片内容的数量，图片按 Zipf 分布共用
+        blob_kb [int]: 图片内容的平均大小（KB）
+    Return:
+        user_ids
+    """
+    rnd = random.Random(seed)
+    now = datetime.now()
+
+    blob_keys = []
+    for _ in range(blobs):
+        size = int(rnd.lognormvariate(0, 0.5) * blob_kb * 1024)
+        blob_keys.append(put_blob(random_bytes(rnd, size)))
+    # put_blob 计了一次引用，按图片实际引用的次数计数
+    add_blob_refs(Counter({key: -1 for key in blob_keys}))
+    blob_weights = zipf_weights(blobs)
+    vocabulary = list(
+        {"".join(rnd.choices(SYLLABLES, k=rnd.randint(1, 3))) for _ in range(500)}
+    )
+    vocabulary.sort()
+    tag_weights = zipf_weights(len(vocabulary))
+    db.session.commit()
+
+    # 各用户的密码相同，只计算一次哈希
+    password = generate_password_hash(SEED_PASSWORD)
+    run = uuid4().hex[:8]
+    user_ids = []
+    for u in range(users):
+        user_id = db.session.execute(
+            db.insert(User)
+            .values(email=f"seed-{run}-{u}@example.com", password=password)
+            .returning(User.id)
+        ).scalar()
+        group_ids = []
+        if groups:
+            group_ids = [
+                id
+                for id, in db.session.execute(
+                    db.insert(Group)
+                    .values(
+                        [{"name": f"分组{i}", "user_id": user_id} for i in range(groups)]
+                    )
+                    .returning(Group.id)
+                )
+            ]
+
+        for start in range(0, images, batch_size):
+            rows = []
+            for _ in range(min(batch_size, images - start)):
+                is_deleted = rnd.random() < 0.03
+                create_at = now - timedelta(seconds=rnd.uniform(0, 365 * 24 * 3600))
+                hash = rnd.choices(blob_keys, blob_weights)[0] if blob_keys else None
+                group_id = None
+                if group_ids and rnd.random() < 0.7:
+                    group_id = rnd.choice(group_ids)
+                rows.append(
+                    {
+                        "user_id": user_id,
+                        "type": "jpeg",
+                        "hash": hash,
+                        "group_id": group_id,
+                        "is_deleted": is_deleted,
+                        "deleted_at": now if is_deleted else None,
+                        "create_at": create_at,
+                    }
+                )
+            image_ids = [
+                id
+                for id, in db.session.execute(
+                    db.insert(Image).values(rows).returning(Image.id)
+                )
+            ]
+            add_blob_refs(Counter(row["hash"] for row in rows if row["hash"]))
+
+            tag_rows = [
+                {"text": text, "image_id": image_id, "user_id": user_id}
+                for image_id in image_ids
+                for text in dict.fromkeys(
+                    rnd.choices(vocabulary, tag_weights, k=rnd.randint(0, tags * 2))
+                )
+            ]
+            if tag_rows:
+                db.session.execute(db.insert(Tag), tag_rows)
+            db.session.commit()
+            if echo is not None:
+                echo(f"User {user_id}: {start + len(rows)} images.")
+        user_ids.append(user_id)
+
+    reconcile_image_counters()
+    db.session.commit()
+    return user_ids
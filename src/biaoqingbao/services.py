@@ -1,11 +1,135 @@
+import logging
+import select
+import threading
+import time
+from datetime import datetime, timedelta
 from email.message import EmailMessage
-from smtplib import SMTP_SSL
+from smtplib import (
+    SMTP,
+    SMTP_SSL,
+    SMTPException,
+    SMTPRecipientsRefused,
+    SMTPResponseException,
+    SMTPServerDisconnected,
+)
+from typing import Optional
+
+from flask import current_app
 
 from .configs import configs
+from .models import OutboxEmail, db
+
+logger = logging.getLogger(__name__)
+
+# 发件箱有新邮件时通知 mail-worker
+OUTBOX_CHANNEL = "email_outbox"
+MAX_RETRY_DELAY = 3600
+
+
+def build_email(to_addrs: str, subject: str, content: str) -> EmailMessage:
+    email = EmailMessage()
+    email["Subject"] = subject
+    email["From"] = f"bqb-admin <{configs.EMAIL_USERNAME}>"
+    email["To"] = to_addrs
+    email.set_content(content)
+    return email
+
+
+class SMTPSender:
+    """复用已登录的 SMTP 连接发送多封邮件，连接断开或空闲过久时重新连接。"""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        use_ssl: bool = True,
+        timeout: float = 10,
+        idle_timeout: float = 60,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self._client = None
+        self._last_used = 0
+
+    @classmethod
+    def from_config(cls, config) -> "SMTPSender":
+        return cls(
+            config["EMAIL_HOST"],
+            config["EMAIL_PORT"],
+            config["EMAIL_USERNAME"],
+            config["EMAIL_PASSWORD"],
+            use_ssl=config["EMAIL_USE_SSL"],
+            timeout=config["EMAIL_TIMEOUT"],
+        )
+
+    def _connect(self):
+        client_class = SMTP_SSL if self.use_ssl else SMTP
+        client = client_class(self.host, self.port, timeout=self.timeout)
+        try:
+            client.ehlo()
+            # 本地测试用的 SMTP 服务器不需要登录
+            if client.has_extn("auth"):
+                client.login(self.username, self.password)
+        except BaseException:
+            client.close()
+            raise
+        self._client = client
+        self.connections += 1
+
+    def send(self, email: EmailMessage) -> dict:
+        """
+        Return:
+            errors [dict]: {'<recepient>': (<error_code>, <error_msg>), ...}
+        Exception:
+            SMTPException, OSError
+        """
+        if (
+            self._client is not None
+            and time.monotonic() - self._last_used > self.idle_timeout
+        ):
+            # 服务器多半已断开空闲连接
+            self.close()
+        if self._client is None:
+            self._connect()
+        try:
+            errors = self._client.send_message(email)
+        except SMTPServerDisconnected:
+            self.close()
+            self._connect()
+            errors = self._client.send_message(email)
+        except BaseException:
+            self.close()
+            raise
+        self._last_used = time.monotonic()
+        return errors
+
+    def close(self) -> None:
+        client, self._client = self._client, None
+        if client is None:
+            return
+        try:
+            client.quit()
+        except (SMTPException, OSError):
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 def send_email(to_addrs: str, subject: str, content: str) -> dict:
-    """
+    """立即发送邮件。web 请求中应使用 enqueue_email。
+
     Params:
         to_addrs [str]: 多个则以英文逗号隔开
     Return:
@@ -13,15 +137,116 @@ def send_email(to_addrs: str, subject: str, content: str) -> dict:
     Exception:
         SMTPException: 这个是所有smtplib exception 的base exception class。
     """
-    email = EmailMessage()
-    email["Subject"] = subject
-    email["From"] = f"bqb-admin <{configs.EMAIL_USERNAME}>"
-    email["To"] = to_addrs
-    email.set_content(content)
+    with SMTPSender.from_config(configs.dict()) as sender:
+        return sender.send(build_email(to_addrs, subject, content))
+
+
+def enqueue_email(to_addrs: str, subject: str, content: str) -> OutboxEmail:
+    """将邮件加入发件箱，在调用方的事务中执行，提交后由 `biaoqingbao mail-worker` 发送。
+
+    Params:
+        to_addrs [str]: 多个则以英文逗号隔开
+    """
+    email = OutboxEmail(to_addrs=to_addrs, subject=subject, content=content)
+    db.session.add(email)
+    # 提交时唤醒 mail worker
+    db.session.execute(
+        db.text("SELECT pg_notify(:channel, '')"), {"channel": OUTBOX_CHANNEL}
+    )
+    return email
+
+
+def record_failure(email: OutboxEmail, error: Exception, permanent: bool) -> None:
+    email.attempts += 1
+    email.last_error = repr(error)
+    if permanent or email.attempts >= current_app.config["EMAIL_MAX_ATTEMPTS"]:
+        email.status = "failed"
+        logger.error("failed to send email %s: %r", email.id, error)
+    else:
+        delay = current_app.config["EMAIL_RETRY_DELAY"] * 2 ** (email.attempts - 1)
+        email.next_attempt_at = datetime.utcnow() + timedelta(
+            seconds=min(delay, MAX_RETRY_DELAY)
+        )
+        logger.warning("failed to send email %s, will retry: %r", email.id, error)
+
+
+def deliver_pending_emails(sender: SMTPSender) -> int:
+    """发送一批到期的邮件，需在 app context 中调用。多个 worker 可同时执行。
+
+    Return:
+        本批处理的邮件数量，0 表示没有到期的邮件
+    """
+    emails = (
+        OutboxEmail.query.filter(
+            OutboxEmail.status == "pending",
+            OutboxEmail.next_attempt_at <= datetime.utcnow(),
+        )
+        .order_by(OutboxEmail.id)
+        .limit(current_app.config["EMAIL_BATCH_SIZE"])
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for i, email in enumerate(emails):
+        try:
+            errors = sender.send(
+                build_email(email.to_addrs, email.subject, email.content)
+            )
+        except SMTPRecipientsRefused as e:
+            record_failure(email, e, permanent=True)
+        except SMTPResponseException as e:
+            # 5xx 为永久错误，重试无用
+            record_failure(email, e, permanent=e.smtp_code >= 500)
+        except (SMTPException, OSError) as e:
+            # 无法连接服务器，本批其余邮件也稍后再发
+            for pending in emails[i:]:
+                record_failure(pending, e, permanent=False)
+            break
+        else:
+            if errors:
+                logger.warning("email %s refused by %s", email.id, errors)
+            email.status = "sent"
+            email.sent_at = datetime.utcnow()
+    db.session.commit()
+    return len(emails)
+
+
+def run_mail_worker(
+    app,
+    poll_interval: float = 5,
+    once: bool = False,
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """发送发件箱中的邮件。有新邮件时通过 LISTEN/NOTIFY 立即唤醒，重试的邮件按 poll_interval 轮询。
+
+    Params:
+        once [bool]: 发完到期的邮件后退出
+        stop [threading.Event]: 设置后在下次唤醒时退出
+    """
+    with app.app_context(), SMTPSender.from_config(app.config) as sender:
+        listener = None
+        if not once:
+            listener = db.engine.raw_connection()
+            listener.detach()
+            listener.connection.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {OUTBOX_CHANNEL}")
+        try:
+            while True:
+                while deliver_pending_emails(sender):
+                    pass
+                if once or (stop is not None and stop.is_set()):
+                    return
+                wait_for_notify(listener.connection, poll_interval)
+        finally:
+            if listener is not None:
+                listener.close()
 
-    TIMEOUT = 2
-    with SMTP_SSL(configs.EMAIL_HOST, timeout=TIMEOUT) as client:
-        client.login(configs.EMAIL_USERNAME, configs.EMAIL_PASSWORD)
-        errors = client.send_message(email)
 
-    return errors
+def wait_for_notify(connection, timeout: float) -> bool:
+    """等待 psycopg2 连接收到 NOTIFY，超时返回 False。"""
+    readable, _, _ = select.select([connection], [], [], timeout)
+    if not readable:
+        return False
+    connection.poll()
+    connection.notifies.clear()
+    return True
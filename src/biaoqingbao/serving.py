@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+import tempfile
+from typing import Optional
+
+from waitress import serve
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn 为生产环境依赖（poetry install --with prod）
+    BaseApplication = None
+
+# 每个 CPU 的默认线程数，可在部署机器上运行 benchmarks/serving.py 重新选择。
+# 默认线程数不超过每个进程的连接数（max_threads，见 engine.pool_capacity），
+# 多出的线程只会排队等待连接，直到 DATABASE_POOL_TIMEOUT 超时。
+THREADS_PER_CPU = 4
+# 超过此大小的响应暂存到临时文件，大部分图片可留在内存中
+OUTBUF_OVERFLOW = 8 * 1024 * 1024
+# 待发送数据超过此大小时暂停读取响应，限制慢速客户端占用的内存
+OUTBUF_HIGH_WATERMARK = 32 * 1024 * 1024
+RECV_BYTES = 64 * 1024
+# 同 metrics.MULTIPROC_DIR_ENV，此模块不导入 metrics，以免在设置前导入 prometheus_client
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+
+def cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def prepare_metrics_dir() -> str:
+    """gunicorn 各 worker 的指标写入 PROMETHEUS_MULTIPROC_DIR，由 /metrics 汇总。
+
+    须在创建 app（导入 prometheus_client）之前调用。未设置时使用临时目录，
+    已设置时删除上次运行留下的文件。
+    """
+    path = os.environ.get(MULTIPROC_DIR_ENV)
+    if path is None:
+        path = tempfile.mkdtemp(prefix="biaoqingbao-metrics-")
+        os.environ[MULTIPROC_DIR_ENV] = path
+    else:
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".db"):
+                os.remove(os.path.join(path, name))
+    return path
+
+
+def child_exit(server, worker) -> None:
+    from .metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
+
+
+def default_threads(threads: int, max_threads: Optional[int]) -> int:
+    if max_threads is None:
+        return threads
+    return max(1, min(threads, max_threads))
+
+
+def waitress_options(
+    host: str = "127.0.0.1",
+    port: int = 5000,
+    unix_socket: Optional[str] = None,
+    threads: Optional[int] = None,
+    max_threads: Optional[int] = None,
+) -> dict:
+    """waitress.serve 的参数。
+
+    Params:
+        max_threads [int]: 未指定 threads 时默认线程数的上限，一般为连接池大小
+    """
+    if threads is None:
+        threads = default_threads(cpu_count() * THREADS_PER_CPU, max_threads)
+    options = {
+        "threads": threads,
+        # 同时保持的连接数需多于线程数，否则空闲的长连接会占满
+        "connection_limit": max(100, threads * 4),
+        "outbuf_overflow": OUTBUF_OVERFLOW,
+        "outbuf_high_watermark": OUTBUF_HIGH_WATERMARK,
+        "recv_bytes": RECV_BYTES,
+        "asyncore_use_poll": True,
+        "ident": "biaoqingbao",
+        "clear_untrusted_proxy_headers": True,
+    }
+    if unix_socket:
+        # nginx 与 biaoqingbao 同组时可以访问
+        options.update(unix_socket=unix_socket, unix_socket_perms="660")
+    else:
+        options.update(host=host, port=port)
+    return options
+
+
+def gunicorn_options(
+    host: str = "127.0.0.1",
+    port: int = 5000,
+    unix_socket: Optional[str] = None,
+    workers: Optional[int] = None,
+    threads: Optional[int] = None,
+    max_threads: Optional[int] = None,
+    max_requests: int = 1000,
+    max_requests_jitter: int = 100,
+    metrics_host: str = "127.0.0.1",
+    metrics_port: Optional[int] = None,
+) -> dict:
+    """gunicorn gthread worker 的配置，gunicorn.conf.py 也使用此配置。
+
+    preload_app 时 app 在 master 中创建，fork 后各 worker 丢弃继承的数据库连接
+    （见 engine.setup_engine）。metrics_port 不为空时 master 在此端口上提供各 worker
+    汇总的 /metrics。max_threads 为未指定 threads 时每个 worker 线程数的上限。
+    """
+    if workers is None:
+        workers = cpu_count()
+    if threads is None:
+        threads = default_threads(THREADS_PER_CPU, max_threads)
+    options = {
+        "bind": f"unix:{unix_socket}" if unix_socket else f"{host}:{port}",
+        "worker_class": "gthread",
+        "workers": workers,
+        "threads": threads,
+        "preload_app": True,
+        # 定期重启 worker 释放内存碎片，jitter 避免所有 worker 同时重启
+        "max_requests": max_requests,
+        "max_requests_jitter": max_requests_jitter,
+        "keepalive": 5,
+        "child_exit": child_exit,
+    }
+    if metrics_port is not None:
+
+        def when_ready(server):
+            from .metrics import start_metrics_server
+
+            start_metrics_server(metrics_host, metrics_port)
+
+        options["when_ready"] = when_ready
+    if unix_socket:
+        options["umask"] = 0o007
+    if os.path.isdir("/dev/shm"):
+        # worker 心跳文件放在内存中，磁盘繁忙时不会误判 worker 超时
+        options["worker_tmp_dir"] = "/dev/shm"
+    return options
+
+
+def serve_waitress(
+    app, metrics_host: str = "127.0.0.1", metrics_port: Optional[int] = None, **kwargs
+) -> None:
+    if metrics_port is not None:
+        from .metrics import start_metrics_server
+
+        start_metrics_server(metrics_host, metrics_port)
+    serve(app, **waitress_options(**kwargs))
+
+
+def serve_gunicorn(app_factory, **kwargs) -> None:
+    """
+    Params:
+        app_factory [Callable]: 返回 WSGI app，preload_app 时在 master 中调用
+    """
+    if BaseApplication is None:
+        raise RuntimeError("gunicorn is not installed")
+    prepare_metrics_dir()
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options(**kwargs).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app_factory()
+
+    Application().run()
@@ -0,0 +1,292 @@
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import Blob, Image, Rendition, db
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# 数据库存储每次追加的字节数。Postgres 每次追加都会重写整个值，块不宜过小
+DATABASE_CHUNK_SIZE = 1024 * 1024
+
+# 内容不在数据库事务中的存储（本地文件），按 key 加 advisory lock（两个 int4 参数，
+# 第一个区分用途，见 migrations.MIGRATION_LOCK_ID）：新建 blob 行的事务持有共享锁直到
+# 结束，删除内容前须取得排它锁并确认 blob 行不存在，不会删除其它事务重新上传、尚未提交的内容。
+BLOB_LOCK_CLASS = 0x62716207
+
+
+class BlobStore:
+    """blob 内容存储后端，blob 以其内容的 sha256 十六进制摘要作为 key。"""
+
+    # 内容与 blob 行在同一事务中写入、删除
+    transactional = False
+
+    def write(self, key: str, fileobj: BinaryIO) -> None:
+        raise NotImplementedError
+
+    def open(self, key: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def remove(self, key: str) -> None:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """内容存放在本地文件时返回文件路径，否则返回 None。"""
+        return None
+
+
+class DatabaseBlobStore(BlobStore):
+    """blob 内容存放在 blob.data 列中，即原来图片存放在数据库中的方式。"""
+
+    transactional = True
+
+    def write(self, key, fileobj):
+        # 逐块追加，不将整个上传读入内存。块作为执行参数传入，不留在语句对象中
+        update = db.update(Blob).where(Blob.hash == key)
+        chunk = db.bindparam("chunk", type_=db.LargeBinary)
+        db.session.execute(
+            update.values(data=chunk), {"chunk": fileobj.read(DATABASE_CHUNK_SIZE)}
+        )
+        append = update.values(data=Blob.data.concat(chunk))
+        for data in iter(lambda: fileobj.read(DATABASE_CHUNK_SIZE), b""):
+            db.session.execute(append, {"chunk": data})
+
+    def open(self, key):
+        data = db.session.query(Blob.data).filter_by(hash=key).scalar()
+        return io.BytesIO(data)
+
+    def remove(self, key):
+        # 内容随 blob 行一起删除
+        pass
+
+
+class LocalBlobStore(BlobStore):
+    """blob 内容存放在本地目录中，按 key 前缀分两级目录：<root>/ab/cd/abcd..."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / key[2:4] / key
+
+    def write(self, key, fileobj):
+        path = self.path(key)
+        if path.exists():
+            return
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                shutil.copyfileobj(fileobj, fh, CHUNK_SIZE)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def open(self, key):
+        return open(self.path(key), "rb")
+
+    def local_path(self, key):
+        return str(self.path(key))
+
+    def remove(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+def create_blob_store(configs) -> BlobStore:
+    if configs.BLOB_STORAGE == "local":
+        return LocalBlobStore(configs.BLOB_STORAGE_PATH)
+    else:
+        return DatabaseBlobStore()
+
+
+def get_blob_store() -> BlobStore:
+    return current_app.extensions["blob_store"]
+
+
+def put_blob(data: bytes) -> str:
+    """
+    Return:
+        key [str]: blob 的 sha256 摘要
+    """
+    return put_blob_file(io.BytesIO(data), hashlib.sha256(data).hexdigest(), len(data))
+
+
+def put_blob_file(fileobj: BinaryIO, key: str, size: int) -> str:
+    """引用计数加一，blob 不存在时写入内容。在调用方的事务中执行。
+
+    Params:
+        fileobj [BinaryIO]: 内容，需已定位到开头
+        key [str]: 内容的 sha256 摘要
+        size [int]: 内容字节数
+    Return:
+        key [str]
+    """
+    if _incr_ref_count({key: 1}):
+        return key
+
+    store = get_blob_store()
+    if not store.transactional:
+        db.session.execute(
+            db.text("SELECT pg_advisory_xact_lock_shared(:lock_class, :lock_id)"),
+            {"lock_class": BLOB_LOCK_CLASS, "lock_id": blob_lock_id(key)},
+        )
+    try:
+        with db.session.begin_nested():
+            db.session.add(Blob(hash=key, size=size, ref_count=1))
+    except IntegrityError:
+        # 其它请求同时上传了相同内容
+        _incr_ref_count({key: 1})
+        return key
+
+    store.write(key, fileobj)
+    if not store.transactional:
+        # 事务未提交时删除内容（内容已存在、未重新写入时也可能是无用的残留文件）
+        db.session.info.setdefault("written_blobs", set()).add(key)
+        db.session.info["blob_store"] = store
+    return key
+
+
+def release_blobs(keys: Iterable[str]) -> None:
+    """引用计数减一（每个 key 出现一次减一），降为 0 的 blob 在事务提交后删除内容。"""
+    counts = Counter(k for k in keys if k is not None)
+    if not counts:
+        return
+
+    _incr_ref_count({k: -n for k, n in counts.items()})
+    unreferenced = [
+        key
+        for key, in db.session.query(Blob.hash)
+        .filter(Blob.hash.in_(counts), Blob.ref_count <= 0)
+        .all()
+    ]
+    if not unreferenced:
+        return
+
+    # 衍生图片随原图一起删除
+    renditions = Rendition.query.filter(Rendition.source_hash.in_(unreferenced))
+    rendition_hashes = [hash for hash, in renditions.with_entities(Rendition.hash)]
+    renditions.delete(synchronize_session=False)
+    release_blobs(rendition_hashes)
+
+    Blob.query.filter(Blob.hash.in_(unreferenced)).delete(synchronize_session=False)
+    pending = db.session.info.setdefault("released_blobs", set())
+    pending.update(unreferenced)
+    db.session.info["blob_store"] = get_blob_store()
+
+
+def release_blob(key: str) -> None:
+    release_blobs([key])
+
+
+def _incr_ref_count(deltas: dict) -> int:
+    """
+    Params:
+        deltas [dict]: {<key>: <delta>, ...}
+    Return:
+        updated [int]: 更新的行数
+    """
+    by_delta = defaultdict(list)
+    for key, delta in deltas.items():
+        by_delta[delta].append(key)
+
+    updated = 0
+    for delta, keys in by_delta.items():
+        updated += Blob.query.filter(Blob.hash.in_(keys)).update(
+            {Blob.ref_count: Blob.ref_count + delta}, synchronize_session=False
+        )
+    return updated
+
+
+def blob_lock_id(key: str) -> int:
+    """key 的前 32 位作为 int4，不同 key 的锁冲突时只是多等待。"""
+    return int(key[:8], 16) - 2**31
+
+
+def remove_unreferenced(bind, store: BlobStore, keys: Iterable[str]) -> None:
+    """删除已没有 blob 行的内容。其它事务正在新建 blob 行的 key 取不到锁，跳过，
+    由该事务结束后处理。"""
+    if store.transactional:
+        return
+
+    keys = sorted(keys)
+    try:
+        with bind.begin() as conn:
+            locked = (
+                conn.execute(
+                    db.text(
+                        "SELECT key FROM unnest(:keys, :lock_ids) AS t(key, lock_id)"
+                        " WHERE pg_try_advisory_xact_lock(:lock_class, lock_id)"
+                    ),
+                    {
+                        "keys": keys,
+                        "lock_ids": [blob_lock_id(key) for key in keys],
+                        "lock_class": BLOB_LOCK_CLASS,
+                    },
+                )
+                .scalars()
+                .all()
+            )
+            if not locked:
+                return
+            alive = set(
+                conn.execute(
+                    db.select(Blob.hash).where(Blob.hash.in_(locked))
+                ).scalars()
+            )
+            # 持有锁时删除，提交后释放锁
+            for key in set(locked) - alive:
+                store.remove(key)
+    except Exception:
+        # 只会残留无用的文件
+        logger.warning("failed to remove blobs %s", keys, exc_info=True)
+
+
+@event.listens_for(Session, "after_commit")
+def _remove_released_blobs(session):
+    session.info.pop("written_blobs", None)
+    keys = session.info.pop("released_blobs", None)
+    store = session.info.pop("blob_store", None)
+    if keys:
+        remove_unreferenced(session.get_bind(), store, keys)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _remove_written_blobs(session, transaction):
+    # 未提交（回滚或关闭）时 after_commit 没有执行
+    if transaction.parent is None:
+        session.info.pop("released_blobs", None)
+        keys = session.info.pop("written_blobs", None)
+        store = session.info.pop("blob_store", None)
+        if keys:
+            remove_unreferenced(session.get_bind(), store, keys)
+
+
+def open_image(image) -> BinaryIO:
+    """
+    Params:
+        image [Image | Row]: 需要有 id、hash 属性
+    """
+    if image.hash is not None:
+        return get_blob_store().open(image.hash)
+    else:
+        data = db.session.query(Image.data).filter_by(id=image.id).scalar()
+        return io.BytesIO(data)
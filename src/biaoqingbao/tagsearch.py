@@ -0,0 +1,153 @@
+from collections import OrderedDict, defaultdict
+from threading import Lock
+from typing import Iterable, List, Tuple
+
+from flask import current_app, g
+from sqlalchemy import event
+
+from .models import Tag, db
+from .querybudget import unbudgeted
+from .utils import any_id
+from .versions import get_tag_version
+
+# pg_trgm GIN 索引，新建的表在 after_create 中创建，已有的数据库由迁移创建
+TRIGRAM_INDEX = "ix_tag_text_trgm"
+
+# 匹配的标签超过此数量时改用 LIKE，不向数据库发送过长的 id 数组
+MAX_INDEX_MATCHES = 1000
+
+
+class NgramIndex:
+    """内存中的 n-gram 倒排索引，用于子串搜索。建好后只读，新增或修改标签后重建。
+
+    同时索引长度为 1 到 n 的 gram，中文标签通常很短，搜索词常只有一两个字。
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, str]], n: int = 2):
+        """
+        Params:
+            rows [Iterable[(id, text)]]
+        """
+        self.n = n
+        self.texts = {}
+        self.postings = defaultdict(list)
+        for id, text in rows:
+            self.texts[id] = text
+            grams = set()
+            for k in range(1, n + 1):
+                grams.update(self._grams(text, k))
+            for gram in grams:
+                self.postings[gram].append(id)
+
+    @staticmethod
+    def _grams(text: str, k: int) -> set:
+        return {text[i : i + k] for i in range(len(text) - k + 1)}
+
+    def search(self, term: str) -> List[int]:
+        """返回 text 包含 term 的 id。"""
+        if not term:
+            return list(self.texts)
+
+        # 只需取最短的倒排表，再逐个确认是否包含 term
+        grams = self._grams(term, min(len(term), self.n))
+        candidates = min((self.postings.get(g, ()) for g in grams), key=len)
+        if len(term) == 1:
+            return list(candidates)
+        texts = self.texts
+        return [id for id in candidates if term in texts[id]]
+
+
+class TagIndexCache:
+    """每个用户一个 NgramIndex，按用户的 tag_version 判断是否过期，LRU 淘汰。"""
+
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id: int) -> NgramIndex:
+        # 先读版本号再读标签：并发修改时最多导致多重建一次，不会用到过期的索引。
+        version = get_tag_version(user_id)
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._indexes.move_to_end(user_id)
+                return entry[1]
+
+        rows = db.session.query(Tag.id, Tag.text).filter_by(user_id=user_id).all()
+        index = NgramIndex(rows)
+        with self._lock:
+            self._indexes[user_id] = (version, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+
+
+def get_backend() -> str:
+    """
+    Return:
+        backend [str]:
+            - "trigram": LIKE 查询，使用 pg_trgm GIN 索引。
+            - "ngram": 进程内 n-gram 索引。
+            - "like": LIKE 查询，不使用索引。
+    """
+    backend = current_app.extensions.get("tag_search")
+    if backend is None:
+        backend = current_app.config["TAG_SEARCH"]
+        if backend == "auto":
+            backend = "trigram" if has_trigram_index() else "ngram"
+        current_app.extensions["tag_search"] = backend
+    return backend
+
+
+def has_trigram_index() -> bool:
+    """只安装了 pg_trgm 扩展而没有索引时（迁移尚未执行）LIKE 仍是全表扫描。"""
+    with unbudgeted():
+        return bool(
+            db.session.execute(
+                db.text(
+                    "SELECT 1 FROM pg_indexes"
+                    " WHERE tablename = 'tag' AND indexname = :name"
+                ),
+                {"name": TRIGRAM_INDEX},
+            ).scalar()
+        )
+
+
+def get_tag_index(user_id: int) -> NgramIndex:
+    """同一 app context（请求）中的多个标签条件只检查一次版本号。"""
+    indexes = g.setdefault("tag_indexes", {})
+    if user_id not in indexes:
+        cache = current_app.extensions["tag_index_cache"]
+        indexes[user_id] = cache.get(user_id)
+    return indexes[user_id]
+
+
+def tag_text_filter(user_id: int, text: str):
+    """Tag.text 包含 text 的查询条件。"""
+    if get_backend() == "ngram":
+        ids = get_tag_index(user_id).search(text)
+        if len(ids) <= MAX_INDEX_MATCHES:
+            return Tag.id == any_id(ids)
+    return Tag.text.contains(text, autoescape=True)
+
+
+@event.listens_for(Tag.__table__, "after_create")
+def create_trigram_index(target, connection, **kw):
+    available = connection.execute(
+        db.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    ).scalar()
+    if not available:
+        return
+    connection.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    connection.execute(
+        db.text(
+            f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX}"
+            " ON tag USING gin (text gin_trgm_ops)"
+        )
+    )
@@ -0,0 +1,63 @@
+import hashlib
+import tempfile
+from typing import Optional
+
+from flask import Request as BaseRequest
+from flask import current_app
+
+SNIFF_SIZE = 12
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """根据文件头识别图片格式，无法识别时返回 None。"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    elif head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    elif head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    elif head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    elif head[:2] == b"BM":
+        return "bmp"
+    else:
+        return None
+
+
+class UploadSpool:
+    """上传文件的临时文件，写入时同时计算 sha256 并识别图片格式。
+
+    超过 max_memory_size 的内容写到磁盘上，因此单个上传占用的内存有上限。
+    """
+
+    def __init__(self, max_memory_size: int):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._head = b""
+
+    def write(self, b) -> int:
+        self._hash.update(b)
+        if len(self._head) < SNIFF_SIZE:
+            self._head += bytes(b[: SNIFF_SIZE - len(self._head)])
+        self.size += len(b)
+        return self.file.write(b)
+
+    @property
+    def hash(self) -> str:
+        return self._hash.hexdigest()
+
+    @property
+    def type(self) -> Optional[str]:
+        return sniff_image_type(self._head)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class Request(BaseRequest):
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        # multipart 解析器按固定大小的块写入，文件内容不会整体读入内存。
+        return UploadSpool(current_app.config["UPLOAD_SPOOL_MEMORY_SIZE"])
@@ -1,6 +1,18 @@
 from random import choice
 from string import digits
+from typing import List
+
+from sqlalchemy import Integer, any_, literal
+from sqlalchemy.dialects.postgresql import ARRAY
 
 
 def generate_passcode() -> str:
     return "".join(choice(digits) for i in range(4))
+
+
+def any_id(ids: List[int]):
+    """eg. Image.id == any_id(ids)
+
+    以一个数组参数传入，id 数量多时不会生成上千个绑定参数。
+    """
+    return any_(literal(ids, ARRAY(Integer)))
@@ -0,0 +1,22 @@
+from .models import User, db
+
+
+def bump_data_version(user_id: int, tags: bool = False) -> None:
+    """用户数据变更时调用，在调用方的事务中执行。
+
+    Params:
+        tags [bool]: 新增标签或修改了标签文本，使进程内的标签索引（见 tagsearch）失效。
+            删除标签不需要，索引中多余的 id 不会匹配到图片。
+    """
+    values = {User.data_version: User.data_version + 1}
+    if tags:
+        values[User.tag_version] = User.tag_version + 1
+    User.query.filter_by(id=user_id).update(values, synchronize_session=False)
+
+
+def get_data_version(user_id: int) -> int:
+    return db.session.query(User.data_version).filter_by(id=user_id).scalar()
+
+
+def get_tag_version(user_id: int) -> int:
+    return db.session.query(User.tag_version).filter_by(id=user_id).scalar()
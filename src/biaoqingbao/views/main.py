@@ -1,27 +1,59 @@
+import base64
+import binascii
 import io
-import zipfile
-from typing import Tuple
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
-from flask import Blueprint, Response, json, jsonify, request, send_file
+import jwt
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    json,
+    jsonify,
+    redirect,
+    request,
+    stream_with_context,
+)
+from werkzeug.wsgi import wrap_file
 
 from .. import db
 from ..auth import decode_token
-from ..models import Group, Image, Tag
+from ..cache import cached_response
+from ..counters import adjust_image_counters
+from ..models import Blob, Group, Image, PurgeJob, Rendition, Tag, User
+from ..purge import create_purge_job, schedule_purge_job
+from ..querybudget import query_budget
+from ..renditions import THUMBNAIL, schedule_thumbnail
+from ..replicas import read_replica
+from ..storage import (
+    open_image,
+    put_blob_file,
+    release_blob,
+    release_blobs,
+)
+from ..tagsearch import tag_text_filter
+from ..utils import any_id
+from ..versions import bump_data_version
+from ..zipstream import ZipStream
 
 bp_main = Blueprint("bp_main", __name__)
 
 RECYCLE_BIN_GROUP_ID = -1
+EXPORT_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 5000
 
 
 @bp_main.before_request
 def handle_authen():
+    start = time.perf_counter()
     try:
-        token = request.cookies["token"]
-        session = decode_token(token)
-        assert "user_id" in session
-        request.session = session
-    except:
+        session = decode_token(request.cookies["token"])
+        if "user_id" not in session:
+            raise jwt.InvalidTokenError("user_id")
+    except (KeyError, jwt.InvalidTokenError):
         return (
             jsonify(
                 {
@@ -31,18 +63,40 @@ def handle_authen():
             401,
         )
     else:
+        request.session = session
         return
+    finally:
+        request.auth_duration = time.perf_counter() - start
+
+
+@bp_main.after_request
+def add_auth_timing(resp: Response) -> Response:
+    duration = getattr(request, "auth_duration", None)
+    if duration is not None:
+        resp.headers.add("Server-Timing", f"auth;dur={duration * 1000:.3f}")
+    return resp
+
+
+def is_first_page() -> bool:
+    return request.args.get("page", "1") == "1" and not request.args.get("cursor")
 
 
 # images
 """
 GET
 搜索：后端实现，使用 url 参数，可搜索项：tag。
-- tag: [str]
+- tag: [str]，可传多个，eg. ?tag=猫&tag=狗
+- tag_mode: 可选，"and"（默认，匹配所有 tag）或 "or"（匹配任一 tag）
+- exclude_tag: [str]，可传多个，排除匹配的图片
 - groupId: [int]
+- facets: 可选，传 1 时返回当前组中匹配各个 tag、exclude_tag 的图片数量
 分页：后端实现，使用url参数?page=[int]&per_page=[int]
 - page: 可选，默认为 1。
 - per_page：可选，默认为 20。
+游标分页：传 cursor 参数时使用，翻页速度与页码无关，适用于无限滚动。
+- cursor: 第一页传空字符串，之后传上一页返回的 next_cursor。
+- per_page：可选，默认为 20。
+- with_total: 可选，传 1 时返回 total，一般只在第一页传。
 排序：默认按创建时间倒序，传 ?asc_order=1 参数指示正序。
 
 resp: 200, body:
@@ -51,6 +105,7 @@ resp: 200, body:
         {
             "id": [Number],
             "url": [String],
+            "thumbnail_url": [String],
             "type": [String],
             "tags": [Array[Object]], // {"id": 1, "text": "xxx"}
             "group_id": [Number] or null,
@@ -65,56 +120,201 @@ resp: 200, body:
         'total': [Number] # 总条数（行数）
     }
 }
+游标分页时：
+    "pagination": {
+        'next_cursor': [String] or null, # 下一页的游标，没有下一页时为 null
+        'per_page': [Number],
+        'total' [Optional]: [Number] # 传 with_total=1 时返回
+    }
+传 facets=1 时：
+    "facets": [
+        {"tag": [String], "image_number": [Number]},
+        ...
+    ]
 """
 
 
 @bp_main.route("/api/images/")
+@query_budget(7)
+@read_replica
+@cached_response(is_first_page)
 def show_images():
     user_id = request.session["user_id"]
     query = Image.query.filter_by(user_id=user_id)
 
     # apply search
     group_id = request.args.get("groupId")
-    tag = request.args.get("tag")
+    tags = [t for t in request.args.getlist("tag") if t]
+    exclude_tags = [t for t in request.args.getlist("exclude_tag") if t]
+    tag_mode = request.args.get("tag_mode", default="and")
+    if tag_mode not in ("and", "or"):
+        return jsonify({"error": "标签搜索参数有误"}), 400
+
     if group_id:
         group_id = int(group_id)
         query = apply_image_group_search(query, group_id)
     else:
         query = query.filter(Image.is_deleted == False)
 
-    if tag:
-        query = apply_image_tag_search(query, tag)
+    facets = None
+    if request.args.get("facets"):
+        facets = count_tag_facets(query, user_id, tags + exclude_tags)
+    tag_searched = bool(tags or exclude_tags)
+    if tag_searched:
+        query = apply_image_tag_search(query, user_id, tags, tag_mode, exclude_tags)
     # apply pagination, order
     DEFAULT_PER_PAGE = 20
-    page = int(request.args.get("page", default=1))
     per_page = int(request.args.get("per_page", default=DEFAULT_PER_PAGE))
-    asc_order = request.args.get("asc_order")
-    paginate = query.order_by(
-        Image.create_at if asc_order else Image.create_at.desc()
-    ).paginate(page=page, per_page=per_page)
-    data = [
-        {
-            "id": record.id,
-            "url": f"/api/images/{record.id}",
-            "type": record.type,
-            "tags": [{"id": t.id, "text": t.text} for t in record.tags],
-            "group_id": record.group_id,
-            "is_deleted": record.is_deleted,
-        }
-        for record in paginate.items
-    ]
-    resp = {
-        "data": data,
-        "pagination": {
+    asc_order = bool(request.args.get("asc_order"))
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        try:
+            records, next_cursor = paginate_by_cursor(
+                query.with_entities(*image_list_columns()), cursor, per_page, asc_order
+            )
+        except ValueError:
+            return jsonify({"error": "分页参数有误，请刷新页面"}), 400
+        pagination = {"next_cursor": next_cursor, "per_page": per_page}
+        if request.args.get("with_total"):
+            pagination["total"] = count_images(query, user_id, group_id, tag_searched)
+    else:
+        page = int(request.args.get("page", default=1))
+        paginate = (
+            query.with_entities(*image_list_columns())
+            .order_by(*image_order(asc_order))
+            .paginate(page=page, per_page=per_page, count=False)
+        )
+        paginate.total = count_images(query, user_id, group_id, tag_searched)
+        records = paginate.items
+        pagination = {
             "pages": paginate.pages,
             "page": paginate.page,
             "per_page": paginate.per_page,
             "total": paginate.total,
-        },
+        }
+
+    resp = {
+        "data": serialize_image_rows(records),
+        "pagination": pagination,
     }
+    if facets is not None:
+        resp["facets"] = facets
     return jsonify(resp)
 
 
+def image_list_columns():
+    """图片列表查询的列，配合 query.with_entities 使用，返回 Row 而不创建 Image 对象。"""
+    return (
+        Image.id,
+        Image.type,
+        Image.group_id,
+        Image.is_deleted,
+        Image.create_at,
+    )
+
+
+def load_image_tags(image_ids: List[int]) -> Dict[int, List[Dict]]:
+    """一条 SQL 取出一页图片的标签，按图片分组，每张图片的标签按 id 排序。"""
+    tags = {id: [] for id in image_ids}
+    if not image_ids:
+        return tags
+    rows = (
+        db.session.query(Tag.image_id, Tag.id, Tag.text)
+        .filter(Tag.image_id.in_(image_ids))
+        .order_by(Tag.id)
+    )
+    for image_id, id, text in rows:
+        tags[image_id].append({"id": id, "text": text})
+    return tags
+
+
+def serialize_image_rows(rows) -> List[Dict]:
+    """
+    Params:
+        rows [Sequence[Row]]: image_list_columns 的查询结果
+    """
+    tags = load_image_tags([row.id for row in rows])
+    return [
+        {
+            "id": id,
+            "url": f"/api/images/{id}",
+            "thumbnail_url": f"/api/images/{id}/thumbnail",
+            "type": type,
+            "tags": tags[id],
+            "group_id": group_id,
+            "is_deleted": is_deleted,
+        }
+        for id, type, group_id, is_deleted, _ in rows
+    ]
+
+
+def image_order(asc_order: bool):
+    # 创建时间相同时按 id 排序，保证翻页时顺序稳定
+    if asc_order:
+        return Image.create_at, Image.id
+    else:
+        return Image.create_at.desc(), Image.id.desc()
+
+
+def encode_cursor(image) -> str:
+    """
+    Params:
+        image [Image or Row]: 有 create_at、id 属性
+    """
+    value = json.dumps([image.create_at.isoformat(), image.id])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """游标格式有误时抛出 ValueError。"""
+    try:
+        create_at, id = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(create_at), int(id)
+    except (TypeError, binascii.Error) as e:
+        raise ValueError(cursor) from e
+
+
+def paginate_by_cursor(
+    query, cursor: str, per_page: int, asc_order: bool
+) -> Tuple[List, Optional[str]]:
+    """按 (create_at, id) 翻页，只读取当前页的记录，不使用 OFFSET。
+
+    Params:
+        cursor [str]: 上一页返回的 next_cursor，空字符串表示第一页
+    Return:
+        (records, next_cursor)
+    """
+    if cursor:
+        key = db.tuple_(Image.create_at, Image.id)
+        position = db.tuple_(*decode_cursor(cursor))
+        query = query.filter(key > position if asc_order else key < position)
+
+    # 多取一条判断是否还有下一页
+    records = query.order_by(*image_order(asc_order)).limit(per_page + 1).all()
+    if len(records) > per_page:
+        records = records[:per_page]
+        return records, encode_cursor(records[-1])
+    else:
+        return records, None
+
+
+def count_images(query, user_id: int, group_id: Optional[int], tag_searched: bool):
+    """统计搜索结果总数。配置 IMAGE_COUNTERS 且未搜索标签时直接读取计数。"""
+    if not current_app.config["IMAGE_COUNTERS"] or tag_searched:
+        return query.order_by(None).count()
+    elif not group_id:
+        column = User.image_number
+        query = db.session.query(column).filter(User.id == user_id)
+    elif is_recycle_bin(group_id):
+        column = User.deleted_image_number
+        query = db.session.query(column).filter(User.id == user_id)
+    else:
+        query = db.session.query(Group.image_number).filter(
+            Group.id == group_id, Group.user_id == user_id
+        )
+    return query.scalar() or 0
+
+
 def apply_image_group_search(query, group_id: int):
     if is_recycle_bin(group_id):
         return query.filter(Image.is_deleted == True)
@@ -126,8 +326,47 @@ def apply_image_group_search(query, group_id: int):
         )
 
 
-def apply_image_tag_search(query, tag: str):
-    return query.join(Image.tags).filter(Tag.text.contains(tag))
+def apply_image_tag_search(
+    query,
+    user_id: int,
+    tags: List[str],
+    tag_mode: str = "and",
+    exclude_tags: List[str] = (),
+):
+    """
+    Params:
+        tags [List[str]]: 图片须有匹配的标签
+        tag_mode [str]: "and" 匹配所有 tags，"or" 匹配任一 tags
+        exclude_tags [List[str]]: 图片不能有匹配的标签
+    """
+    if tags:
+        matches = [image_has_tag(user_id, t) for t in tags]
+        query = query.filter(
+            db.and_(*matches) if tag_mode == "and" else db.or_(*matches)
+        )
+    for t in exclude_tags:
+        query = query.filter(~image_has_tag(user_id, t))
+    return query
+
+
+def image_has_tag(user_id: int, tag: str):
+    # 使用 EXISTS 而非 join，多个标签匹配时图片不会重复出现
+    return Image.tags.any(tag_text_filter(user_id, tag))
+
+
+def count_tag_facets(query, user_id: int, tags: List[str]) -> List[dict]:
+    """一次查询统计 query 中匹配各个标签的图片数量。"""
+    tags = list(dict.fromkeys(tags))
+    if not tags:
+        return []
+    counts = (
+        query.with_entities(
+            *[db.func.count(Image.id).filter(image_has_tag(user_id, t)) for t in tags]
+        )
+        .order_by(None)
+        .one()
+    )
+    return [{"tag": t, "image_number": n} for t, n in zip(tags, counts)]
 
 
 def is_recycle_bin(group_id: int) -> bool:
@@ -136,29 +375,115 @@ def is_recycle_bin(group_id: int) -> bool:
 
 """
 GET ?id=[int]
-resp: 200, content-type: image/<type>
-body: 图片二进制数据
+支持 If-None-Match（ETag 为图片内容的 sha256）与 Range 请求。
+resp:
+- 200, content-type: image/<type>, body: 图片二进制数据
+- 206, body: Range 指定的部分数据
+- 304, 图片未改变
 """
 
 
 @bp_main.route("/api/images/<int:image_id>")
+@query_budget(2)
+@read_replica
 def show_image(image_id):
-    image = Image.query.get(image_id)
-    if image.user_id != request.session["user_id"]:
+    image = (
+        db.session.query(Image.id, Image.user_id, Image.type, Image.hash, Blob.size)
+        .outerjoin(Blob, Blob.hash == Image.hash)
+        .filter(Image.id == image_id)
+        .first()
+    )
+    if image is None:
+        return jsonify({"error": "所选图片不存在，请刷新页面"}), 404
+    elif image.user_id != request.session["user_id"]:
         return jsonify({"error": "您没有访问此图片的权限"}), 403
 
-    resp = Response(image.data, mimetype=f"image/{image.type}")
-    resp.cache_control.public = True
+    return cache_image_response(make_image_response(image))
+
+
+"""
+GET
+resp:
+- 200, content-type: image/<type>, body: 缩略图二进制数据，同 GET /api/images/<id>
+- 302, 缩略图尚未生成，重定向至原图
+"""
+
+
+@bp_main.route("/api/images/<int:image_id>/thumbnail")
+@query_budget(2)
+@read_replica
+def show_thumbnail(image_id):
+    image = (
+        db.session.query(
+            Image.id,
+            Image.user_id,
+            Rendition.hash,
+            Rendition.type,
+            Blob.size,
+        )
+        .outerjoin(
+            Rendition,
+            db.and_(Rendition.source_hash == Image.hash, Rendition.name == THUMBNAIL),
+        )
+        .outerjoin(Blob, Blob.hash == Rendition.hash)
+        .filter(Image.id == image_id)
+        .first()
+    )
+    if image is None:
+        return jsonify({"error": "所选图片不存在，请刷新页面"}), 404
+    elif image.user_id != request.session["user_id"]:
+        return jsonify({"error": "您没有访问此图片的权限"}), 403
+    elif image.hash is None:
+        return redirect(f"/api/images/{image_id}")
+
+    return cache_image_response(make_image_response(image))
+
+
+def cache_image_response(resp: Response) -> Response:
+    # 图片内容不会改变。响应需验证用户权限，只允许浏览器缓存，CDN 等共享缓存不能返回给其它用户。
+    resp.cache_control.private = True
+    resp.cache_control.immutable = True
     resp.cache_control.max_age = 31536000
     return resp
 
 
+def make_image_response(image) -> Response:
+    """
+    Params:
+        image [Row]: 需要有 id、hash、type、size 属性
+    """
+    # 旧数据（未迁移至 blob 存储）没有 hash，不支持 ETag
+    etag = image.hash
+    # If-None-Match 按弱比较，经代理压缩后变为 W/"..." 的 ETag 也能匹配
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        # 不读取图片内容
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    fh = open_image(image)
+    size = image.size
+    if size is None:
+        size = fh.seek(0, io.SEEK_END)
+        fh.seek(0)
+    resp = Response(
+        wrap_file(request.environ, fh),
+        mimetype=f"image/{image.type}",
+        direct_passthrough=True,
+    )
+    resp.content_length = size
+    resp.accept_ranges = "bytes"
+    if etag is not None:
+        resp.set_etag(etag)
+    return resp.make_conditional(request, accept_ranges="bytes", complete_length=size)
+
+
 """
 POST 使用表单提交
 Content-Type: multipart/form-data
 "image": [bytes-file],
 "metadata": [JSON-String] {
-    "type": [String],
+    "type": [String], // 无法从文件内容识别图片格式时使用此值
     "tags" [Optional]: [Array[String]],
     "group_id" [Optional]: [Number] or null,
 }
@@ -170,15 +495,9 @@ resp: 200, body: {"msg": [String]}
 def add_image():
     user_id = request.session["user_id"]
     image_file = request.files["image"]
-    image_data = image_file.read()
-    image_file.close()
+    spool = image_file.stream
     metadata = json.loads(request.form["metadata"])
-    image = Image(
-        data=image_data,
-        type=metadata["type"],
-        tags=[Tag(text=t, user_id=user_id) for t in metadata.get("tags", [])],
-        user_id=user_id,
-    )
+    group = None
     group_id = metadata.get("group_id")
     if group_id is not None:
         group = Group.query.get(group_id)
@@ -186,11 +505,20 @@ def add_image():
             return jsonify({"error": "所选组不存在，请刷新页面后重试"}), 400
         elif group.user_id != user_id:
             return jsonify({"error": "您没有添加图片至此组的权限"}), 403
-        else:
-            image.group = group
 
+    image = Image(
+        hash=put_blob_file(spool, spool.hash, spool.size),
+        type=spool.type or metadata["type"],
+        tags=[Tag(text=t, user_id=user_id) for t in metadata.get("tags", [])],
+        group=group,
+        user_id=user_id,
+    )
+    image_file.close()
     db.session.add(image)
+    adjust_image_counters(user_id, [(group_id, False, 1)])
+    bump_data_version(user_id, tags=bool(image.tags))
     db.session.commit()
+    schedule_thumbnail(current_app._get_current_object(), image.hash)
     return jsonify(
         {
             "id": image.id,
@@ -210,7 +538,7 @@ resp: 200, body: {"msg": [String]}
 def delete_image():
     data = request.get_json()
     image_id = data["id"]
-    image = Image.query.get(image_id)
+    image = get_image_for_update(image_id)
     if image is None:
         return (
             jsonify(
@@ -230,7 +558,13 @@ def delete_image():
             403,
         )
     else:
-        image.is_deleted = True
+        if not image.is_deleted:
+            image.is_deleted = True
+            image.deleted_at = datetime.utcnow()
+            adjust_image_counters(
+                image.user_id, [(image.group_id, False, -1), (image.group_id, True, 1)]
+            )
+            bump_data_version(image.user_id)
         db.session.commit()
         return jsonify({"msg": "图片已移至回收站"})
 
@@ -247,7 +581,7 @@ resp: 200, body: {"msg": [String]}
 def permanent_delete_image():
     data = request.get_json()
     image_id = data["id"]
-    image = Image.query.get(image_id)
+    image = get_image_for_update(image_id)
     if image is None:
         return (
             jsonify(
@@ -268,6 +602,9 @@ def permanent_delete_image():
         )
     else:
         db.session.delete(image)
+        release_blob(image.hash)
+        adjust_image_counters(image.user_id, [(image.group_id, image.is_deleted, -1)])
+        bump_data_version(image.user_id)
         db.session.commit()
         return jsonify({"msg": "成功删除图片"})
 
@@ -284,7 +621,7 @@ resp: 200, body: {"msg": [String]}
 def restore_image():
     data = request.get_json()
     image_id = data["id"]
-    image = Image.query.get(image_id)
+    image = get_image_for_update(image_id)
     if image is None:
         return (
             jsonify(
@@ -304,34 +641,68 @@ def restore_image():
             403,
         )
     else:
-        image.is_deleted = False
+        if image.is_deleted:
+            image.is_deleted = False
+            image.deleted_at = None
+            adjust_image_counters(
+                image.user_id, [(image.group_id, True, -1), (image.group_id, False, 1)]
+            )
+            bump_data_version(image.user_id)
         db.session.commit()
         return jsonify({"msg": "图片已恢复"})
 
 
 """
 POST {}
-resp: 200, body: {"msg": [String]}
+后台分批删除当前在回收站中的图片，已有未完成的任务时返回该任务。
+resp: 200, body: {"msg": [String], "job_id": [Number]}
 """
 
 
 @bp_main.route("/api/clearRecycleBin", methods=["POST"])
 def clear_recycle_bin():
-    user_id = request.session["user_id"]
-    image_ids = get_image_ids_in_recycle_bin(user_id)
-    Tag.query.filter(Tag.image_id.in_(image_ids)).delete()
-    Image.query.filter_by(user_id=user_id, is_deleted=True).delete()
+    job = create_purge_job(request.session["user_id"])
     db.session.commit()
-    return jsonify({"msg": "回收站已清空"})
+    schedule_purge_job(current_app._get_current_object(), job.id)
+    return jsonify({"msg": "正在清空回收站", "job_id": job.id})
 
 
-def get_image_ids_in_recycle_bin(user_id: int) -> Tuple[int]:
-    images = (
-        Image.query.filter_by(user_id=user_id, is_deleted=True)
-        .with_entities(Image.id)
-        .all()
+"""
+GET
+resp: 200, body:
+{
+    "id": [Number],
+    "status": [String], // "pending" | "done"
+    "total": [Number], // 需删除的图片数量
+    "purged": [Number] // 已删除的图片数量
+}
+"""
+
+
+@bp_main.route("/api/clearRecycleBin/<int:job_id>")
+@query_budget(1)
+def show_purge_job(job_id):
+    job = PurgeJob.query.get(job_id)
+    if job is None or job.user_id != request.session["user_id"]:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(
+        {
+            "id": job.id,
+            "status": job.status,
+            "total": job.total,
+            "purged": job.purged,
+        }
+    )
+
+
+def get_image_for_update(image_id: int) -> Image:
+    """读取并锁定图片，并发修改同一图片时计数不会出错。"""
+    return (
+        Image.query.filter_by(id=image_id)
+        .options(db.lazyload(Image.group))
+        .with_for_update(of=Image)
+        .first()
     )
-    return (image[0] for image in images)
 
 
 """
@@ -347,7 +718,7 @@ resp: 200, body: {"msg": [String]}
 def update_image():
     data = request.get_json()
     image_id = data["id"]
-    image = Image.query.get(image_id)
+    image = get_image_for_update(image_id)
     if not image:
         return jsonify({"error": "所选图片不存在，请刷新页面"}), 404
 
@@ -363,8 +734,11 @@ def update_image():
         )
 
     group_id = data["group_id"]
+    moved = [(image.group_id, image.is_deleted, -1), (group_id, image.is_deleted, 1)]
     if group_id is None:
         image.group_id = None
+        adjust_image_counters(user_id, moved)
+        bump_data_version(user_id)
         db.session.commit()
         return jsonify({"msg": "成功将图片移至组“全部”"})
     else:
@@ -375,10 +749,238 @@ def update_image():
             return jsonify({"error": "您无将图片移至此组的权限"}), 403
         else:
             image.group = group
+            adjust_image_counters(user_id, moved)
+            bump_data_version(user_id)
             db.session.commit()
             return jsonify({"msg": f"成功将图片移至组“{group.name}”"})
 
 
+# batch
+"""
+批量操作图片，一次请求、一个事务处理多张图片，请求体中的 ids 最多 MAX_BATCH_SIZE 个。
+各图片的结果按 ids 的顺序返回，部分图片失败不影响其它图片：
+resp: 200, body:
+{
+    "results": [
+        {"id": [Number], "ok": true},
+        {"id": [Number], "ok": false, "error": [String]},
+        ...
+    ]
+}
+"""
+
+
+def get_batch_ids(ids) -> List[int]:
+    """校验并去重请求中的 id 列表，格式有误时抛出 ValueError。"""
+    if not isinstance(ids, list) or len(ids) > MAX_BATCH_SIZE:
+        raise ValueError(ids)
+    if not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+        raise ValueError(ids)
+    return list(dict.fromkeys(ids))
+
+
+def lock_user_images(user_id: int, ids: List[int]) -> Tuple[dict, Dict[int, str]]:
+    """锁定 ids 中属于用户的图片，按 id 顺序加锁避免并发批量操作时死锁。
+
+    Return:
+        (images, errors): images 为 {id: (id, group_id, is_deleted)}，
+            errors 为不存在或不属于用户的图片 {id: 错误信息}
+    """
+    rows = db.session.execute(
+        db.select(Image.id, Image.group_id, Image.is_deleted)
+        .where(Image.id == any_id(ids), Image.user_id == user_id)
+        .order_by(Image.id)
+        .with_for_update()
+    ).all()
+    images = {row.id: row for row in rows}
+    errors = {}
+    missing = [id for id in ids if id not in images]
+    if missing:
+        others = set(
+            db.session.execute(
+                db.select(Image.id).where(Image.id == any_id(missing))
+            ).scalars()
+        )
+        for id in missing:
+            if id in others:
+                errors[id] = "您没有操作此图片的权限"
+            else:
+                errors[id] = "所选图片不存在，请刷新页面"
+    return images, errors
+
+
+def batch_results(ids: List[int], errors: Dict[int, str], **values) -> List[dict]:
+    """
+    Params:
+        values [Dict[str, Dict[int, Any]]]: 成功的图片额外返回的值，eg. tag_id={1: 2}
+    """
+    results = []
+    for id in ids:
+        if id in errors:
+            results.append({"id": id, "ok": False, "error": errors[id]})
+        else:
+            result = {"id": id, "ok": True}
+            for key, value in values.items():
+                result[key] = value.get(id)
+            results.append(result)
+    return results
+
+
+def update_user_images(user_id: int, ids: List[int], **values) -> None:
+    if ids:
+        db.session.execute(
+            db.update(Image)
+            .where(Image.id == any_id(ids), Image.user_id == user_id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def set_images_deleted(is_deleted: bool):
+    user_id = request.session["user_id"]
+    try:
+        ids = get_batch_ids(request.get_json().get("ids"))
+    except ValueError:
+        return jsonify({"error": "所选图片有误，请刷新页面"}), 400
+
+    images, errors = lock_user_images(user_id, ids)
+    changed = [img for img in images.values() if img.is_deleted != is_deleted]
+    update_user_images(
+        user_id,
+        [img.id for img in changed],
+        is_deleted=is_deleted,
+        deleted_at=datetime.utcnow() if is_deleted else None,
+    )
+    counter_changes = []
+    for img in changed:
+        counter_changes.append((img.group_id, img.is_deleted, -1))
+        counter_changes.append((img.group_id, is_deleted, 1))
+    adjust_image_counters(user_id, counter_changes)
+    if changed:
+        bump_data_version(user_id)
+    db.session.commit()
+    return jsonify({"results": batch_results(ids, errors)})
+
+
+"""
+POST {
+    "ids": [Array[Number]]
+}
+将图片移至回收站
+"""
+
+
+@bp_main.route("/api/images/batch/delete", methods=["POST"])
+def batch_delete_images():
+    return set_images_deleted(True)
+
+
+"""
+POST {
+    "ids": [Array[Number]]
+}
+从回收站恢复图片
+"""
+
+
+@bp_main.route("/api/images/batch/restore", methods=["POST"])
+def batch_restore_images():
+    return set_images_deleted(False)
+
+
+"""
+POST {
+    "ids": [Array[Number]],
+    "group_id": [Number] | null
+}
+将图片移至组
+"""
+
+
+@bp_main.route("/api/images/batch/update", methods=["POST"])
+def batch_update_images():
+    user_id = request.session["user_id"]
+    data = request.get_json()
+    try:
+        ids = get_batch_ids(data.get("ids"))
+    except ValueError:
+        return jsonify({"error": "所选图片有误，请刷新页面"}), 400
+
+    group_id = data["group_id"]
+    if group_id is not None:
+        group = Group.query.get(group_id)
+        if not group:
+            return jsonify({"error": "所选组不存在，请刷新页面后重试"}), 404
+        elif group.user_id != user_id:
+            return jsonify({"error": "您无将图片移至此组的权限"}), 403
+
+    images, errors = lock_user_images(user_id, ids)
+    changed = [img for img in images.values() if img.group_id != group_id]
+    update_user_images(user_id, [img.id for img in changed], group_id=group_id)
+    counter_changes = []
+    for img in changed:
+        counter_changes.append((img.group_id, img.is_deleted, -1))
+        counter_changes.append((group_id, img.is_deleted, 1))
+    adjust_image_counters(user_id, counter_changes)
+    if changed:
+        bump_data_version(user_id)
+    db.session.commit()
+    return jsonify({"results": batch_results(ids, errors)})
+
+
+"""
+POST {
+    "image_ids": [Array[Number]],
+    "text": [String]
+}
+给多张图片打上同一个标签，已有此标签的图片不重复添加。
+resp: 200, body:
+{
+    "results": [
+        {"id": [Number], "ok": true, "tag_id": [Number]},
+        {"id": [Number], "ok": false, "error": [String]},
+        ...
+    ]
+}
+"""
+
+
+@bp_main.route("/api/tags/batch/add", methods=["POST"])
+def batch_add_tags():
+    user_id = request.session["user_id"]
+    data = request.get_json()
+    try:
+        ids = get_batch_ids(data.get("image_ids"))
+    except ValueError:
+        return jsonify({"error": "所选图片有误，请刷新页面"}), 400
+
+    text = data["text"]
+    images, errors = lock_user_images(user_id, ids)
+    tag_ids = dict(
+        db.session.execute(
+            db.select(Tag.image_id, Tag.id).where(
+                Tag.image_id == any_id(list(images)), Tag.text == text
+            )
+        ).all()
+    )
+    untagged = [id for id in images if id not in tag_ids]
+    if untagged:
+        rows = db.session.execute(
+            db.insert(Tag)
+            .from_select(
+                [Tag.text, Tag.image_id, Tag.user_id],
+                db.select(
+                    db.literal(text, db.String), Image.id, db.literal(user_id)
+                ).where(Image.id == any_id(untagged)),
+            )
+            .returning(Tag.image_id, Tag.id)
+        )
+        tag_ids.update(rows.all())
+        bump_data_version(user_id, tags=True)
+    db.session.commit()
+    return jsonify({"results": batch_results(ids, errors, tag_id=tag_ids)})
+
+
 # tags
 """
 GET ?image_id=[int]
@@ -390,15 +992,19 @@ resp: 200, body:
 
 
 @bp_main.route("/api/tags/")
+@query_budget(2)
+@read_replica
+@cached_response()
 def show_tags():
-    query = Tag.query.filter_by(user_id=request.session["user_id"])
+    query = db.session.query(Tag.id, Tag.text).filter(
+        Tag.user_id == request.session["user_id"]
+    )
     image_id = request.args.get("image_id")
     if image_id:
-        query = query.filter_by(image_id=image_id)
+        query = query.filter(Tag.image_id == image_id)
 
-    tags = query.all()
     resp = {
-        "data": [{"id": t.id, "text": t.text} for t in tags],
+        "data": [{"id": id, "text": text} for id, text in query],
     }
     return jsonify(resp)
 
@@ -425,6 +1031,7 @@ def add_tags():
     else:
         record = Tag(text=data["text"], image_id=image_id, user_id=user_id)
         db.session.add(record)
+        bump_data_version(user_id, tags=True)
         db.session.commit()
         return jsonify(
             {
@@ -452,6 +1059,7 @@ def delete_tag():
         return jsonify({"error": "您无删除此标签的权限"}), 403
     else:
         db.session.delete(tag)
+        bump_data_version(tag.user_id)
         db.session.commit()
         return jsonify({"msg": "成功删除标签"})
 
@@ -476,6 +1084,7 @@ def update_tag():
         return jsonify({"error": "您无修改此标签的权限"}), 403
     else:
         tag.text = data["text"]
+        bump_data_version(tag.user_id, tags=True)
         db.session.commit()
         return jsonify({"msg": "成功将标签重命名"})
 
@@ -491,10 +1100,29 @@ resp: 200, body:
 
 
 @bp_main.route("/api/groups/")
+@query_budget(3)
+@read_replica
+@cached_response()
 def show_groups():
     user_id = request.session["user_id"]
-    image_total = Image.query.filter_by(user_id=user_id, is_deleted=False).count()
-    deleted_image_num = Image.query.filter_by(user_id=user_id, is_deleted=True).count()
+    groups = (
+        db.session.query(Group.id, Group.name, Group.image_number)
+        .filter_by(user_id=user_id)
+        .order_by(Group.create_at, Group.id)
+        .all()
+    )
+    if current_app.config["IMAGE_COUNTERS"]:
+        image_total, deleted_image_num = (
+            db.session.query(User.image_number, User.deleted_image_number)
+            .filter_by(id=user_id)
+            .one()
+        )
+        group_image_numbers = {id: image_number for id, _, image_number in groups}
+    else:
+        image_total, deleted_image_num, group_image_numbers = count_group_images(
+            user_id
+        )
+
     data = [
         {
             "id": None,
@@ -507,10 +1135,10 @@ def show_groups():
             "image_number": deleted_image_num,
         },
     ]
-    groups = Group.query.filter_by(user_id=user_id).order_by(Group.create_at).all()
-    for _g in groups:
-        image_number = Image.query.filter_by(group=_g, is_deleted=False).count()
-        data.append({"id": _g.id, "name": _g.name, "image_number": image_number})
+    for id, name, _ in groups:
+        data.append(
+            {"id": id, "name": name, "image_number": group_image_numbers.get(id, 0)}
+        )
 
     resp = {
         "data": data,
@@ -518,6 +1146,30 @@ def show_groups():
     return jsonify(resp)
 
 
+def count_group_images(user_id: int) -> Tuple[int, int, Dict[int, int]]:
+    """一次查询统计用户各组的图片数量。
+
+    Return:
+        (image_total, deleted_image_num, {group_id: image_number})
+    """
+    rows = (
+        db.session.query(Image.group_id, Image.is_deleted, db.func.count(Image.id))
+        .filter_by(user_id=user_id)
+        .group_by(Image.group_id, Image.is_deleted)
+    )
+    image_total = 0
+    deleted_image_num = 0
+    group_image_numbers = {}
+    for group_id, is_deleted, image_number in rows:
+        if is_deleted:
+            deleted_image_num += image_number
+        else:
+            image_total += image_number
+            if group_id is not None:
+                group_image_numbers[group_id] = image_number
+    return image_total, deleted_image_num, group_image_numbers
+
+
 """
 POST {
     "name": [String],
@@ -527,11 +1179,13 @@ resp: 200, body: {"id": [int]}
 
 
 @bp_main.route("/api/groups/add", methods=["POST"])
+@query_budget(3)
 def add_group():
     data = request.get_json()
     name = data["name"]
     record = Group(name=name, user_id=request.session["user_id"])
     db.session.add(record)
+    bump_data_version(request.session["user_id"])
     db.session.commit()
     return jsonify(
         {
@@ -552,6 +1206,8 @@ resp: 200, body: {"msg": [String]}
 def delete_group():
     data = request.get_json()
     group_ids = data["ids"]
+    hashes = []
+    counter_changes = []
     for id in group_ids:
         group = Group.query.get(id)
         if not group:
@@ -559,8 +1215,19 @@ def delete_group():
         elif group.user_id != request.session["user_id"]:
             return jsonify({"error": "您无删除此组的权限"}), 403
         else:
+            # 组中的图片随组一起删除
+            images = Image.query.filter_by(group_id=id).with_entities(
+                Image.hash, Image.is_deleted
+            )
+            for hash, is_deleted in images:
+                hashes.append(hash)
+                counter_changes.append((id, is_deleted, -1))
             db.session.delete(group)
 
+    db.session.flush()
+    release_blobs(hashes)
+    adjust_image_counters(request.session["user_id"], counter_changes)
+    bump_data_version(request.session["user_id"])
     db.session.commit()
     return jsonify({"msg": f"成功删除所选组"})
 
@@ -582,6 +1249,7 @@ def update_group():
     group = Group.query.get(group_id)
     if group.user_id == request.session["user_id"]:
         group.name = name
+        bump_data_version(group.user_id)
         db.session.commit()
         return jsonify(
             {
@@ -606,19 +1274,31 @@ resp: 200, body: serve export.zip file.
 
 
 @bp_main.route("/api/images/export")
+@read_replica
 def export_images():
     group_id = request.args.get("group_id")
-    query = Image.query.filter_by(user_id=request.session["user_id"])
+    query = db.session.query(
+        Image.id, Image.hash, Image.type, Image.create_at
+    ).filter_by(user_id=request.session["user_id"])
     if group_id:
         query = query.filter_by(group_id=int(group_id))
-    images = query.all()
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as fh:
-        for image in images:
-            fileinfo = zipfile.ZipInfo(
-                filename=f"{uuid4()}.{image.type}",
-                date_time=image.create_at.timetuple()[:6],
-            )
-            fh.writestr(fileinfo, image.data)
-    buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name="export.zip")
+    # server-side cursor，每次只取一批记录
+    rows = query.order_by(Image.id).yield_per(EXPORT_BATCH_SIZE)
+
+    def generate():
+        zs = ZipStream()
+        for row in rows:
+            with open_image(row) as fh:
+                yield from zs.write(
+                    f"{uuid4()}.{row.type}",
+                    fh,
+                    date_time=row.create_at.timetuple()[:6],
+                    type=row.type,
+                )
+        yield from zs.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=export.zip"},
+    )
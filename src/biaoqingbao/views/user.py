@@ -1,18 +1,37 @@
 from datetime import datetime, timedelta
-from smtplib import SMTPException
 
-from flask import Blueprint, jsonify, request
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Blueprint, current_app, g, jsonify, request
 
 from .. import db
-from ..auth import generate_token
-from ..models import Passcode, ResetAttempt, User
-from ..services import send_email
+from ..auth import generate_token, revoke_token
+from ..models import Passcode, User
+from ..passwords import HasherBusy, hash_password, needs_rehash, verify_password
+from ..querybudget import query_budget
+from ..ratelimit import get_rate_limiter
+from ..services import enqueue_email
 from ..utils import generate_passcode
 
 bp_user = Blueprint("bp_user", __name__)
 
 
+@bp_user.errorhandler(HasherBusy)
+def handle_hasher_busy(e):
+    return jsonify({"error": "服务器繁忙，请稍后重试"}), 503
+
+
+@bp_user.after_request
+def add_password_hash_timing(resp):
+    timing = g.get("password_hash_timing")
+    if timing is not None:
+        queue_seconds, hash_seconds = timing
+        resp.headers.add(
+            "Server-Timing",
+            f"hash-queue;dur={queue_seconds * 1000:.3f},"
+            f" hash;dur={hash_seconds * 1000:.3f}",
+        )
+    return resp
+
+
 """
 POST {
     "email": [String],
@@ -25,6 +44,7 @@ resp:
 
 
 @bp_user.route("/api/register", methods=["POST"])
+@query_budget(2)
 def handle_register():
     data = request.get_json()
     u = User.query.filter_by(email=data["email"]).first()
@@ -38,7 +58,7 @@ def handle_register():
             409,
         )
 
-    user = User(email=data["email"], password=generate_password_hash(data["password"]))
+    user = User(email=data["email"], password=hash_password(data["password"]))
     db.session.add(user)
     db.session.commit()
     return jsonify({"msg": "注册成功"})
@@ -56,6 +76,7 @@ resp:
 
 
 @bp_user.route("/api/login", methods=["POST"])
+@query_budget(3)
 def handle_login():
     data = request.get_json()
     user = User.query.filter_by(email=data["email"]).first()
@@ -69,14 +90,18 @@ def handle_login():
             401,
         )
 
-    ok = check_password_hash(user.password, data["password"])
+    ok = verify_password(user.password, data["password"])
     if ok:
+        if needs_rehash(user.password):
+            user.password = hash_password(data["password"])
+            db.session.commit()
         token = generate_token({"user_id": user.id})
         resp = jsonify({"msg": "登陆成功"})
         resp.set_cookie(
             "token",
             token,
-            expires=datetime.utcnow() + timedelta(days=14),
+            expires=datetime.utcnow()
+            + timedelta(seconds=current_app.config["TOKEN_LIFETIME"]),
             httponly=True,
         )
         return resp
@@ -100,6 +125,10 @@ resp:
 
 @bp_user.route("/api/logout")
 def handle_logout():
+    token = request.cookies.get("token")
+    if token:
+        revoke_token(token)
+        db.session.commit()
     resp = jsonify({"msg": "注销成功"})
     resp.set_cookie(
         "token",
@@ -110,12 +139,30 @@ def handle_logout():
     return resp
 
 
-def get_legal_passcodes(user_id):
-    expire_datetime = datetime.now() - timedelta(0, 600)  # 10 分钟
-    return (
-        Passcode.query.filter_by(user_id=user_id)
-        .filter(Passcode.create_at > expire_datetime)
-        .all()
+def is_legal_passcode(user_id: int, passcode: str) -> bool:
+    expire_datetime = datetime.now() - timedelta(
+        seconds=current_app.config["PASSCODE_LIFETIME"]
+    )
+    query = Passcode.query.filter_by(user_id=user_id, content=passcode).filter(
+        Passcode.create_at > expire_datetime
+    )
+    return db.session.query(query.exists()).scalar()
+
+
+def format_passcode_lifetime() -> str:
+    """验证码有效期的文字描述，如 "10 分钟"；不足整分钟时以秒为单位。"""
+    seconds = current_app.config["PASSCODE_LIFETIME"]
+    if seconds % 60 == 0:
+        return f"{seconds // 60} 分钟"
+    return f"{seconds} 秒"
+
+
+def hit_passcode_limit(action: str, user_id: int) -> bool:
+    """有效期内同一用户最多发送、尝试 PASSCODE_LIMIT 次验证码，超出时返回 False。"""
+    return get_rate_limiter().hit(
+        f"{action}:{user_id}",
+        current_app.config["PASSCODE_LIMIT"],
+        current_app.config["PASSCODE_LIFETIME"],
     )
 
 
@@ -126,7 +173,7 @@ POST {
 resp:
 - 200, { "msg": "验证码已发送至电子邮箱" }
 - 403, { "error": "发送验证码过于频繁" }
-- 500, { "error": "发送邮件失败" }
+邮件由 `biaoqingbao mail-worker` 在后台发送。
 """
 
 
@@ -146,8 +193,7 @@ def handle_send_passcode():
             200,
         )
 
-    legal_codes = get_legal_passcodes(user.id)
-    if len(legal_codes) >= 5:
+    if not hit_passcode_limit("send-passcode", user.id):
         return (
             jsonify(
                 {
@@ -160,17 +206,13 @@ def handle_send_passcode():
     passcode = generate_passcode()
     record = Passcode(content=passcode, user_id=user.id)
     db.session.add(record)
+    enqueue_email(
+        email,
+        "重设您的“表情宝”账号密码",
+        f"你此次重置密码的验证码为：{passcode}，请在 {format_passcode_lifetime()}内输入验证码进行下一步操作。 如非你本人操作，请忽略此邮件。",
+    )
     db.session.commit()
 
-    try:
-        send_email(
-            email,
-            "重设您的“表情宝”账号密码",
-            f"你此次重置密码的验证码为：{passcode}，请在 10 分钟内输入验证码进行下一步操作。 如非你本人操作，请忽略此邮件。",
-        )
-    except SMTPException as e:
-        return jsonify({"error": "发送邮件失败"}), 500
-
     return jsonify({"msg": "验证码已发送至电子邮箱"})
 
 
@@ -204,20 +246,11 @@ def handle_reset_password():
             404,
         )
 
-    expire_datetime = datetime.now() - timedelta(0, 600)  # 10 分钟
-    attempts = (
-        ResetAttempt.query.filter_by(user_id=user.id)
-        .filter(ResetAttempt.create_at > expire_datetime)
-        .all()
-    )
-    if len(attempts) >= 5:
-        return jsonify({"error": ""}), 403
-
-    a = ResetAttempt(user_id=user.id)
-    db.session.add(a)
-    legal_codes = get_legal_passcodes(user.id)
-    if passcode in [r.content for r in legal_codes]:
-        user.password = generate_password_hash(data["password"])
+    if not hit_passcode_limit("reset-password", user.id):
+        return jsonify({"error": "重置尝试次数过于频繁"}), 403
+
+    if is_legal_passcode(user.id, passcode):
+        user.password = hash_password(data["password"])
         db.session.add(user)
         db.session.commit()
         return jsonify({"msg": "重置密码成功"})
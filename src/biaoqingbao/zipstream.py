@@ -0,0 +1,69 @@
+import zipfile
+from typing import BinaryIO, Iterator
+
+CHUNK_SIZE = 64 * 1024
+# 已压缩过的图片格式，再 deflate 几乎没有收益
+STORED_TYPES = {"gif", "jpeg", "jpg", "png", "webp"}
+
+
+class _Pipe:
+    """只写的非 seekable 文件，ZipFile 写入的数据暂存在此，由生成器取走。"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """边写边输出的 zip 文件，内存占用与文件数量、大小无关。
+
+    用法：
+        zs = ZipStream()
+        for name, fh in files:
+            yield from zs.write(name, fh)
+        yield from zs.close()
+    """
+
+    def __init__(self):
+        self._pipe = _Pipe()
+        # fp 不支持 tell()，ZipFile 会使用 data descriptor 记录每个文件的大小与 crc
+        self._zf = zipfile.ZipFile(self._pipe, "w")
+
+    def write(
+        self, filename: str, fileobj: BinaryIO, date_time: tuple, type: str
+    ) -> Iterator[bytes]:
+        """
+        Params:
+            filename [str]
+            fileobj [BinaryIO]: 文件内容，写完后由调用方关闭
+            date_time [tuple]: (year, month, day, hour, min, sec)
+            type [str]: 图片格式，决定是否压缩
+        """
+        info = zipfile.ZipInfo(filename=filename, date_time=date_time)
+        if type in STORED_TYPES:
+            info.compress_type = zipfile.ZIP_STORED
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+
+        with self._zf.open(info, "w") as dst:
+            for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                dst.write(chunk)
+                data = self._pipe.pop()
+                if data:
+                    yield data
+        yield self._pipe.pop()
+
+    def close(self) -> Iterator[bytes]:
+        self._zf.close()
+        yield self._pipe.pop()
@@ -1,3 +1,9 @@
+import os
+
+# 请求执行的 SQL 超出 view 的 query_budget 或有 N+1 查询时测试失败。
+# 在导入 biaoqingbao（读取配置）之前设置，测试中创建的 app 都会检查
+os.environ.setdefault("QUERY_BUDGETS", "1")
+
 from biaoqingbao import create_app, generate_token
 
 test_app = create_app()
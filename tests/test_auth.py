@@ -0,0 +1,106 @@
+import time
+import unittest
+from datetime import datetime, timedelta
+
+import jwt
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import RevokedToken, User, db, generate_token
+from biaoqingbao.auth import TokenCache, decode_token, revoked_tokens, token_cache
+from biaoqingbao.configs import configs
+from tests import test_app
+
+
+class TestTokenCache(unittest.TestCase):
+    def test_lru(self):
+        cache = TokenCache(2)
+        exp = time.time() + 60
+        for token in ["a", "b"]:
+            cache.put(token, {"exp": exp})
+        cache.get("a")
+        cache.put("c", {"exp": exp})
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+    def test_expired(self):
+        cache = TokenCache(2)
+        cache.put("a", {"exp": time.time() - 1})
+        self.assertIsNone(cache.get("a"))
+
+
+class TestAuthenticate(unittest.TestCase):
+    url = "/api/groups/"
+
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            db.session.add(
+                User(email="1@foo.com", password=generate_password_hash("password1"))
+            )
+            db.session.commit()
+        token_cache.clear()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def get(self, token):
+        client = test_app.test_client()
+        client.set_cookie("localhost", "token", token)
+        return client.get(self.url)
+
+    def test_claims(self):
+        with test_app.app_context():
+            claims = decode_token(generate_token({"user_id": 1}))
+        self.assertEqual(claims["user_id"], 1)
+        self.assertEqual(claims["exp"] - claims["iat"], configs.TOKEN_LIFETIME)
+        self.assertIn("jti", claims)
+
+    def test_server_timing(self):
+        resp = self.get(generate_token({"user_id": 1}))
+        self.assertEqual(resp.status_code, 200)
+        self.assertRegex(resp.headers["Server-Timing"], r"^auth;dur=\d+\.\d{3}$")
+
+    def test_expired(self):
+        token = generate_token({"user_id": 1}, lifetime=1)
+        self.assertEqual(self.get(token).status_code, 200)
+        time.sleep(2.1)
+        self.assertEqual(self.get(token).status_code, 401)
+
+    def test_no_expiry(self):
+        token = jwt.encode({"user_id": 1}, configs.SECRET_KEY, algorithm="HS256")
+        self.assertEqual(self.get(token).status_code, 401)
+
+    def test_bad_signature(self):
+        token = jwt.encode(
+            {"user_id": 1, "iat": 0, "exp": 2**40, "jti": "x"},
+            "wrong key",
+            algorithm="HS256",
+        )
+        self.assertEqual(self.get(token).status_code, 401)
+
+    def test_logout_revokes_token(self):
+        token = generate_token({"user_id": 1})
+        self.assertEqual(self.get(token).status_code, 200)
+
+        client = test_app.test_client()
+        client.set_cookie("localhost", "token", token)
+        self.assertEqual(client.get("/api/logout").status_code, 200)
+        self.assertEqual(self.get(token).status_code, 401)
+        with test_app.app_context():
+            self.assertEqual(RevokedToken.query.count(), 1)
+
+    def test_revoked_by_other_process(self):
+        token = generate_token({"user_id": 1})
+        self.assertEqual(self.get(token).status_code, 200)
+        with test_app.app_context():
+            claims = decode_token(token)
+            db.session.add(
+                RevokedToken(
+                    jti=claims["jti"], expire_at=datetime.utcnow() + timedelta(days=1)
+                )
+            )
+            db.session.commit()
+            revoked_tokens.refresh()
+        self.assertEqual(self.get(token).status_code, 401)
@@ -0,0 +1,132 @@
+import unittest
+
+from psycopg2.extensions import cursor
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Group, Image, Tag, User, db
+from biaoqingbao.storage import put_blob
+from tests import create_login_client, test_app
+
+BLOB_SIZE = 1024 * 1024
+
+
+class CountingCursor(cursor):
+    """统计从数据库取回的字节数。"""
+
+    fetched_bytes = 0
+
+    def _count(self, rows):
+        for row in rows:
+            for v in row:
+                if isinstance(v, (bytes, memoryview, str)):
+                    CountingCursor.fetched_bytes += len(v)
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._count([row])
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        return self._count(super().fetchmany(*args, **kwargs))
+
+    def fetchall(self):
+        return self._count(super().fetchall())
+
+
+def use_counting_cursor(dbapi_connection, connection_record):
+    dbapi_connection.cursor_factory = CountingCursor
+
+
+class TestBlobNotLoaded(unittest.TestCase):
+    """只有输出图片内容的接口才会从数据库读取图片内容。"""
+
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            hashes = [put_blob(bytes([i]) * BLOB_SIZE) for i in range(5)]
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            group = Group(name="testGroup", user=user)
+            for hash in hashes:
+                img = Image(
+                    hash=hash,
+                    type="jpeg",
+                    user=user,
+                    group=group,
+                    tags=[Tag(text="aTag", user=user)],
+                )
+            legacy_image = Image(
+                data=b"\xff" * BLOB_SIZE,
+                type="jpeg",
+                tags=[Tag(text="aTag", user=user)],
+            )
+            user.images.append(legacy_image)
+            db.session.add(user)
+            db.session.commit()
+
+            self.image_id = img.id
+            self.legacy_image_id = legacy_image.id
+            self.engine = db.engine
+        event.listen(self.engine, "connect", use_counting_cursor)
+        self.engine.dispose()
+
+    def tearDown(self):
+        event.remove(self.engine, "connect", use_counting_cursor)
+        self.engine.dispose()
+        with test_app.app_context():
+            db.drop_all()
+
+    def fetched_bytes(self, method, url, status=200, **kwargs):
+        client = create_login_client(user_id=1)
+        CountingCursor.fetched_bytes = 0
+        resp = getattr(client, method)(url, **kwargs)
+        self.assertEqual(resp.status_code, status)
+        resp.get_data()
+        return CountingCursor.fetched_bytes
+
+    def test_no_blob(self):
+        image_id = self.legacy_image_id
+        requests = [
+            ("get", "/api/images/", {}),
+            ("get", "/api/images/", {"query_string": {"tag": "aTag"}}),
+            ("get", "/api/groups/", {}),
+            ("get", "/api/tags/", {}),
+            ("post", "/api/images/delete", {"json": {"id": image_id}}),
+            ("post", "/api/images/restore", {"json": {"id": image_id}}),
+            ("post", "/api/images/update", {"json": {"id": image_id, "group_id": 1}}),
+            ("post", "/api/tags/add", {"json": {"image_id": image_id, "text": "b"}}),
+            ("post", "/api/images/permanentDelete", {"json": {"id": self.image_id}}),
+        ]
+        for method, url, kwargs in requests:
+            with self.subTest(url=url):
+                self.assertLess(self.fetched_bytes(method, url, **kwargs), 64 * 1024)
+
+    def test_serve_blob(self):
+        self.assertGreaterEqual(
+            self.fetched_bytes("get", f"/api/images/{self.image_id}"),
+            BLOB_SIZE,
+        )
+        self.assertGreaterEqual(
+            self.fetched_bytes("get", f"/api/images/{self.legacy_image_id}"),
+            BLOB_SIZE,
+        )
+        self.assertGreaterEqual(
+            self.fetched_bytes("get", "/api/images/export"),
+            6 * BLOB_SIZE,
+        )
+
+    def test_not_modified(self):
+        with test_app.app_context():
+            hash = Image.query.get(self.image_id).hash
+        fetched_bytes = self.fetched_bytes(
+            "get",
+            f"/api/images/{self.image_id}",
+            status=304,
+            headers={"If-None-Match": f'"{hash}"'},
+        )
+        self.assertLess(fetched_bytes, 1024)
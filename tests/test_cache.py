@@ -0,0 +1,208 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Group, Image, Tag, User, create_app, db, generate_token
+from biaoqingbao.cache import (
+    CACHE_HEADER,
+    MemoryResponseCache,
+    SharedResponseCache,
+)
+from biaoqingbao.configs import configs
+from biaoqingbao.counters import reconcile_image_counters
+from biaoqingbao.metrics import prometheus_client
+from tests import create_login_client, test_app
+
+
+class TestMemoryResponseCache(unittest.TestCase):
+    def test_lru(self):
+        cache = MemoryResponseCache(max_bytes=10)
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        self.assertEqual(cache.get("a"), b"1234")
+        # 超出大小时淘汰最久未读取的 b
+        cache.set("c", b"1234")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1234")
+        self.assertEqual(cache.get("c"), b"1234")
+
+    def test_too_large(self):
+        cache = MemoryResponseCache(max_bytes=10)
+        cache.set("a", b"x" * 11)
+        self.assertIsNone(cache.get("a"))
+
+
+class TestSharedResponseCache(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "cache")
+
+    def test_shared(self):
+        # 同一目录的两个实例，相当于两个 worker 进程
+        worker1 = SharedResponseCache(self.path, max_bytes=1024)
+        worker2 = SharedResponseCache(self.path, max_bytes=1024)
+        self.assertIsNone(worker2.get("a"))
+        worker1.set("a", b"data")
+        self.assertEqual(worker2.get("a"), b"data")
+        worker2.clear()
+        self.assertIsNone(worker1.get("a"))
+
+    def test_prune(self):
+        cache = SharedResponseCache(self.path, max_bytes=100)
+        for i in range(cache.PRUNE_INTERVAL):
+            cache.set(str(i), b"x" * 10)
+            os.utime(cache._file(str(i)), (i, i))
+        cache.prune()
+        size = sum(entry.stat().st_size for entry in os.scandir(self.path))
+        self.assertLessEqual(size, 100 * cache.PRUNE_TARGET)
+        # 保留最近读取的
+        self.assertIsNotNone(cache.get(str(cache.PRUNE_INTERVAL - 1)))
+        self.assertIsNone(cache.get("0"))
+
+
+class TestCachedResponse(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            group = Group(name="group", user=user)
+            for _ in range(3):
+                user.images.append(
+                    Image(
+                        data=b"fake binary data",
+                        type="jpeg",
+                        group=group,
+                        tags=[Tag(text="aTag", user=user)],
+                    )
+                )
+            db.session.add(user)
+            db.session.commit()
+        self.client = create_login_client()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def get(self, url, cache="hit"):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers.get(CACHE_HEADER), cache)
+        return resp.get_json()
+
+    def post(self, url, data):
+        resp = self.client.post(url, json=data)
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_json()
+
+    def test_hit(self):
+        for url in ["/api/groups/", "/api/tags/?image_id=1", "/api/images/"]:
+            data = self.get(url, cache="miss")
+            self.assertEqual(self.get(url), data)
+
+    def test_first_page_only(self):
+        self.get("/api/images/?per_page=1", cache="miss")
+        self.get("/api/images/?per_page=1&page=2", cache=None)
+        self.get("/api/images/?per_page=1&cursor=", cache="miss")
+        self.get("/api/images/?per_page=1&cursor=", cache="hit")
+
+    def test_per_user(self):
+        self.get("/api/groups/", cache="miss")
+        with test_app.app_context():
+            db.session.add(User(email="2@foo.com", password=""))
+            db.session.commit()
+        self.client = create_login_client(user_id=2)
+        data = self.get("/api/groups/", cache="miss")
+        self.assertEqual(len(data["data"]), 2)
+
+    def test_invalidate_groups(self):
+        self.get("/api/groups/", cache="miss")
+        self.post("/api/groups/add", {"name": "new group"})
+        data = self.get("/api/groups/", cache="miss")
+        self.assertEqual([g["name"] for g in data["data"]][-1], "new group")
+
+        self.post("/api/groups/update", {"id": 1, "name": "renamed"})
+        data = self.get("/api/groups/", cache="miss")
+        self.assertIn("renamed", [g["name"] for g in data["data"]])
+
+    def test_invalidate_images(self):
+        self.get("/api/images/", cache="miss")
+        self.post("/api/images/delete", {"id": 1})
+        data = self.get("/api/images/", cache="miss")
+        self.assertEqual(len(data["data"]), 2)
+
+        self.post("/api/images/batch/update", {"ids": [2], "group_id": None})
+        data = self.get("/api/images/", cache="miss")
+        groups = {image["id"]: image["group_id"] for image in data["data"]}
+        self.assertEqual(groups, {2: None, 3: 1})
+
+        # 没有修改任何图片时不失效
+        self.post("/api/images/batch/update", {"ids": [2], "group_id": None})
+        self.get("/api/images/")
+
+    def test_invalidate_tags(self):
+        self.get("/api/tags/?image_id=1", cache="miss")
+        self.post("/api/tags/add", {"image_id": 1, "text": "bTag"})
+        data = self.get("/api/tags/?image_id=1", cache="miss")
+        self.assertEqual(["aTag", "bTag"], [tag["text"] for tag in data["data"]])
+
+    def test_reconcile_counters(self):
+        with mock.patch.dict(test_app.config, IMAGE_COUNTERS=True):
+            self.get("/api/groups/", cache="miss")
+            with test_app.app_context():
+                reconcile_image_counters()
+            data = self.get("/api/groups/", cache="miss")
+        self.assertEqual(data["data"][0]["image_number"], 3)
+
+    def test_disabled(self):
+        with mock.patch.object(configs, "RESPONSE_CACHE", "none"):
+            app = create_app()
+        client = app.test_client()
+        client.set_cookie("localhost", "token", generate_token({"user_id": 1}))
+        resp = client.get("/api/groups/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn(CACHE_HEADER, resp.headers)
+
+    def test_shared_backend(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch.multiple(
+                configs,
+                RESPONSE_CACHE="shared",
+                RESPONSE_CACHE_SHM_PATH=os.path.join(tmpdir, "cache"),
+            ):
+                workers = [create_app(), create_app()]
+            clients = []
+            for app in workers:
+                client = app.test_client()
+                client.set_cookie("localhost", "token", generate_token({"user_id": 1}))
+                clients.append(client)
+            resp = clients[0].get("/api/groups/")
+            self.assertEqual(resp.headers[CACHE_HEADER], "miss")
+            resp = clients[1].get("/api/groups/")
+            self.assertEqual(resp.headers[CACHE_HEADER], "hit")
+
+            clients[1].post("/api/groups/add", json={"name": "new group"})
+            resp = clients[0].get("/api/groups/")
+            self.assertEqual(resp.headers[CACHE_HEADER], "miss")
+            self.assertEqual(len(resp.get_json()["data"]), 4)
+
+    @unittest.skipIf(prometheus_client is None, "prometheus_client is not installed")
+    def test_metrics(self):
+        def sample(result):
+            value = prometheus_client.REGISTRY.get_sample_value(
+                "biaoqingbao_response_cache_total",
+                {"endpoint": "bp_main.show_groups", "result": result},
+            )
+            return value or 0
+
+        hits, misses = sample("hit"), sample("miss")
+        self.get("/api/groups/", cache="miss")
+        self.get("/api/groups/")
+        self.assertEqual(sample("hit"), hits + 1)
+        self.assertEqual(sample("miss"), misses + 1)
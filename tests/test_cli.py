@@ -1,8 +1,10 @@
 import unittest
 
 from click.testing import CliRunner
+from werkzeug.security import generate_password_hash
 
-from biaoqingbao import __version__, cli
+from biaoqingbao import Blob, Image, User, __version__, cli, db, migrations
+from tests import test_app
 
 
 class TestGeneralOptions(unittest.TestCase):
@@ -11,3 +13,34 @@ class TestGeneralOptions(unittest.TestCase):
         result = runner.invoke(cli, ["--version"])
         self.assertEqual(result.exit_code, 0)
         self.assertIn(__version__, result.output)
+
+
+class TestMigrateBlobs(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            for i in range(3):
+                user.images.append(Image(data=b"fake binary data", type="jpeg"))
+            user.images.append(Image(data=b"other binary data", type="jpeg"))
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_migrate(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ["migrate-blobs", "--batch-size", "3"])
+        self.assertEqual(result.exit_code, 0)
+        with test_app.app_context():
+            self.assertEqual(Image.query.filter(Image.data != None).count(), 0)
+            counts = sorted(b.ref_count for b in Blob.query.all())
+            self.assertEqual(counts, [1, 3])
+            with db.engine.connect() as conn:
+                applied = migrations.applied_versions(conn)
+        self.assertEqual(applied, [m.version for m in migrations.MIGRATIONS])
@@ -0,0 +1,133 @@
+import os
+import unittest
+
+from pydantic import ValidationError
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import User, db
+from biaoqingbao.configs import Configs, configs
+from biaoqingbao.engine import (
+    InstrumentedQueuePool,
+    engine_options,
+    pool_capacity,
+    pool_metrics,
+    setup_engine,
+)
+from tests import create_login_client, test_app
+
+
+def make_configs(**update):
+    return configs.copy(update=update)
+
+
+def make_engine(configs):
+    options = engine_options(configs)
+    engine = create_engine(configs.SQLALCHEMY_DATABASE_URI, **options)
+    setup_engine(engine)
+    return engine
+
+
+class TestEngineOptions(unittest.TestCase):
+    def test_postgres(self):
+        options = engine_options(make_configs(DATABASE_POOL_SIZE=7))
+        self.assertIs(options["poolclass"], InstrumentedQueuePool)
+        self.assertEqual(options["pool_size"], 7)
+        self.assertEqual(options["max_overflow"], 2)
+        self.assertEqual(options["connect_args"]["application_name"], "biaoqingbao")
+        self.assertIn("statement_timeout", options["connect_args"]["options"])
+
+    def test_pool_capacity(self):
+        self.assertEqual(pool_capacity(make_configs(DATABASE_POOL_SIZE=7)), 9)
+        self.assertIsNone(pool_capacity(make_configs(DATABASE_MAX_OVERFLOW=-1)))
+        self.assertIsNone(pool_capacity(make_configs(DATABASE_PROFILE="pgbouncer")))
+
+    def test_statement_timeout(self):
+        with test_app.app_context():
+            timeout = db.session.execute(text("SHOW statement_timeout")).scalar()
+        self.assertEqual(timeout, "30s")
+
+    def test_pgbouncer(self):
+        options = engine_options(make_configs(DATABASE_PROFILE="pgbouncer"))
+        self.assertIs(options["poolclass"], NullPool)
+        self.assertNotIn("pool_size", options)
+        self.assertNotIn("options", options["connect_args"])
+
+        options = engine_options(
+            make_configs(
+                DATABASE_PROFILE="pgbouncer",
+                SQLALCHEMY_DATABASE_URI="postgresql+psycopg://localhost/biaoqingbao",
+            )
+        )
+        self.assertIsNone(options["connect_args"]["prepare_threshold"])
+
+    def test_database_uri(self):
+        with self.assertRaises(ValidationError):
+            Configs(SQLALCHEMY_DATABASE_URI="sqlite:///bqb.db")
+        uri = "postgresql+psycopg://bqb@localhost/biaoqingbao"
+        self.assertEqual(
+            Configs(SQLALCHEMY_DATABASE_URI=uri).SQLALCHEMY_DATABASE_URI, uri
+        )
+
+
+class TestPoolMetrics(unittest.TestCase):
+    def test_saturation(self):
+        engine = make_engine(
+            make_configs(
+                DATABASE_POOL_SIZE=1, DATABASE_MAX_OVERFLOW=0, DATABASE_POOL_TIMEOUT=0.1
+            )
+        )
+        self.addCleanup(engine.dispose)
+        with engine.connect():
+            metrics = pool_metrics(engine)
+            self.assertEqual(metrics["saturation"], 1)
+            with self.assertRaises(PoolTimeoutError):
+                engine.connect()
+        metrics = pool_metrics(engine)
+        self.assertEqual(metrics["checked_out"], 0)
+        self.assertEqual(metrics["checkouts"], 1)
+        self.assertEqual(metrics["timeouts"], 1)
+
+    def test_server_timing(self):
+        with test_app.app_context():
+            db.create_all()
+            db.session.add(
+                User(email="1@foo.com", password=generate_password_hash("password1"))
+            )
+            db.session.commit()
+        try:
+            client = create_login_client(user_id=1)
+            resp = client.get("/api/groups/")
+            self.assertEqual(resp.status_code, 200)
+            timings = resp.headers.getlist("Server-Timing")
+            self.assertTrue(any(t.startswith("db-pool;dur=") for t in timings))
+        finally:
+            with test_app.app_context():
+                db.drop_all()
+
+
+class TestFork(unittest.TestCase):
+    def test_dispose_in_child(self):
+        """fork 出的子进程不使用父进程的连接。"""
+        engine = make_engine(make_configs())
+        self.addCleanup(engine.dispose)
+        with engine.connect() as conn:
+            parent_pid = conn.execute(text("SELECT pg_backend_pid()")).scalar()
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                with engine.connect() as conn:
+                    child_pid = conn.execute(text("SELECT pg_backend_pid()")).scalar()
+                os._exit(0 if child_pid != parent_pid else 1)
+            except BaseException:
+                os._exit(2)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+        # 父进程的连接仍可使用
+        with engine.connect() as conn:
+            pid = conn.execute(text("SELECT pg_backend_pid()")).scalar()
+        self.assertEqual(pid, parent_pid)
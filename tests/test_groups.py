@@ -1,8 +1,14 @@
+import io
+import json
 import unittest
+from unittest import mock
 
+from click.testing import CliRunner
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash
 
-from biaoqingbao import Group, Image, Tag, User, db
+from biaoqingbao import Group, Image, Tag, User, cli, db
+from biaoqingbao.purge import wait_pending as wait_purge_jobs
 from tests import create_login_client, test_app
 
 
@@ -41,6 +47,116 @@ class TestShowGroups(unittest.TestCase):
         self.assertIn("data", json_data)
         self.assertEqual(len(json_data["data"]), 5)
 
+    def test_query_count(self):
+        """查询次数与组的数量无关。"""
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with test_app.app_context():
+            engine = db.engine
+        client = create_login_client(user_id=1)
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            resp = client.get(self.url)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        self.assertEqual(resp.status_code, 200)
+        self.assertLessEqual(len(statements), 3)
+
+
+class TestGroupImageNumber(unittest.TestCase):
+    """开启、关闭 IMAGE_COUNTERS 时各组图片数量一致。"""
+
+    url = "/api/groups/"
+
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            user.groups = [Group(name="testGroup1"), Group(name="testGroup2")]
+            db.session.add(user)
+            db.session.commit()
+            self.group_ids = [g.id for g in user.groups]
+        patcher = mock.patch.dict(test_app.config, {"IMAGE_COUNTERS": True})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def add_image(self, client, group_id):
+        resp = client.post(
+            "/api/images/add",
+            data={
+                "image": (io.BytesIO(b"fake image %d" % group_id), "a.jpg"),
+                "metadata": json.dumps({"type": "jpeg", "group_id": group_id}),
+            },
+        )
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_json()["id"]
+
+    def image_numbers(self, client):
+        resp = client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        return [g["image_number"] for g in resp.get_json()["data"]]
+
+    def assert_image_numbers(self, client, expected):
+        self.assertEqual(self.image_numbers(client), expected)
+        with mock.patch.dict(test_app.config, {"IMAGE_COUNTERS": False}):
+            self.assertEqual(self.image_numbers(client), expected)
+
+    def test_maintained(self):
+        client = create_login_client(user_id=1)
+        g1, g2 = self.group_ids
+        ids = [self.add_image(client, g) for g in (g1, g1, g1, g2)]
+        self.assert_image_numbers(client, [4, 0, 3, 1])
+
+        for _ in range(2):
+            client.post("/api/images/delete", json={"id": ids[0]})
+        self.assert_image_numbers(client, [3, 1, 2, 1])
+
+        client.post("/api/images/update", json={"id": ids[1], "group_id": g2})
+        self.assert_image_numbers(client, [3, 1, 1, 2])
+
+        client.post("/api/images/update", json={"id": ids[2], "group_id": None})
+        self.assert_image_numbers(client, [3, 1, 0, 2])
+
+        for _ in range(2):
+            client.post("/api/images/restore", json={"id": ids[0]})
+        self.assert_image_numbers(client, [4, 0, 1, 2])
+
+        client.post("/api/images/delete", json={"id": ids[3]})
+        client.post("/api/images/permanentDelete", json={"id": ids[2]})
+        self.assert_image_numbers(client, [2, 1, 1, 1])
+
+        client.post("/api/clearRecycleBin")
+        self.assertTrue(wait_purge_jobs(timeout=30))
+        self.assert_image_numbers(client, [2, 0, 1, 1])
+
+        client.post("/api/images/delete", json={"id": ids[1]})
+        client.post("/api/groups/delete", json={"ids": [g2]})
+        self.assert_image_numbers(client, [1, 0, 1])
+
+    def test_reconcile(self):
+        client = create_login_client(user_id=1)
+        g1, _ = self.group_ids
+        self.add_image(client, g1)
+        with test_app.app_context():
+            User.query.update({User.image_number: 10})
+            Group.query.update({Group.image_number: 10})
+            db.session.commit()
+
+        result = CliRunner().invoke(cli, ["reconcile-counters"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Repaired counters of 3 users and groups.", result.output)
+        self.assertEqual(self.image_numbers(client), [1, 0, 1, 0])
+
 
 class TestAddGroup(unittest.TestCase):
     url = "/api/groups/add"
@@ -1,10 +1,15 @@
 import json
 import unittest
+import zipfile
 from io import BytesIO
+from unittest import mock
 
+from click.testing import CliRunner
 from werkzeug.security import generate_password_hash
 
-from biaoqingbao import Group, Image, Tag, User, db
+from biaoqingbao import Group, Image, Tag, User, cli, db
+from biaoqingbao.purge import wait_pending as wait_purge_jobs
+from biaoqingbao.storage import put_blob
 from tests import create_login_client, test_app
 
 
@@ -12,6 +17,7 @@ class TestShowImageList(unittest.TestCase):
     url = "/api/images/"
 
     def setUp(self):
+        test_app.extensions["tag_index_cache"].clear()
         with test_app.app_context():
             db.create_all()
             user = User(
@@ -49,6 +55,29 @@ class TestShowImageList(unittest.TestCase):
         self.assertIn("data", json_data)
         self.assertEqual(json_data["pagination"]["total"], 20)
 
+    def test_item(self):
+        with test_app.app_context():
+            db.session.add(Image(data=b"fake binary data", type="png", user_id=1))
+            db.session.commit()
+        client = create_login_client(user_id=1)
+        resp = client.get(self.url, query_string={"per_page": 2})
+        first, second = resp.get_json()["data"]
+        self.assertEqual(
+            first,
+            {
+                "id": 22,
+                "url": "/api/images/22",
+                "thumbnail_url": "/api/images/22/thumbnail",
+                "type": "png",
+                "tags": [],
+                "group_id": None,
+                "is_deleted": False,
+            },
+        )
+        self.assertEqual(
+            second["tags"], [{"id": 39, "text": "aTag"}, {"id": 40, "text": "bTag"}]
+        )
+
     def test_pagination(self):
         client = create_login_client(user_id=1)
         resp = client.get(
@@ -64,11 +93,57 @@ class TestShowImageList(unittest.TestCase):
         self.assertIn("pagination", json_data)
         self.assertEqual(len(json_data["data"]), 10)
 
+    def fetch_all_by_cursor(self, client, **query_string):
+        ids = []
+        cursor = ""
+        while cursor is not None:
+            resp = client.get(
+                self.url,
+                query_string={"cursor": cursor, "per_page": 6, **query_string},
+            )
+            self.assertEqual(resp.status_code, 200)
+            json_data = resp.get_json()
+            self.assertNotIn("total", json_data["pagination"])
+            ids.extend(img["id"] for img in json_data["data"])
+            cursor = json_data["pagination"]["next_cursor"]
+        return ids
+
+    def test_cursor(self):
+        client = create_login_client(user_id=1)
+        ids = self.fetch_all_by_cursor(client)
+        self.assertEqual(ids, list(range(20, 0, -1)))
+        ids = self.fetch_all_by_cursor(client, asc_order=1)
+        self.assertEqual(ids, list(range(1, 21)))
+
+    def test_cursor_same_as_page(self):
+        client = create_login_client(user_id=1)
+        resp = client.get(self.url, query_string={"per_page": 30, "tag": "Tag"})
+        ids = [img["id"] for img in resp.get_json()["data"]]
+        self.assertEqual(ids, self.fetch_all_by_cursor(client, tag="Tag"))
+
+    def test_cursor_with_total(self):
+        client = create_login_client(user_id=1)
+        resp = client.get(
+            self.url, query_string={"cursor": "", "per_page": 30, "with_total": 1}
+        )
+        self.assertEqual(resp.status_code, 200)
+        json_data = resp.get_json()
+        self.assertEqual(json_data["pagination"]["total"], 20)
+        self.assertIsNone(json_data["pagination"]["next_cursor"])
+
+    def test_invalid_cursor(self):
+        client = create_login_client(user_id=1)
+        for cursor in ["xx", "WzEsMl0=", "bm90IGpzb24="]:
+            with self.subTest(cursor=cursor):
+                resp = client.get(self.url, query_string={"cursor": cursor})
+                self.assertEqual(resp.status_code, 400)
+
 
 class TestSearchImage(unittest.TestCase):
     url = "/api/images/"
 
     def setUp(self):
+        test_app.extensions["tag_index_cache"].clear()
         with test_app.app_context():
             db.create_all()
             user = User(
@@ -177,6 +252,44 @@ class TestSearchImage(unittest.TestCase):
         self.assertIn("data", json_data)
         self.assertEqual(len(json_data["data"]), 1)
 
+    def search(self, query_string, status=200):
+        client = create_login_client(user_id=1)
+        resp = client.get(self.url, query_string=query_string)
+        self.assertEqual(resp.status_code, status)
+        return resp.get_json()
+
+    def test_search_all_tags(self):
+        json_data = self.search([("tag", "Tag"), ("tag", "aT")])
+        self.assertEqual([img["id"] for img in json_data["data"]], [1])
+
+    def test_search_any_tag(self):
+        json_data = self.search([("tag", "aTag"), ("tag", "cTag"), ("tag_mode", "or")])
+        self.assertEqual(len(json_data["data"]), 2)
+        self.assertEqual(json_data["pagination"]["total"], 2)
+
+    def test_exclude_tag(self):
+        json_data = self.search([("tag", "Tag"), ("exclude_tag", "aTag")])
+        self.assertEqual(len(json_data["data"]), 2)
+        json_data = self.search([("groupId", -1), ("exclude_tag", "dTag")])
+        self.assertEqual(len(json_data["data"]), 1)
+
+    def test_facets(self):
+        json_data = self.search(
+            [("tag", "aTag"), ("tag", "Tag"), ("exclude_tag", "bTag"), ("facets", 1)]
+        )
+        self.assertEqual(len(json_data["data"]), 1)
+        self.assertEqual(
+            json_data["facets"],
+            [
+                {"tag": "aTag", "image_number": 1},
+                {"tag": "Tag", "image_number": 3},
+                {"tag": "bTag", "image_number": 1},
+            ],
+        )
+
+    def test_invalid_tag_mode(self):
+        self.search([("tag", "aTag"), ("tag_mode", "xor")], status=400)
+
 
 class TestShowImage(unittest.TestCase):
     url = "/api/images/{id}"
@@ -219,6 +332,76 @@ class TestShowImage(unittest.TestCase):
         json_data = resp.get_json()
         self.assertIn("error", json_data)
 
+    def test_fetch_not_exists_image(self):
+        client = create_login_client(user_id=1)
+        resp = client.get(self.url.format(id=1000))
+        self.assertEqual(resp.status_code, 404)
+        json_data = resp.get_json()
+        self.assertIn("error", json_data)
+
+
+class TestShowImageConditional(unittest.TestCase):
+    url = "/api/images/{id}"
+
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            db.session.add(user)
+            db.session.commit()
+            self.hash = put_blob(b"fake binary data")
+            db.session.add(Image(hash=self.hash, type="jpeg", user=user))
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_etag(self):
+        client = create_login_client(user_id=1)
+        resp = client.get(self.url.format(id=1))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["ETag"], f'"{self.hash}"')
+        self.assertEqual(resp.headers["Accept-Ranges"], "bytes")
+        self.assertEqual(resp.data, b"fake binary data")
+
+    def test_not_modified(self):
+        client = create_login_client(user_id=1)
+        resp = client.get(
+            self.url.format(id=1), headers={"If-None-Match": f'"{self.hash}"'}
+        )
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], f'"{self.hash}"')
+
+    def test_not_modified_weak(self):
+        client = create_login_client(user_id=1)
+        resp = client.get(
+            self.url.format(id=1), headers={"If-None-Match": f'W/"{self.hash}"'}
+        )
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers["ETag"], f'"{self.hash}"')
+
+    def test_modified(self):
+        client = create_login_client(user_id=1)
+        resp = client.get(self.url.format(id=1), headers={"If-None-Match": '"xxx"'})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_range(self):
+        client = create_login_client(user_id=1)
+        resp = client.get(self.url.format(id=1), headers={"Range": "bytes=5-10"})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.data, b"binary")
+        self.assertEqual(resp.headers["Content-Range"], "bytes 5-10/16")
+
+    def test_range_not_satisfiable(self):
+        client = create_login_client(user_id=1)
+        resp = client.get(self.url.format(id=1), headers={"Range": "bytes=100-200"})
+        self.assertEqual(resp.status_code, 416)
+
 
 class TestAddImage(unittest.TestCase):
     url = "/api/images/add"
@@ -309,6 +492,19 @@ class TestAddImage(unittest.TestCase):
             self.assertTrue(image)
             self.assertEqual(image.group_id, 1)
 
+    def test_sniff_type(self):
+        client = create_login_client(user_id=1)
+        resp = client.post(
+            self.url,
+            data={
+                "image": (BytesIO(b"\x89PNG\r\n\x1a\n image data"), "test_image"),
+                "metadata": json.dumps({"type": "jpeg"}),
+            },
+        )
+        self.assertEqual(resp.status_code, 200)
+        with test_app.app_context():
+            self.assertEqual(Image.query.get(resp.get_json()["id"]).type, "png")
+
     def test_add_to_not_exists_group(self):
         client = create_login_client(user_id=1)
         resp = client.post(
@@ -724,6 +920,11 @@ class TestExportImages(unittest.TestCase):
         client = create_login_client()
         resp = client.get(self.url)
         self.assertEqual(resp.status_code, 200)
+        with zipfile.ZipFile(BytesIO(resp.data)) as fh:
+            infos = fh.infolist()
+            self.assertEqual(len(infos), 15)
+            self.assertEqual(infos[0].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(fh.read(infos[0]), b"fake binary data")
 
     def test_export_group(self):
         client = create_login_client()
@@ -775,6 +976,11 @@ class TestClearRecycleBin(unittest.TestCase):
         self.assertEqual(resp.status_code, 200)
         json_data = resp.get_json()
         self.assertIn("msg", json_data)
+        self.assertTrue(wait_purge_jobs(timeout=30))
+        resp = client.get(f"{self.url}/{json_data['job_id']}")
+        self.assertEqual(
+            resp.get_json(), {"id": 1, "status": "done", "total": 1, "purged": 1}
+        )
         with test_app.app_context():
             deleted_images = Image.query.filter_by(is_deleted=True).all()
             self.assertEqual(deleted_images, [])
@@ -782,3 +988,93 @@ class TestClearRecycleBin(unittest.TestCase):
             self.assertEqual(len(last_images), 2)
             tags = Tag.query.filter_by(text="dTag").all()
             self.assertEqual(tags, [])
+
+
+class TestBatchImages(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user1 = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            user2 = User(
+                email="2@foo.com",
+                password=generate_password_hash("password2"),
+            )
+            group = Group(name="testGroup", user=user1)
+            for i in range(3):
+                Image(data=b"fake binary data", type="jpeg", user=user1, group=group)
+            db.session.add_all([user1, user2])
+            db.session.commit()
+            other = Image(data=b"fake binary data", type="jpeg", user=user2)
+            db.session.add(other)
+            db.session.commit()
+            self.group_id = group.id
+            self.other_image_id = other.id
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def post(self, url, json, status=200):
+        client = create_login_client(user_id=1)
+        resp = client.post(url, json=json)
+        self.assertEqual(resp.status_code, status)
+        return resp.get_json()
+
+    def test_delete_and_restore(self):
+        ids = [1, 2, self.other_image_id, 1000]
+        json_data = self.post("/api/images/batch/delete", {"ids": ids})
+        self.assertEqual(
+            [r["ok"] for r in json_data["results"]], [True, True, False, False]
+        )
+        self.assertEqual(json_data["results"][2]["id"], self.other_image_id)
+        self.assertIn("error", json_data["results"][3])
+        with test_app.app_context():
+            deleted = Image.query.filter_by(is_deleted=True).order_by(Image.id)
+            self.assertEqual([img.id for img in deleted], [1, 2])
+
+        json_data = self.post("/api/images/batch/restore", {"ids": [2, 3]})
+        self.assertTrue(all(r["ok"] for r in json_data["results"]))
+        with test_app.app_context():
+            deleted = Image.query.filter_by(is_deleted=True)
+            self.assertEqual([img.id for img in deleted], [1])
+
+    def test_move(self):
+        json_data = self.post(
+            "/api/images/batch/update", {"ids": [1, 2], "group_id": None}
+        )
+        self.assertTrue(all(r["ok"] for r in json_data["results"]))
+        with test_app.app_context():
+            self.assertEqual(Image.query.filter_by(group_id=None).count(), 3)
+
+        self.post(
+            "/api/images/batch/update",
+            {"ids": [1], "group_id": 1000},
+            status=404,
+        )
+
+    def test_counters(self):
+        with mock.patch.dict(test_app.config, {"IMAGE_COUNTERS": True}):
+            CliRunner().invoke(cli, ["reconcile-counters"])
+            self.post("/api/images/batch/delete", {"ids": [1, 2]})
+            self.post("/api/images/batch/restore", {"ids": [1]})
+            self.post("/api/images/batch/update", {"ids": [1, 3], "group_id": None})
+            client = create_login_client(user_id=1)
+            counted = client.get("/api/groups/").get_json()
+        with mock.patch.dict(test_app.config, {"IMAGE_COUNTERS": False}):
+            aggregated = client.get("/api/groups/").get_json()
+        self.assertEqual(counted, aggregated)
+        self.assertEqual([g["image_number"] for g in counted["data"]], [2, 1, 0])
+
+    def test_invalid_ids(self):
+        for ids in [None, 1, ["1"], [True], list(range(10000))]:
+            with self.subTest(ids=ids):
+                self.post("/api/images/batch/delete", {"ids": ids}, status=400)
+
+    def test_many_ids(self):
+        ids = list(range(1, 5001))
+        json_data = self.post("/api/images/batch/delete", {"ids": ids})
+        self.assertEqual(sum(r["ok"] for r in json_data["results"]), 3)
+        self.assertEqual(len(json_data["results"]), 5000)
@@ -0,0 +1,71 @@
+import unittest
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from unittest import mock
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from biaoqingbao import create_app
+from biaoqingbao.configs import configs
+from biaoqingbao.jsonprovider import OrjsonProvider, orjson
+
+
+@unittest.skipIf(orjson is None, "orjson is not installed")
+class TestOrjsonProvider(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.provider = OrjsonProvider(self.app)
+        self.default = DefaultJSONProvider(self.app)
+
+    def test_same_as_default(self):
+        obj = {
+            "text": "表情包",
+            "number": [1, 2.5, None, True],
+            "time": datetime(2022, 11, 1, 8, 30),
+            "decimal": Decimal("1.5"),
+            "uuid": uuid.UUID(int=1),
+            "ids": {1: "non-str key"},
+        }
+        self.assertEqual(
+            self.default.loads(self.provider.dumps(obj)),
+            self.default.loads(self.default.dumps(obj)),
+        )
+
+    def test_loads(self):
+        self.assertEqual(self.provider.loads(b'{"a": [1, "\\u8868"]}'), {"a": [1, "表"]})
+        with self.assertRaises(ValueError):
+            self.provider.loads("{")
+
+    def test_response(self):
+        with self.app.app_context():
+            resp = self.provider.response({"a": "表情"})
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertEqual(resp.get_data(), '{"a":"表情"}\n'.encode())
+
+    def test_pretty(self):
+        self.app.debug = True
+        with self.app.app_context():
+            resp = self.provider.response(a=1)
+        self.assertEqual(resp.get_data(), b'{\n  "a": 1\n}\n')
+
+
+class TestInitJSONProvider(unittest.TestCase):
+    def test_stdlib(self):
+        with mock.patch.object(configs, "JSON_PROVIDER", "stdlib"):
+            app = create_app()
+        self.assertIs(type(app.json), DefaultJSONProvider)
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_auto(self):
+        with mock.patch.object(configs, "JSON_PROVIDER", "auto"):
+            app = create_app()
+        self.assertIsInstance(app.json, OrjsonProvider)
+
+    def test_not_installed(self):
+        with mock.patch.multiple(configs, JSON_PROVIDER="orjson"), mock.patch(
+            "biaoqingbao.jsonprovider.orjson", None
+        ):
+            with self.assertRaisesRegex(RuntimeError, "orjson is not installed"):
+                create_app()
@@ -0,0 +1,192 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+from io import BytesIO
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Image, User, create_app, db
+from biaoqingbao.configs import configs
+from biaoqingbao.engine import engine_options
+from biaoqingbao.metrics import instrument_engine, pool_label, prometheus_client
+from tests import create_login_client, test_app
+
+MULTIPROCESS_SCRIPT = """
+import os
+
+from biaoqingbao import create_app
+
+app = create_app()
+for _ in range(2):
+    pid = os.fork()
+    if pid == 0:
+        app.test_client().get("/api/images/")
+        os._exit(0)
+    os.waitpid(pid, 0)
+print(app.test_client().get("/metrics").get_data(as_text=True))
+"""
+
+
+def sample(name, **labels):
+    value = prometheus_client.REGISTRY.get_sample_value(name, labels)
+    return value or 0
+
+
+@unittest.skipIf(prometheus_client is None, "prometheus_client is not installed")
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            for _ in range(3):
+                user.images.append(Image(data=b"fake binary data", type="jpeg"))
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_request(self):
+        labels = {"endpoint": "bp_main.show_images", "method": "GET"}
+        count = sample("biaoqingbao_request_duration_seconds_count", **labels)
+        ok = sample("biaoqingbao_requests_total", status="200", **labels)
+        sql = sample(
+            "biaoqingbao_sql_duration_seconds_count", endpoint="bp_main.show_images"
+        )
+        in_progress = sample("biaoqingbao_requests_in_progress")
+
+        resp = create_login_client().get("/api/images/")
+        self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(
+            sample("biaoqingbao_request_duration_seconds_count", **labels), count + 1
+        )
+        self.assertEqual(
+            sample("biaoqingbao_requests_total", status="200", **labels), ok + 1
+        )
+        self.assertGreater(
+            sample(
+                "biaoqingbao_sql_duration_seconds_count",
+                endpoint="bp_main.show_images",
+            ),
+            sql,
+        )
+        self.assertEqual(sample("biaoqingbao_requests_in_progress"), in_progress)
+
+    def test_unauthorized(self):
+        labels = {"endpoint": "bp_main.show_images", "method": "GET", "status": "401"}
+        count = sample("biaoqingbao_requests_total", **labels)
+        resp = test_app.test_client().get("/api/images/")
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(sample("biaoqingbao_requests_total", **labels), count + 1)
+
+    def test_response_bytes(self):
+        endpoint = "bp_main.show_image"
+        before = sample("biaoqingbao_response_bytes_total", endpoint=endpoint)
+        resp = create_login_client().get("/api/images/1")
+        self.assertEqual(resp.data, b"fake binary data")
+        self.assertEqual(
+            sample("biaoqingbao_response_bytes_total", endpoint=endpoint),
+            before + len(resp.data),
+        )
+
+    def test_streamed_response_bytes(self):
+        endpoint = "bp_main.export_images"
+        before = sample("biaoqingbao_response_bytes_total", endpoint=endpoint)
+        resp = create_login_client().get("/api/images/export")
+        with zipfile.ZipFile(BytesIO(resp.data)) as fh:
+            self.assertEqual(len(fh.infolist()), 3)
+        self.assertEqual(
+            sample("biaoqingbao_response_bytes_total", endpoint=endpoint),
+            before + len(resp.data),
+        )
+
+    def test_metrics_endpoint(self):
+        create_login_client().get("/api/images/")
+        resp = test_app.test_client().get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.get_data(as_text=True)
+        self.assertIn("biaoqingbao_request_duration_seconds_bucket", text)
+        self.assertIn('endpoint="bp_main.show_images"', text)
+
+    def test_pool(self):
+        with test_app.app_context():
+            label = pool_label(db.engine)
+        checkouts = sample(
+            "biaoqingbao_db_pool_checkout_wait_seconds_count", pool=label
+        )
+        create_login_client().get("/api/images/")
+        self.assertGreater(
+            sample("biaoqingbao_db_pool_checkout_wait_seconds_count", pool=label),
+            checkouts,
+        )
+        self.assertEqual(sample("biaoqingbao_db_pool_checked_out", pool=label), 0)
+        self.assertEqual(sample("biaoqingbao_db_pool_capacity", pool=label), 5)
+        text = test_app.test_client().get("/metrics").get_data(as_text=True)
+        for name in (
+            "biaoqingbao_db_pool_checkout_wait_seconds_count",
+            "biaoqingbao_db_pool_checked_out",
+            "biaoqingbao_db_pool_saturation",
+            "biaoqingbao_db_pool_capacity",
+        ):
+            self.assertIn(f'{name}{{pool="{label}"', text)
+
+    def test_pool_timeout(self):
+        pool_configs = configs.copy(
+            update=dict(
+                DATABASE_POOL_SIZE=1, DATABASE_MAX_OVERFLOW=0, DATABASE_POOL_TIMEOUT=0.1
+            )
+        )
+        # 换一种写法连接同一数据库，指标与 test_app 的连接池区分
+        uri = make_url(configs.SQLALCHEMY_DATABASE_URI).set(host="127.0.0.1")
+        engine = create_engine(uri, **engine_options(pool_configs))
+        self.addCleanup(engine.dispose)
+        instrument_engine(engine)
+        label = pool_label(engine)
+        timeouts = sample("biaoqingbao_db_pool_timeouts_total", pool=label)
+        with engine.connect():
+            self.assertEqual(sample("biaoqingbao_db_pool_saturation", pool=label), 1)
+            with self.assertRaises(PoolTimeoutError):
+                engine.connect()
+        self.assertEqual(
+            sample("biaoqingbao_db_pool_timeouts_total", pool=label), timeouts + 1
+        )
+        self.assertEqual(sample("biaoqingbao_db_pool_saturation", pool=label), 0)
+
+    def test_separate_port(self):
+        with mock.patch.object(configs, "METRICS_PORT", 9100):
+            app = create_app()
+        self.assertEqual(app.test_client().get("/metrics").status_code, 404)
+
+    def test_disabled(self):
+        with mock.patch.object(configs, "METRICS", False):
+            app = create_app()
+        self.assertEqual(app.test_client().get("/metrics").status_code, 404)
+
+    def test_multiprocess(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=tmpdir)
+            result = subprocess.run(
+                [sys.executable, "-c", MULTIPROCESS_SCRIPT],
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        self.assertIn(
+            'biaoqingbao_requests_total{endpoint="bp_main.show_images",'
+            'method="GET",status="401"} 2.0',
+            result.stdout,
+        )
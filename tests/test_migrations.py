@@ -0,0 +1,228 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from click.testing import CliRunner
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Group, Image, SchemaMigration, Tag, User, cli, db
+from biaoqingbao.migrations import MIGRATIONS, upgrade
+from biaoqingbao.tagsearch import TRIGRAM_INDEX
+from tests import create_login_client, test_app
+
+HOT_PATH_INDEXES = [
+    "ix_image_user_id_is_deleted_create_at",
+    "ix_image_group_id_create_at",
+    "ix_image_deleted_at",
+    "ix_group_user_id_create_at",
+    "ix_tag_user_id_image_id",
+    "ix_tag_image_id",
+    "ix_passcode_user_id_create_at",
+]
+
+
+def index_names():
+    rows = db.session.execute(
+        db.text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")
+    )
+    return {name for name, in rows}
+
+
+class TestMigrate(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_fresh_database(self):
+        """create_all 已创建与迁移相同的索引，迁移不做修改。"""
+        with test_app.app_context():
+            before = index_names()
+            self.assertEqual(upgrade(), MIGRATIONS)
+            self.assertEqual(index_names(), before)
+            self.assertEqual(upgrade(), [])
+            self.assertEqual(SchemaMigration.query.count(), len(MIGRATIONS))
+
+    def test_old_database(self):
+        with test_app.app_context():
+            for name in HOT_PATH_INDEXES:
+                db.session.execute(db.text(f"DROP INDEX {name}"))
+            db.session.execute(db.text("ALTER TABLE image DROP COLUMN deleted_at"))
+            db.session.execute(
+                db.text(
+                    "CREATE INDEX ix_image_user_id_create_at"
+                    " ON image (user_id, create_at, id)"
+                )
+            )
+            db.session.commit()
+
+        runner = CliRunner()
+        result = runner.invoke(cli, ["migrate"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn(f"Applied {len(MIGRATIONS)} migrations.", result.output)
+
+        with test_app.app_context():
+            names = index_names()
+            for name in HOT_PATH_INDEXES:
+                self.assertIn(name, names)
+            self.assertNotIn("ix_image_user_id_create_at", names)
+            invalid = db.session.execute(
+                db.text("SELECT count(*) FROM pg_index WHERE NOT indisvalid")
+            ).scalar()
+            self.assertEqual(invalid, 0)
+            self.assertEqual(Image.query.filter(Image.deleted_at != None).count(), 0)
+
+    def test_trigram_index(self):
+        with test_app.app_context():
+            available = db.session.execute(
+                db.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+            ).scalar()
+            if not available:
+                self.skipTest("pg_trgm is not available")
+            # 升级前创建的数据库没有此索引
+            db.session.execute(db.text(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX}"))
+            db.session.commit()
+            upgrade()
+            self.assertIn(TRIGRAM_INDEX, index_names())
+
+    def test_target(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ["migrate", "--to", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        result = runner.invoke(cli, ["show-migrations"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("1 add_columns applied", result.output)
+        self.assertIn("2 add_hot_path_indexes pending", result.output)
+
+
+def scans(plan):
+    """查询计划（EXPLAIN FORMAT JSON）中各节点的 (Node Type, Relation Name)。"""
+    if isinstance(plan, list):
+        for item in plan:
+            yield from scans(item)
+    elif isinstance(plan, dict):
+        if "Node Type" in plan:
+            yield plan["Node Type"], plan.get("Relation Name")
+        for value in plan.values():
+            yield from scans(value)
+
+
+class TestHotPathIndexes(unittest.TestCase):
+    """热点查询使用迁移创建的索引。
+
+    测试数据很少，关闭顺序扫描后检查查询计划。
+    """
+
+    def setUp(self):
+        test_app.extensions["tag_index_cache"].clear()
+        with test_app.app_context():
+            db.create_all()
+            now = datetime.now()
+            users = []
+            for u in range(2):
+                user = User(
+                    email=f"{u}@foo.com",
+                    password=generate_password_hash("password1"),
+                )
+                group = Group(name="testGroup")
+                user.groups = [group]
+                for i in range(20):
+                    image = Image(
+                        data=b"fake binary data",
+                        type="jpeg",
+                        group=group if i % 2 else None,
+                        is_deleted=i % 5 == 0,
+                        deleted_at=now if i % 5 == 0 else None,
+                        create_at=now - timedelta(minutes=i),
+                    )
+                    image.tags = [Tag(text=f"tag{i % 3}", user=user)]
+                    user.images.append(image)
+                users.append(user)
+            db.session.add_all(users)
+            db.session.commit()
+
+            engine = db.engine
+        self.statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            self.statements.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", capture)
+        self.addCleanup(event.remove, engine, "before_cursor_execute", capture)
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def plans(self, url, table):
+        """请求 url，返回其中查询 table 的语句的查询计划。"""
+        client = create_login_client(user_id=1)
+        self.statements.clear()
+        resp = client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        statements = [
+            (s, p)
+            for s, p in self.statements
+            if s.lstrip().startswith("SELECT") and f"FROM {table}" in s
+        ]
+        self.assertTrue(statements, url)
+
+        plans = []
+        with test_app.app_context(), db.engine.connect() as conn:
+            raw = conn.connection.cursor()
+            raw.execute("SET enable_seqscan = off")
+            for statement, parameters in statements:
+                raw.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+                plans.append(json.dumps(raw.fetchone()[0]))
+            raw.execute("RESET enable_seqscan")
+        return plans
+
+    def assertUsesIndex(self, url, table, index):
+        plans = self.plans(url, table)
+        self.assertTrue(any(index in plan for plan in plans), plans)
+
+    def test_images(self):
+        self.assertUsesIndex(
+            "/api/images/", "image", "ix_image_user_id_is_deleted_create_at"
+        )
+
+    def test_images_by_cursor(self):
+        self.assertUsesIndex(
+            "/api/images/?cursor=&per_page=5",
+            "image",
+            "ix_image_user_id_is_deleted_create_at",
+        )
+
+    def test_recycle_bin(self):
+        self.assertUsesIndex(
+            "/api/images/?groupId=-1", "image", "ix_image_user_id_is_deleted_create_at"
+        )
+
+    def test_group_images(self):
+        self.assertUsesIndex(
+            "/api/images/?groupId=1", "image", "ix_image_group_id_create_at"
+        )
+
+    def test_tag_search(self):
+        # 按 tag.id 还是 tag.image_id 查找由查询计划器决定，只检查 tag 表不是顺序扫描
+        with test_app.app_context():
+            indexed = db.session.execute(
+                db.text("SELECT 1 FROM pg_indexes WHERE indexname = 'ix_tag_image_id'")
+            ).scalar()
+        self.assertTrue(indexed)
+        for plan in self.plans("/api/images/?tag=tag1", "image"):
+            nodes = list(scans(json.loads(plan)))
+            self.assertIn("tag", [relation for _, relation in nodes], plan)
+            self.assertNotIn(("Seq Scan", "tag"), nodes, plan)
+
+    def test_tags(self):
+        self.assertUsesIndex("/api/tags/", "tag", "ix_tag_user_id_image_id")
+        self.assertUsesIndex("/api/tags/?image_id=2", "tag", "ix_tag_user_id_image_id")
+
+    def test_groups(self):
+        self.assertUsesIndex("/api/groups/", '"group"', "ix_group_user_id_create_at")
@@ -0,0 +1,120 @@
+import threading
+import unittest
+from unittest import mock
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from biaoqingbao import User, db
+from biaoqingbao.passwords import HasherBusy, PasswordHasher
+from tests import test_app
+from tests.test_metrics import prometheus_client, sample
+
+
+class TestPasswordHasher(unittest.TestCase):
+    def block(self, hasher):
+        """占用唯一的 worker，直到 release 被设置。"""
+        release = threading.Event()
+        started = threading.Event()
+
+        def wait():
+            started.set()
+            release.wait(10)
+
+        thread = threading.Thread(target=hasher.run, args=(wait,))
+        thread.start()
+        started.wait(10)
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        return release
+
+    def test_queue_full(self):
+        hasher = PasswordHasher(workers=1, queue_size=0, timeout=5)
+        self.block(hasher)
+        rejected = sample(
+            "biaoqingbao_password_hash_rejected_total", reason="queue_full"
+        )
+        with self.assertRaises(HasherBusy):
+            hasher.run(generate_password_hash, "password1")
+        self.assertEqual(hasher.stats.rejected, 1)
+        if prometheus_client is not None:
+            self.assertEqual(
+                sample("biaoqingbao_password_hash_rejected_total", reason="queue_full"),
+                rejected + 1,
+            )
+
+    def test_timeout(self):
+        hasher = PasswordHasher(workers=1, queue_size=1, timeout=0.1)
+        self.block(hasher)
+        rejected = sample("biaoqingbao_password_hash_rejected_total", reason="timeout")
+        with self.assertRaises(HasherBusy):
+            hasher.run(generate_password_hash, "password1")
+        if prometheus_client is not None:
+            # 占用 worker 的调用也可能超时
+            self.assertGreaterEqual(
+                sample("biaoqingbao_password_hash_rejected_total", reason="timeout"),
+                rejected + 1,
+            )
+
+    def test_queue_time(self):
+        hasher = PasswordHasher(workers=1, queue_size=1, timeout=5)
+        release = self.block(hasher)
+        queued = sample("biaoqingbao_password_hash_queue_seconds_bucket", le="0.1")
+        count = sample("biaoqingbao_password_hash_queue_seconds_count")
+        threading.Timer(0.2, release.set).start()
+        self.assertTrue(hasher.run(str.isdigit, "1"))
+        self.assertEqual(hasher.stats.count, 2)
+        self.assertGreaterEqual(hasher.stats.max_queue_seconds, 0.1)
+        if prometheus_client is not None:
+            self.assertEqual(
+                sample("biaoqingbao_password_hash_queue_seconds_count"), count + 2
+            )
+            # 排队的一次超过 0.1 秒
+            self.assertLessEqual(
+                sample("biaoqingbao_password_hash_queue_seconds_bucket", le="0.1"),
+                queued + 1,
+            )
+
+
+class TestRehash(unittest.TestCase):
+    url = "/api/login"
+
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1", "pbkdf2:sha256:1000"),
+            )
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def login(self):
+        client = test_app.test_client()
+        return client.post(
+            self.url, json={"email": "1@foo.com", "password": "password1"}
+        )
+
+    def test_rehash_on_login(self):
+        resp = self.login()
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("hash-queue;dur=", resp.headers["Server-Timing"])
+        with test_app.app_context():
+            pwhash = User.query.get(1).password
+        self.assertTrue(pwhash.startswith("pbkdf2:sha256:260000$"))
+        self.assertTrue(check_password_hash(pwhash, "password1"))
+
+        self.assertEqual(self.login().status_code, 200)
+        with test_app.app_context():
+            self.assertEqual(User.query.get(1).password, pwhash)
+
+    def test_busy(self):
+        hasher = PasswordHasher(workers=1, queue_size=0, timeout=5)
+        release = TestPasswordHasher.block(self, hasher)
+        with mock.patch.dict(test_app.extensions, {"password_hasher": hasher}):
+            resp = self.login()
+        self.assertEqual(resp.status_code, 503)
+        self.assertIn("error", resp.get_json())
@@ -0,0 +1,126 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from click.testing import CliRunner
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Image, PurgeJob, Tag, User, cli, db
+from biaoqingbao.purge import create_purge_job, purge_chunk, wait_pending
+from tests import create_login_client, test_app
+
+
+class TestPurgeJob(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            for i in range(5):
+                user.images.append(
+                    Image(
+                        data=b"fake binary data",
+                        type="jpeg",
+                        tags=[Tag(text="aTag", user=user)],
+                        is_deleted=True,
+                        deleted_at=datetime.utcnow(),
+                    )
+                )
+            user.images.append(Image(data=b"fake binary data", type="jpeg"))
+            db.session.add(user)
+            db.session.commit()
+        patcher = mock.patch.dict(test_app.config, {"PURGE_CHUNK_SIZE": 2})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_chunked(self):
+        client = create_login_client(user_id=1)
+        job_id = client.post("/api/clearRecycleBin").get_json()["job_id"]
+        self.assertTrue(wait_pending(timeout=30))
+        resp = client.get(f"/api/clearRecycleBin/{job_id}")
+        self.assertEqual(resp.get_json()["purged"], 5)
+        with test_app.app_context():
+            self.assertEqual(Image.query.count(), 1)
+            self.assertEqual(Tag.query.count(), 0)
+
+    def test_other_users_job(self):
+        with test_app.app_context():
+            db.session.add(
+                User(email="2@foo.com", password=generate_password_hash("password2"))
+            )
+            job = create_purge_job(user_id=1)
+            db.session.commit()
+            job_id = job.id
+        client = create_login_client(user_id=2)
+        resp = client.get(f"/api/clearRecycleBin/{job_id}")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_resume(self):
+        with test_app.app_context():
+            job = create_purge_job(user_id=1)
+            self.assertIs(create_purge_job(user_id=1), job)
+            db.session.commit()
+            # 只删除一批后中断
+            purge_chunk(job.user_id, job.deleted_before)
+            db.session.commit()
+
+            # 创建任务后移入回收站的图片不删除
+            image = Image.query.filter_by(is_deleted=False).one()
+            image.is_deleted = True
+            image.deleted_at = datetime.utcnow()
+            db.session.commit()
+
+        result = CliRunner().invoke(cli, ["purge-recycle-bin"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Finished 1 purge jobs.", result.output)
+        with test_app.app_context():
+            self.assertEqual(PurgeJob.query.one().status, "done")
+            self.assertEqual(Image.query.count(), 1)
+
+
+class TestPurgeExpired(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            for days in [10, 1, None]:
+                deleted_at = days and datetime.utcnow() - timedelta(days=days)
+                user.images.append(
+                    Image(
+                        data=b"fake binary data",
+                        type="jpeg",
+                        is_deleted=True,
+                        deleted_at=deleted_at,
+                    )
+                )
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_purge_expired(self):
+        result = CliRunner().invoke(cli, ["purge-recycle-bin", "--days", "7"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Purged 1 expired images.", result.output)
+        with test_app.app_context():
+            images = Image.query.order_by(Image.id).all()
+            self.assertEqual([img.id for img in images], [2, 3])
+            self.assertIsNotNone(images[1].deleted_at)
+
+    def test_no_policy(self):
+        result = CliRunner().invoke(cli, ["purge-recycle-bin"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertNotIn("expired", result.output)
+        with test_app.app_context():
+            self.assertEqual(Image.query.count(), 3)
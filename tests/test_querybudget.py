@@ -0,0 +1,126 @@
+import unittest
+
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Group, Image, Tag, User, create_app, db
+from biaoqingbao.querybudget import (
+    STATEMENTS_HEADER,
+    QueryBudgetExceeded,
+    query_budget,
+    unbudgeted,
+)
+from tests import create_login_client, test_app
+
+
+def select(n: int):
+    for i in range(n):
+        db.session.execute(db.text("SELECT :i"), {"i": i})
+
+
+def create_budget_app():
+    app = create_app()
+    app.config["TESTING"] = True
+
+    @app.route("/within")
+    @query_budget(2)
+    def within():
+        select(2)
+        return "ok"
+
+    @app.route("/exceed")
+    @query_budget(1)
+    def exceed():
+        db.session.execute(db.text("SELECT 1"))
+        db.session.execute(db.text("SELECT 2"))
+        return "ok"
+
+    @app.route("/n-plus-one")
+    def n_plus_one():
+        select(4)
+        return "ok"
+
+    @app.route("/periodic")
+    @query_budget(0)
+    def periodic():
+        with unbudgeted():
+            select(4)
+        return "ok"
+
+    return app
+
+
+class TestQueryBudget(unittest.TestCase):
+    def setUp(self):
+        self.client = create_budget_app().test_client()
+
+    def test_within_budget(self):
+        resp = self.client.get("/within")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers[STATEMENTS_HEADER], "2")
+
+    def test_exceed_budget(self):
+        with self.assertRaisesRegex(
+            QueryBudgetExceeded, "2 statements exceed budget 1"
+        ):
+            self.client.get("/exceed")
+
+    def test_n_plus_one(self):
+        with self.assertRaisesRegex(QueryBudgetExceeded, "N\\+1: executed 4 times"):
+            self.client.get("/n-plus-one")
+
+    def test_unbudgeted(self):
+        resp = self.client.get("/periodic")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers[STATEMENTS_HEADER], "0")
+
+
+class TestQueryCounts(unittest.TestCase):
+    """查询数量不随组、图片、标签的数量增加。"""
+
+    def setUp(self):
+        test_app.extensions["tag_index_cache"].clear()
+        with test_app.app_context():
+            db.create_all()
+            db.session.add(
+                User(email="1@foo.com", password=generate_password_hash("password1"))
+            )
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def add_data(self, n: int):
+        with test_app.app_context():
+            user = User.query.get(1)
+            for i in range(n):
+                group = Group(name=f"group{i}", user=user)
+                image = Image(data=b"fake binary data", type="jpeg", user=user)
+                image.group = group
+                image.tags = [
+                    Tag(text="aTag", user=user),
+                    Tag(text=f"tag{i}", user=user),
+                ]
+                db.session.add(image)
+            db.session.commit()
+
+    def statements(self, url: str) -> int:
+        client = create_login_client()
+        # 预热：标签索引等
+        client.get(url)
+        resp = client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return int(resp.headers[STATEMENTS_HEADER])
+
+    def test_scaling(self):
+        urls = [
+            "/api/groups/",
+            "/api/images/",
+            "/api/images/?tag=Tag&facets=1",
+            "/api/tags/?image_id=1",
+        ]
+        self.add_data(1)
+        few = [self.statements(url) for url in urls]
+        self.add_data(10)
+        many = [self.statements(url) for url in urls]
+        self.assertEqual(few, many)
@@ -0,0 +1,161 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from click.testing import CliRunner
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Passcode, RateLimit, User, cli, db
+from biaoqingbao.ratelimit import (
+    DatabaseRateLimiter,
+    MemoryRateLimiter,
+    SharedMemoryRateLimiter,
+    estimate_hits,
+    slide_window,
+)
+from tests import test_app
+
+
+def hit_many(limiter, n, results):
+    results.put(sum(limiter.hit("key", 10, 60) for _ in range(n)))
+
+
+class TestSlidingWindow(unittest.TestCase):
+    def test_slide(self):
+        self.assertEqual(slide_window(10, 3, 1, 605, 60), (10, 3, 1))
+        self.assertEqual(slide_window(10, 3, 1, 665, 60), (11, 0, 3))
+        self.assertEqual(slide_window(10, 3, 1, 725, 60), (12, 0, 0))
+
+    def test_estimate(self):
+        self.assertEqual(estimate_hits(2, 4, 615, 60), 2 + 4 * 0.75)
+
+
+class RateLimiterTests:
+    def create_limiter(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.limiter = self.create_limiter()
+
+    def test_limit(self):
+        results = [self.limiter.hit("a", 3, 60) for _ in range(5)]
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertTrue(self.limiter.hit("b", 3, 60))
+
+    def test_window(self):
+        self.assertTrue(self.limiter.hit("a", 1, 1))
+        self.assertFalse(self.limiter.hit("a", 1, 1))
+        time.sleep(2.1)
+        self.assertTrue(self.limiter.hit("a", 1, 1))
+
+    def test_clear(self):
+        self.assertTrue(self.limiter.hit("a", 1, 60))
+        self.limiter.clear()
+        self.assertTrue(self.limiter.hit("a", 1, 60))
+
+
+class TestMemoryRateLimiter(RateLimiterTests, unittest.TestCase):
+    def create_limiter(self):
+        return MemoryRateLimiter()
+
+
+class TestSharedMemoryRateLimiter(RateLimiterTests, unittest.TestCase):
+    def create_limiter(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+        return SharedMemoryRateLimiter(self.path, slots=64)
+
+    def test_shared_between_processes(self):
+        ctx = multiprocessing.get_context("fork")
+        results = ctx.Queue()
+        processes = [
+            ctx.Process(target=hit_many, args=(self.limiter, 8, results))
+            for _ in range(3)
+        ]
+        for p in processes:
+            p.start()
+        allowed = sum(results.get(timeout=30) for _ in processes)
+        for p in processes:
+            p.join()
+        self.assertEqual(allowed, 10)
+
+    def test_collision_after_expired_slot(self):
+        # 两个 key 的探测序列起点相同，a 先占第一个位置，b 在第二个位置
+        hashes = {("a", 1): 1, ("b", 60): 1 + 64}
+        with mock.patch.object(
+            SharedMemoryRateLimiter, "_hash", side_effect=lambda k, w: hashes[k, w]
+        ), mock.patch("time.time") as now:
+            now.return_value = 1000.0
+            self.assertTrue(self.limiter.hit("a", 1, 1))
+            self.assertTrue(self.limiter.hit("b", 1, 60))
+            # a 的位置过期后，b 仍使用原来的计数
+            now.return_value = 1003.0
+            self.assertFalse(self.limiter.hit("b", 1, 60))
+            self.assertTrue(self.limiter.hit("a", 1, 1))
+            self.assertFalse(self.limiter.hit("b", 1, 60))
+
+    def test_table_full(self):
+        for i in range(200):
+            self.limiter.hit(f"key{i}", 1, 60)
+        self.assertFalse(self.limiter.hit("key199", 1, 60))
+
+
+class TestDatabaseRateLimiter(RateLimiterTests, unittest.TestCase):
+    def create_limiter(self):
+        ctx = test_app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+        db.create_all()
+        self.addCleanup(db.drop_all)
+        return DatabaseRateLimiter()
+
+
+class TestPurgeExpired(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(email="1@foo.com", password=generate_password_hash("password1"))
+            user.passcodes = [
+                Passcode(content="1234"),
+                Passcode(content="2234", create_at=datetime.now() - timedelta(0, 601)),
+            ]
+            db.session.add(user)
+            db.session.add_all(
+                [
+                    RateLimit(
+                        key="a",
+                        bucket=0,
+                        curr=1,
+                        prev=0,
+                        expire_at=datetime.utcnow() - timedelta(seconds=1),
+                    ),
+                    RateLimit(
+                        key="b",
+                        bucket=0,
+                        curr=1,
+                        prev=0,
+                        expire_at=datetime.utcnow() + timedelta(seconds=60),
+                    ),
+                ]
+            )
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_purge(self):
+        result = CliRunner().invoke(cli, ["purge-expired"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn(
+            "Deleted 1 passcodes, 0 reset attempts and 1 rate limit counters.",
+            result.output,
+        )
+        with test_app.app_context():
+            self.assertEqual([p.content for p in Passcode.query], ["1234"])
+            self.assertEqual([r.key for r in RateLimit.query], ["b"])
@@ -0,0 +1,121 @@
+import json
+import tempfile
+import unittest
+from concurrent.futures import Future
+from io import BytesIO
+
+from click.testing import CliRunner
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Blob, Image, Rendition, User, cli, db
+from biaoqingbao.renditions import PIL, THUMBNAIL, save_thumbnail, wait_pending
+from biaoqingbao.storage import LocalBlobStore, put_blob
+from tests import create_login_client, test_app
+
+
+def make_image(format, size=(800, 600)):
+    im = PIL.Image.new("RGB", size, (255, 0, 0))
+    out = BytesIO()
+    im.save(out, format=format)
+    return out.getvalue()
+
+
+@unittest.skipIf(PIL is None, "Pillow is not installed")
+class TestThumbnail(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_generate_on_upload(self):
+        client = create_login_client(user_id=1)
+        resp = client.post(
+            "/api/images/add",
+            data={
+                "image": (BytesIO(make_image("GIF")), "test_image.gif"),
+                "metadata": json.dumps({"type": "gif"}),
+            },
+        )
+        self.assertEqual(resp.status_code, 200)
+        image_id = resp.get_json()["id"]
+        self.assertTrue(wait_pending(timeout=30))
+
+        resp = client.get("/api/images/")
+        self.assertEqual(
+            resp.get_json()["data"][0]["thumbnail_url"],
+            f"/api/images/{image_id}/thumbnail",
+        )
+        resp = client.get(f"/api/images/{image_id}/thumbnail")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "image/webp")
+        self.assertTrue(resp.cache_control.private)
+        self.assertFalse(resp.cache_control.public)
+        with PIL.Image.open(BytesIO(resp.data)) as im:
+            self.assertEqual(im.size, (256, 192))
+
+        # 缩略图随原图一起删除
+        client.post("/api/images/permanentDelete", json={"id": image_id})
+        with test_app.app_context():
+            self.assertEqual(Rendition.query.count(), 0)
+            self.assertEqual(Blob.query.count(), 0)
+
+    def test_redirect_before_generated(self):
+        with test_app.app_context():
+            image = Image(hash=put_blob(make_image("PNG")), type="png", user_id=1)
+            db.session.add(image)
+            db.session.commit()
+
+        client = create_login_client(user_id=1)
+        resp = client.get("/api/images/1/thumbnail")
+        self.assertEqual(resp.status_code, 302)
+        self.assertTrue(resp.location.endswith("/api/images/1"))
+
+    def test_save_existing(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        store = LocalBlobStore(tmpdir.name)
+        default_store = test_app.extensions["blob_store"]
+        test_app.extensions["blob_store"] = store
+        self.addCleanup(test_app.extensions.__setitem__, "blob_store", default_store)
+        with test_app.app_context():
+            source_hash = put_blob(make_image("PNG"))
+            db.session.add(
+                Rendition(
+                    source_hash=source_hash,
+                    name=THUMBNAIL,
+                    hash=put_blob(b"thumbnail"),
+                    type="webp",
+                )
+            )
+            db.session.commit()
+            keys = {hash for hash, in db.session.query(Blob.hash)}
+
+            # 其它进程已生成缩略图，新写入的文件随回滚删除
+            future = Future()
+            future.set_result((b"another thumbnail", "webp"))
+            save_thumbnail(source_hash, future)
+            self.assertEqual(Rendition.query.count(), 1)
+        files = {path.name for path in store.root.glob("*/*/*")}
+        self.assertEqual(files, keys)
+
+    def test_backfill(self):
+        with test_app.app_context():
+            for data in [make_image("PNG"), make_image("JPEG"), b"not an image"]:
+                image = Image(hash=put_blob(data), type="png", user_id=1)
+                db.session.add(image)
+            db.session.commit()
+
+        runner = CliRunner()
+        result = runner.invoke(cli, ["backfill-renditions", "--workers", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with test_app.app_context():
+            self.assertEqual(Rendition.query.count(), 2)
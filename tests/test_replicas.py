@@ -0,0 +1,121 @@
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Group, User, create_app, db, generate_token
+from biaoqingbao.configs import configs
+from biaoqingbao.replicas import WRITE_COOKIE
+
+# 测试用的第二个本地数据库，代替从库
+REPLICA_URI = str(
+    make_url(configs.SQLALCHEMY_DATABASE_URI).set(database="biaoqingbao_replica")
+)
+
+
+def create_replica_database():
+    engine = create_engine(
+        configs.SQLALCHEMY_DATABASE_URI, isolation_level="AUTOCOMMIT"
+    )
+    with engine.connect() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM pg_database WHERE datname = 'biaoqingbao_replica'")
+        ).scalar()
+        if not exists:
+            conn.execute(text("CREATE DATABASE biaoqingbao_replica"))
+    engine.dispose()
+
+
+def create_user(group_name):
+    user = User(email="1@foo.com", password=generate_password_hash("password1"))
+    user.groups = [Group(name=group_name)]
+    return user
+
+
+class TestReplicaRouting(unittest.TestCase):
+    replica_uri = REPLICA_URI
+
+    @classmethod
+    def setUpClass(cls):
+        create_replica_database()
+
+    def setUp(self):
+        with mock.patch.object(configs, "DATABASE_REPLICA_URIS", [self.replica_uri]):
+            self.app = create_app()
+        self.app.config["TESTING"] = True
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(create_user("primary group"))
+            db.session.commit()
+            self.replica = self.app.extensions["replicas"].engines[0]
+            if self.replica_uri == REPLICA_URI:
+                # 从库的数据与主库不同，以便区分查询发往何处
+                db.metadata.create_all(self.replica)
+                with self.replica.begin() as conn:
+                    conn.execute(
+                        db.insert(User).values(
+                            email="1@foo.com",
+                            password=generate_password_hash("password1"),
+                        )
+                    )
+                    conn.execute(
+                        db.insert(Group).values(name="replica group", user_id=1)
+                    )
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            if self.replica_uri == REPLICA_URI:
+                db.metadata.drop_all(self.replica)
+            db.engine.dispose()
+        self.replica.dispose()
+
+    def client(self):
+        client = self.app.test_client()
+        client.set_cookie("localhost", "token", generate_token({"user_id": 1}))
+        return client
+
+    def group_names(self, client):
+        resp = client.get("/api/groups/")
+        self.assertEqual(resp.status_code, 200)
+        return [g["name"] for g in resp.get_json()["data"]]
+
+    def test_read_from_replica(self):
+        self.assertIn("replica group", self.group_names(self.client()))
+
+    def test_read_your_writes(self):
+        client = self.client()
+        resp = client.post("/api/groups/add", json={"name": "new group"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(WRITE_COOKIE, resp.headers["Set-Cookie"])
+
+        names = self.group_names(client)
+        self.assertIn("primary group", names)
+        self.assertIn("new group", names)
+
+        # 其它客户端仍读从库
+        self.assertIn("replica group", self.group_names(self.client()))
+
+    def test_write_endpoint_uses_primary(self):
+        resp = self.client().post(
+            "/api/groups/update", json={"id": 1, "name": "renamed"}
+        )
+        self.assertEqual(resp.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(Group.query.get(1).name, "renamed")
+
+
+class TestReplicaFallback(TestReplicaRouting):
+    # 无法连接的从库
+    replica_uri = str(make_url(REPLICA_URI).set(port=1))
+
+    test_read_from_replica = None
+    test_read_your_writes = None
+
+    def test_fallback_to_primary(self):
+        self.assertIn("primary group", self.group_names(self.client()))
+        replicas = self.app.extensions["replicas"]
+        self.assertFalse(replicas.is_healthy(self.replica))
@@ -0,0 +1,59 @@
+import unittest
+
+from click.testing import CliRunner
+
+from biaoqingbao import Blob, Group, Image, Tag, User, cli, db
+from biaoqingbao.seed import seed_corpus
+from tests import test_app
+
+
+class TestSeed(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_seed(self):
+        with test_app.app_context():
+            user_ids = seed_corpus(
+                users=2, images=120, groups=3, tags=2, blobs=5, blob_kb=1, batch_size=50
+            )
+            self.assertEqual(len(user_ids), 2)
+            self.assertEqual(Image.query.count(), 240)
+            self.assertEqual(Group.query.count(), 6)
+            self.assertGreater(Tag.query.count(), 0)
+
+            # 计数与 image 表一致
+            user = User.query.get(user_ids[0])
+            self.assertEqual(
+                user.image_number,
+                Image.query.filter_by(user_id=user.id, is_deleted=False).count(),
+            )
+            # 引用计数与引用的图片数量一致
+            for blob in Blob.query.all():
+                self.assertEqual(
+                    blob.ref_count, Image.query.filter_by(hash=blob.hash).count()
+                )
+
+    def test_repeatable(self):
+        def summary(user_id):
+            return [
+                (image.hash, image.is_deleted, bool(image.group_id), len(image.tags))
+                for image in Image.query.filter_by(user_id=user_id).order_by(Image.id)
+            ]
+
+        with test_app.app_context():
+            (first,) = seed_corpus(images=30, groups=2, blobs=3, blob_kb=1)
+            (second,) = seed_corpus(images=30, groups=2, blobs=3, blob_kb=1)
+            self.assertEqual(summary(first), summary(second))
+
+    def test_cli(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            cli, ["seed", "--images", "10", "--blobs", "2", "--blob-kb", "1"]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Seeded users 1.", result.output)
@@ -0,0 +1,160 @@
+import socket
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from aiosmtpd.controller import Controller
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import OutboxEmail, User, db
+from biaoqingbao.services import (
+    SMTPSender,
+    deliver_pending_emails,
+    enqueue_email,
+    run_mail_worker,
+)
+from tests import test_app
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Handler:
+    """记录收到的邮件，拒绝发给 rejected@foo.com 的邮件。"""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == "rejected@foo.com":
+            return "550 no such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            db.session.add(
+                User(email="1@foo.com", password=generate_password_hash("password1"))
+            )
+            db.session.commit()
+
+        self.handler = Handler()
+        self.port = get_free_port()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=self.port)
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+        patcher = mock.patch.dict(
+            test_app.config,
+            {
+                "EMAIL_HOST": "127.0.0.1",
+                "EMAIL_PORT": self.port,
+                "EMAIL_USE_SSL": False,
+                "EMAIL_BATCH_SIZE": 3,
+            },
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def enqueue(self, *to_addrs):
+        with test_app.app_context():
+            for to in to_addrs:
+                enqueue_email(to, "测试邮件", "test test")
+            db.session.commit()
+
+    def test_reuse_connection(self):
+        self.enqueue(*[f"{i}@foo.com" for i in range(5)])
+        with test_app.app_context(), SMTPSender.from_config(test_app.config) as sender:
+            self.assertEqual(deliver_pending_emails(sender), 3)
+            self.assertEqual(deliver_pending_emails(sender), 2)
+            self.assertEqual(deliver_pending_emails(sender), 0)
+            self.assertEqual(sender.connections, 1)
+            statuses = {e.status for e in OutboxEmail.query}
+            self.assertEqual(statuses, {"sent"})
+        self.assertEqual(len(self.handler.messages), 5)
+        self.assertEqual(self.handler.sessions, 1)
+
+    def test_permanent_failure(self):
+        self.enqueue("rejected@foo.com", "1@foo.com")
+        with test_app.app_context(), SMTPSender.from_config(test_app.config) as sender:
+            deliver_pending_emails(sender)
+            emails = OutboxEmail.query.order_by(OutboxEmail.id).all()
+            self.assertEqual([e.status for e in emails], ["failed", "sent"])
+            self.assertIn("550", emails[0].last_error)
+
+    def unreachable_sender(self) -> SMTPSender:
+        sender = SMTPSender.from_config(test_app.config)
+        sender.port = get_free_port()
+        return sender
+
+    def test_retry_with_backoff(self):
+        self.enqueue("1@foo.com", "2@foo.com")
+        with test_app.app_context():
+            with self.unreachable_sender() as sender:
+                self.assertEqual(deliver_pending_emails(sender), 2)
+                # 未到重试时间
+                self.assertEqual(deliver_pending_emails(sender), 0)
+            email = OutboxEmail.query.first()
+            self.assertEqual(email.status, "pending")
+            self.assertEqual(email.attempts, 1)
+            delay = email.next_attempt_at - datetime.utcnow()
+            self.assertGreater(delay, timedelta(seconds=20))
+
+            OutboxEmail.query.update({OutboxEmail.next_attempt_at: datetime.utcnow()})
+            db.session.commit()
+            with SMTPSender.from_config(test_app.config) as sender:
+                self.assertEqual(deliver_pending_emails(sender), 2)
+            self.assertEqual(OutboxEmail.query.filter_by(status="sent").count(), 2)
+
+    def test_give_up(self):
+        self.enqueue("1@foo.com")
+        with mock.patch.dict(
+            test_app.config, {"EMAIL_MAX_ATTEMPTS": 2, "EMAIL_RETRY_DELAY": 0}
+        ), test_app.app_context(), self.unreachable_sender() as sender:
+            deliver_pending_emails(sender)
+            deliver_pending_emails(sender)
+            email = OutboxEmail.query.one()
+            self.assertEqual(email.status, "failed")
+            self.assertEqual(email.attempts, 2)
+
+    def test_worker_wakes_on_notify(self):
+        stop = threading.Event()
+        worker = threading.Thread(
+            target=run_mail_worker,
+            args=(test_app,),
+            kwargs={"poll_interval": 60, "stop": stop},
+        )
+        worker.start()
+        time.sleep(0.5)
+        self.enqueue("1@foo.com")
+        for _ in range(50):
+            if self.handler.messages:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(self.handler.messages), 1)
+
+        stop.set()
+        self.enqueue("2@foo.com")
+        worker.join(timeout=10)
+        self.assertFalse(worker.is_alive())
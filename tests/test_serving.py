@@ -0,0 +1,134 @@
+import http.client
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from click.testing import CliRunner
+from waitress import create_server
+
+from biaoqingbao import cli, serving
+from biaoqingbao.configs import configs
+from biaoqingbao.engine import pool_capacity
+from biaoqingbao.serving import gunicorn_options, waitress_options
+from tests import test_app
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class TestServingOptions(unittest.TestCase):
+    def test_waitress(self):
+        with mock.patch.object(serving, "cpu_count", return_value=2):
+            options = waitress_options(port=5001)
+        self.assertEqual(options["threads"], 2 * serving.THREADS_PER_CPU)
+        self.assertEqual(options["port"], 5001)
+        self.assertGreater(options["connection_limit"], options["threads"])
+        self.assertGreater(options["outbuf_overflow"], 1024 * 1024)
+
+        with mock.patch.object(serving, "cpu_count", return_value=2):
+            options = waitress_options(port=5001, max_threads=5)
+        self.assertEqual(options["threads"], 5)
+        # 显式指定的线程数不受 max_threads 限制
+        options = waitress_options(port=5001, threads=8, max_threads=5)
+        self.assertEqual(options["threads"], 8)
+
+        options = waitress_options(unix_socket="/tmp/bqb.sock", threads=3)
+        self.assertEqual(options["threads"], 3)
+        self.assertEqual(options["unix_socket"], "/tmp/bqb.sock")
+        self.assertNotIn("port", options)
+
+    def test_gunicorn(self):
+        options = gunicorn_options(workers=3, max_requests_jitter=50)
+        self.assertEqual(options["bind"], "127.0.0.1:5000")
+        self.assertEqual(options["worker_class"], "gthread")
+        self.assertEqual(options["workers"], 3)
+        self.assertTrue(options["preload_app"])
+        self.assertEqual(options["max_requests_jitter"], 50)
+
+        options = gunicorn_options(unix_socket="/tmp/bqb.sock")
+        self.assertEqual(options["bind"], "unix:/tmp/bqb.sock")
+        self.assertNotIn("when_ready", options)
+
+        options = gunicorn_options(metrics_port=9100)
+        self.assertIn("when_ready", options)
+        self.assertIs(options["child_exit"], serving.child_exit)
+
+    def test_prepare_metrics_dir(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            stale = os.path.join(tmpdir, "counter_123.db")
+            open(stale, "w").close()
+            with mock.patch.dict(os.environ, {serving.MULTIPROC_DIR_ENV: tmpdir}):
+                self.assertEqual(serving.prepare_metrics_dir(), tmpdir)
+            self.assertFalse(os.path.exists(stale))
+
+        with mock.patch.dict(os.environ):
+            os.environ.pop(serving.MULTIPROC_DIR_ENV, None)
+            path = serving.prepare_metrics_dir()
+            self.assertEqual(os.environ[serving.MULTIPROC_DIR_ENV], path)
+        os.rmdir(path)
+
+
+class TestRun(unittest.TestCase):
+    def test_waitress(self):
+        runner = CliRunner()
+        with mock.patch.object(serving, "serve") as serve:
+            result = runner.invoke(cli, ["run", "--port", "5001", "--threads", "6"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        _, kwargs = serve.call_args
+        self.assertEqual(kwargs["port"], 5001)
+        self.assertEqual(kwargs["threads"], 6)
+
+    def test_waitress_default_threads(self):
+        runner = CliRunner()
+        with mock.patch.object(serving, "serve") as serve, mock.patch.object(
+            serving, "cpu_count", return_value=8
+        ):
+            result = runner.invoke(cli, ["run"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        _, kwargs = serve.call_args
+        self.assertEqual(kwargs["threads"], pool_capacity(configs))
+
+    def test_waitress_metrics_port(self):
+        runner = CliRunner()
+        with mock.patch.object(serving, "serve"), mock.patch.object(
+            configs, "METRICS_PORT", 9100
+        ), mock.patch("biaoqingbao.metrics.start_metrics_server") as start:
+            result = runner.invoke(cli, ["run"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        start.assert_called_once_with("127.0.0.1", 9100)
+
+    def test_gunicorn_not_installed(self):
+        runner = CliRunner()
+        with mock.patch.object(serving, "BaseApplication", None):
+            result = runner.invoke(cli, ["run", "--server", "gunicorn"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("gunicorn is not installed", result.output)
+
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "bqb.sock")
+            server = create_server(
+                test_app, **waitress_options(unix_socket=path, threads=2)
+            )
+            thread = threading.Thread(target=server.run)
+            thread.start()
+            try:
+                conn = UnixHTTPConnection(path)
+                conn.request("GET", "/api/images/")
+                resp = conn.getresponse()
+                # 未登录
+                self.assertEqual(resp.status, 401)
+                conn.close()
+            finally:
+                server.close()
+                thread.join()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import tempfile
+import tracemalloc
+import unittest
+from io import BytesIO
+
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Blob, Image, User, db
+from biaoqingbao.purge import wait_pending as wait_purge_jobs
+from biaoqingbao.storage import (
+    DATABASE_CHUNK_SIZE,
+    LocalBlobStore,
+    get_blob_store,
+    put_blob,
+    put_blob_file,
+    remove_unreferenced,
+)
+from tests import create_login_client, test_app
+
+
+class TestLocalBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = LocalBlobStore(self.tmpdir.name)
+        self.default_store = test_app.extensions["blob_store"]
+        test_app.extensions["blob_store"] = self.store
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+        test_app.extensions["blob_store"] = self.default_store
+        self.tmpdir.cleanup()
+
+    def add_image(self, client, data):
+        resp = client.post(
+            "/api/images/add",
+            data={
+                "image": (BytesIO(data), "test_image.jpeg"),
+                "metadata": json.dumps({"type": "jpeg"}),
+            },
+        )
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_json()["id"]
+
+    def test_dedupe(self):
+        client = create_login_client(user_id=1)
+        id1 = self.add_image(client, b"same image data")
+        id2 = self.add_image(client, b"same image data")
+        with test_app.app_context():
+            blobs = Blob.query.all()
+            self.assertEqual(len(blobs), 1)
+            self.assertEqual(blobs[0].ref_count, 2)
+            self.assertIsNone(blobs[0].data)
+            self.assertEqual(Image.query.get(id1).hash, Image.query.get(id2).hash)
+            path = self.store.path(blobs[0].hash)
+        self.assertEqual(path.read_bytes(), b"same image data")
+
+        resp = client.get(f"/api/images/{id1}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, b"same image data")
+
+    def test_release(self):
+        client = create_login_client(user_id=1)
+        id1 = self.add_image(client, b"same image data")
+        id2 = self.add_image(client, b"same image data")
+        with test_app.app_context():
+            path = self.store.path(Image.query.get(id1).hash)
+
+        client.post("/api/images/permanentDelete", json={"id": id1})
+        with test_app.app_context():
+            self.assertEqual(Blob.query.one().ref_count, 1)
+        self.assertTrue(path.exists())
+
+        client.post("/api/images/delete", json={"id": id2})
+        client.post("/api/clearRecycleBin")
+        self.assertTrue(wait_purge_jobs(timeout=30))
+        with test_app.app_context():
+            self.assertEqual(Blob.query.all(), [])
+        self.assertFalse(path.exists())
+
+    def test_remove_on_rollback(self):
+        with test_app.app_context():
+            key = put_blob(b"image data")
+            self.assertTrue(self.store.path(key).exists())
+            db.session.rollback()
+        self.assertFalse(self.store.path(key).exists())
+
+    def test_keep_reuploaded(self):
+        # 删除 blob 的事务已提交、尚未删除文件时，其它事务重新上传了相同内容
+        data = b"image data"
+        key = hashlib.sha256(data).hexdigest()
+        self.store.write(key, BytesIO(data))
+        with test_app.app_context():
+            put_blob(data)
+            remove_unreferenced(db.engine, self.store, [key])
+            self.assertTrue(self.store.path(key).exists())
+            db.session.commit()
+            remove_unreferenced(db.engine, self.store, [key])
+        self.assertEqual(self.store.path(key).read_bytes(), data)
+
+    def test_remove_orphan(self):
+        data = b"image data"
+        key = hashlib.sha256(data).hexdigest()
+        self.store.write(key, BytesIO(data))
+        with test_app.app_context():
+            remove_unreferenced(db.engine, self.store, [key])
+        self.assertFalse(self.store.path(key).exists())
+
+
+class TestDatabaseBlobStore(unittest.TestCase):
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_write_in_chunks(self):
+        size = 16 * DATABASE_CHUNK_SIZE
+        with tempfile.TemporaryFile() as fh:
+            digest = hashlib.sha256()
+            for i in range(size // 4096):
+                block = i.to_bytes(4, "little") * 1024
+                digest.update(block)
+                fh.write(block)
+            fh.seek(0)
+            key = digest.hexdigest()
+            with test_app.app_context():
+                tracemalloc.start()
+                try:
+                    put_blob_file(fh, key, size)
+                    db.session.commit()
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                # 内存占用只与块大小有关，与内容大小无关
+                self.assertLess(peak, 8 * DATABASE_CHUNK_SIZE)
+                with get_blob_store().open(key) as stored:
+                    self.assertEqual(hashlib.sha256(stored.read()).hexdigest(), key)
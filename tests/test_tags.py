@@ -210,3 +210,47 @@ class TestUpdateTag(unittest.TestCase):
         self.assertEqual(resp.status_code, 403)
         json_data = resp.get_json()
         self.assertIn("error", json_data)
+
+
+class TestBatchAddTags(unittest.TestCase):
+    url = "/api/tags/batch/add"
+
+    def setUp(self):
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            user.images = [
+                Image(data=b"abcdefggggggg", type="jpeg"),
+                Image(
+                    data=b"abcdefggggggg",
+                    type="jpeg",
+                    tags=[Tag(text="addedTag", user=user)],
+                ),
+            ]
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def test_default(self):
+        client = create_login_client(user_id=1)
+        resp = client.post(self.url, json={"image_ids": [1, 2, 3], "text": "addedTag"})
+        self.assertEqual(resp.status_code, 200)
+        results = resp.get_json()["results"]
+        self.assertEqual([r["ok"] for r in results], [True, True, False])
+        with test_app.app_context():
+            tags = Tag.query.filter_by(text="addedTag").order_by(Tag.image_id).all()
+            self.assertEqual([t.image_id for t in tags], [1, 2])
+            self.assertEqual([r["tag_id"] for r in results[:2]], [t.id for t in tags])
+
+    def test_searchable(self):
+        client = create_login_client(user_id=1)
+        client.get("/api/images/", query_string={"tag": "newTag"})
+        client.post(self.url, json={"image_ids": [1, 2], "text": "newTag"})
+        resp = client.get("/api/images/", query_string={"tag": "newTag"})
+        self.assertEqual(len(resp.get_json()["data"]), 2)
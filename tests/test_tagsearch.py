@@ -0,0 +1,150 @@
+import unittest
+from unittest import mock
+
+from werkzeug.security import generate_password_hash
+
+from biaoqingbao import Image, Tag, User, db, tagsearch
+from biaoqingbao.tagsearch import (
+    TRIGRAM_INDEX,
+    NgramIndex,
+    get_backend,
+    tag_text_filter,
+)
+from tests import create_login_client, test_app
+
+
+class TestNgramIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = NgramIndex(
+            [(1, "aTag"), (2, "bTag"), (3, "猫猫表情"), (4, "Tagging"), (5, "a")]
+        )
+
+    def test_search(self):
+        self.assertEqual(sorted(self.index.search("Tag")), [1, 2, 4])
+        self.assertEqual(self.index.search("aTag"), [1])
+        self.assertEqual(self.index.search("猫表情"), [3])
+        self.assertEqual(self.index.search("xyz"), [])
+
+    def test_search_short_term(self):
+        self.assertEqual(sorted(self.index.search("a")), [1, 2, 4, 5])
+        self.assertEqual(self.index.search("猫猫"), [3])
+
+    def test_no_false_positive(self):
+        # 每个 3-gram 都存在，但不是子串
+        index = NgramIndex([(1, "abcxbcd")])
+        self.assertEqual(index.search("abcd"), [])
+
+
+class TestSearchAfterUpdate(unittest.TestCase):
+    def setUp(self):
+        # tag 表重建后 tag_version 从 0 开始，清除之前测试的标签索引
+        test_app.extensions["tag_index_cache"].clear()
+        with test_app.app_context():
+            db.create_all()
+            user = User(
+                email="1@foo.com",
+                password=generate_password_hash("password1"),
+            )
+            img = Image(
+                data=b"fake binary data",
+                type="jpeg",
+                tags=[Tag(text="aTag", user=user)],
+            )
+            user.images.append(img)
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def search(self, client, tag):
+        resp = client.get("/api/images/", query_string={"tag": tag})
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_json()["data"]
+
+    def test_rename_tag(self):
+        client = create_login_client(user_id=1)
+        self.assertEqual(len(self.search(client, "aTag")), 1)
+        client.post("/api/tags/update", json={"id": 1, "text": "renamed"})
+        self.assertEqual(len(self.search(client, "aTag")), 0)
+        self.assertEqual(len(self.search(client, "name")), 1)
+
+    def test_index_kept_without_tag_changes(self):
+        client = create_login_client(user_id=1)
+        self.search(client, "aTag")
+        cache = test_app.extensions["tag_index_cache"]
+        with test_app.app_context():
+            index = cache.get(1)
+        resp = client.post("/api/images/update", json={"id": 1, "group_id": None})
+        self.assertEqual(resp.status_code, 200)
+        client.post("/api/tags/delete", json={"id": 1})
+        with test_app.app_context():
+            self.assertIs(cache.get(1), index)
+        self.assertEqual(len(self.search(client, "aTag")), 0)
+
+    def test_add_tag(self):
+        client = create_login_client(user_id=1)
+        self.assertEqual(len(self.search(client, "new")), 0)
+        client.post("/api/tags/add", json={"image_id": 1, "text": "newTag"})
+        self.assertEqual(len(self.search(client, "new")), 1)
+
+
+class TestBackend(unittest.TestCase):
+    def setUp(self):
+        test_app.extensions["tag_index_cache"].clear()
+        with test_app.app_context():
+            db.create_all()
+        self.addCleanup(test_app.extensions.pop, "tag_search", None)
+
+    def tearDown(self):
+        with test_app.app_context():
+            db.drop_all()
+
+    def get_backend(self):
+        test_app.extensions.pop("tag_search", None)
+        with test_app.app_context():
+            return get_backend()
+
+    def test_auto_without_index(self):
+        # 已有的数据库安装了 pg_trgm 扩展，但还没有创建索引
+        with test_app.app_context():
+            db.session.execute(db.text(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX}"))
+            db.session.commit()
+        self.assertEqual(self.get_backend(), "ngram")
+
+    def test_auto_with_index(self):
+        with test_app.app_context():
+            indexed = db.session.execute(
+                db.text("SELECT 1 FROM pg_indexes WHERE indexname = :name"),
+                {"name": TRIGRAM_INDEX},
+            ).scalar()
+        if not indexed:
+            self.skipTest("pg_trgm is not available")
+        self.assertEqual(self.get_backend(), "trigram")
+
+    def test_ngram_filter_single_parameter(self):
+        test_app.extensions["tag_search"] = "ngram"
+        with test_app.app_context():
+            user = User(email="1@foo.com", password="")
+            image = Image(data=b"fake binary data", type="jpeg", user=user)
+            image.tags = [Tag(text=f"tag{i}", user=user) for i in range(100)]
+            db.session.add(image)
+            db.session.commit()
+            criterion = tag_text_filter(1, "tag")
+            self.assertEqual(len(criterion.compile().params), 1)
+            self.assertEqual(Tag.query.filter(criterion).count(), 100)
+
+    def test_ngram_filter_many_matches(self):
+        test_app.extensions["tag_search"] = "ngram"
+        with test_app.app_context():
+            user = User(email="1@foo.com", password="")
+            image = Image(data=b"fake binary data", type="jpeg", user=user)
+            image.tags = [Tag(text=f"tag{i}", user=user) for i in range(20)]
+            db.session.add(image)
+            db.session.commit()
+            with mock.patch.object(tagsearch, "MAX_INDEX_MATCHES", 10):
+                criterion = tag_text_filter(1, "tag")
+            # 匹配过多时使用 LIKE
+            self.assertIn("LIKE", str(criterion.compile()))
+            self.assertEqual(Tag.query.filter(criterion).count(), 20)
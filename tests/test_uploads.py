@@ -0,0 +1,24 @@
+import hashlib
+import unittest
+
+from biaoqingbao.uploads import UploadSpool
+
+
+class TestUploadSpool(unittest.TestCase):
+    def test_write_in_chunks(self):
+        data = b"GIF89a" + bytes(range(256)) * 100
+        spool = UploadSpool(max_memory_size=1024)
+        for i in range(0, len(data), 1000):
+            spool.write(data[i : i + 1000])
+        spool.seek(0)
+
+        self.assertEqual(spool.size, len(data))
+        self.assertEqual(spool.hash, hashlib.sha256(data).hexdigest())
+        self.assertEqual(spool.type, "gif")
+        self.assertTrue(spool._rolled)
+        self.assertEqual(spool.read(), data)
+
+    def test_unknown_type(self):
+        spool = UploadSpool(max_memory_size=1024)
+        spool.write(b"fake binary data")
+        self.assertIsNone(spool.type)
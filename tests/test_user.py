@@ -1,10 +1,11 @@
 import unittest
 from datetime import datetime, timedelta
-from unittest.mock import patch
+from unittest import mock
 
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from biaoqingbao import Passcode, ResetAttempt, User, db
+from biaoqingbao import OutboxEmail, Passcode, User, db
+from biaoqingbao.ratelimit import get_rate_limiter
 from tests import create_login_client, get_cookies, test_app
 
 
@@ -153,6 +154,7 @@ class TestSendPasscode(unittest.TestCase):
     def setUp(self):
         with test_app.app_context():
             db.create_all()
+            get_rate_limiter().clear()
             fake_records(1)
 
     def tearDown(self):
@@ -161,13 +163,27 @@ class TestSendPasscode(unittest.TestCase):
 
     def test_normal(self):
         with test_app.test_client() as client:
-            with patch("biaoqingbao.views.user.send_email") as mock_send_email:
-                resp = client.post(self.url, json=self.data)
-                mock_send_email.assert_called_once()
-
+            resp = client.post(self.url, json=self.data)
             self.assertEqual(resp.status_code, 200)
             json_data = resp.get_json()
             self.assertIn("msg", json_data)
+        with test_app.app_context():
+            email = OutboxEmail.query.one()
+            self.assertEqual(email.to_addrs, "1@foo.com")
+            self.assertEqual(email.status, "pending")
+            self.assertIn("请在 10 分钟内输入验证码", email.content)
+
+    def test_lifetime_in_content(self):
+        for lifetime, text in [(1800, "30 分钟"), (90, "90 秒")]:
+            with self.subTest(lifetime=lifetime), mock.patch.dict(
+                test_app.config, {"PASSCODE_LIFETIME": lifetime}
+            ):
+                with test_app.test_client() as client:
+                    resp = client.post(self.url, json=self.data)
+                    self.assertEqual(resp.status_code, 200)
+                with test_app.app_context():
+                    email = OutboxEmail.query.order_by(OutboxEmail.id.desc()).first()
+                    self.assertIn(f"请在 {text}内输入验证码", email.content)
 
     def test_user_not_exists(self):
         with test_app.test_client() as client:
@@ -177,28 +193,16 @@ class TestSendPasscode(unittest.TestCase):
             self.assertIn("msg", json_data)
 
     def test_send_passcode_too_frequently(self):
-        with test_app.app_context():
-            user = User(
-                email="2@foo.com",
-                password=generate_password_hash("password2"),
-            )
-            user.passcodes = [
-                Passcode(content="1234"),
-                Passcode(content="2234"),
-                Passcode(content="3234"),
-                Passcode(content="4234"),
-                Passcode(content="5234"),
-            ]
-            db.session.add(user)
-            db.session.commit()
         with test_app.test_client() as client:
-            with patch("biaoqingbao.views.user.send_email") as mock_send_email:
-                resp = client.post(self.url, json={"email": "2@foo.com"})
-                mock_send_email.assert_not_called()
-
+            for _ in range(5):
+                resp = client.post(self.url, json=self.data)
+                self.assertEqual(resp.status_code, 200)
+            resp = client.post(self.url, json=self.data)
             self.assertEqual(resp.status_code, 403)
             json_data = resp.get_json()
             self.assertIn("error", json_data)
+        with test_app.app_context():
+            self.assertEqual(OutboxEmail.query.count(), 5)
 
 
 class TestResetPassword(unittest.TestCase):
@@ -213,6 +217,7 @@ class TestResetPassword(unittest.TestCase):
     def setUp(self):
         with test_app.app_context():
             db.create_all()
+            get_rate_limiter().clear()
             user = User(
                 email="1@foo.com",
                 password=generate_password_hash("password1"),
@@ -272,24 +277,14 @@ class TestResetPassword(unittest.TestCase):
             self.assertIn("error", json_data)
 
     def test_reset_too_frequently(self):
-        with test_app.app_context():
-            user = User(
-                email="2@foo.com",
-                password=generate_password_hash("password2"),
-            )
-            user.reset_attempts = [
-                ResetAttempt(),
-                ResetAttempt(),
-                ResetAttempt(),
-                ResetAttempt(),
-                ResetAttempt(),
-            ]
-            db.session.add(user)
-            db.session.commit()
         with test_app.test_client() as client:
             body = self.data.copy()
-            body["email"] = "2@foo.com"
-            resp = client.post(self.url, json=body)
+            body["passcode"] = "1235"
+            for _ in range(5):
+                resp = client.post(self.url, json=body)
+                self.assertEqual(resp.json["error"], "验证码错误")
+            # 验证码正确也不能再尝试
+            resp = client.post(self.url, json=self.data)
             self.assertEqual(resp.status_code, 403)
             json_data = resp.get_json()
-            self.assertIn("error", json_data)
+            self.assertEqual(json_data["error"], "重置尝试次数过于频繁")